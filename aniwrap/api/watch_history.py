@@ -1,9 +1,12 @@
 from typing import Annotated, Literal
 
-from cattrs import unstructure
 from fastapi import APIRouter, Depends, Query
+from fastapi.responses import Response, StreamingResponse
 
+from aniwrap.metrics import timed
+from aniwrap.serialization import dumps, iter_media_list_collection
 from aniwrap.service.watch_history.anilist import AnilistWatchHistoryService
+from aniwrap.service.watch_history.mal import MalWatchHistoryService
 
 router = APIRouter(prefix="/watched")
 
@@ -17,7 +20,22 @@ async def get_watch_history(
     username: Annotated[
         str, Query(description="The user's username on the specified platform")
     ],
-    watch_history_service: Annotated[AnilistWatchHistoryService, Depends()],
-) -> dict:
+    anilist_watch_history: Annotated[AnilistWatchHistoryService, Depends()],
+    mal_watch_history: Annotated[MalWatchHistoryService, Depends()],
+    stream: Annotated[
+        bool,
+        Query(description="Send the response in chunks, one list at a time"),
+    ] = False,
+) -> Response:
+    watch_history_service = (
+        mal_watch_history if provider == "mal" else anilist_watch_history
+    )
     o = await watch_history_service.get_watch_history(username)
-    return unstructure(o)
+    if stream:
+        # a sync iterator, so starlette serializes the lists in its threadpool
+        return StreamingResponse(
+            iter_media_list_collection(o), media_type="application/json"
+        )
+    with timed("serialize"):
+        content = dumps(o)
+    return Response(content, media_type="application/json")
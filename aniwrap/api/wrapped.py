@@ -1,26 +1,94 @@
+from datetime import date
 from typing import Annotated, Literal
 
-from fastapi import APIRouter, Depends, Query
+from fastapi import APIRouter, Body, Depends, HTTPException, Query
+from fastapi.responses import Response
 
-from aniwrap.service.stats import StatisticsService
-from aniwrap.service.watch_history.anilist import AnilistWatchHistoryService
-from aniwrap.types.dto import CalculatedStats
+from aniwrap.config import AniwrapConfig, get_config
+from aniwrap.db.models import ProviderType
+from aniwrap.service.wrapped import WrappedService
+from aniwrap.types.dto import (
+    BatchStats,
+    BatchWrappedRequest,
+    CalculatedStats,
+    YearlyStats,
+)
 
 router = APIRouter(prefix="/wrapped")
 
 
 Provider = Literal["mal", "anilist"]
 
+# earliest year /wrapped/years takes; well before any tracking site's entries
+MIN_YEAR = 1900
 
-@router.get("/")
+
+# The response is built with model_construct, so it's returned already serialized;
+# response_model only documents it (FastAPI would otherwise validate it all again).
+@router.get("/", response_model=CalculatedStats)
 async def get_wrapped(
     provider: Annotated[Provider, Query(description="The anime tracking provider")],
     username: Annotated[
         str, Query(description="The user's username on the specified platform")
     ],
-    watch_history_service: Annotated[AnilistWatchHistoryService, Depends()],
-    stats: Annotated[StatisticsService, Depends()],
-) -> CalculatedStats:
-    data = await watch_history_service.get_watch_history(username=username)
-    df = stats.make_dataframe_from_anilist(data)
-    return stats.calculate_stats(df)
+    wrapped_service: Annotated[WrappedService, Depends()],
+) -> Response:
+    content = await wrapped_service.get_wrapped_json(ProviderType(provider), username)
+    return Response(content, media_type="application/json")
+
+
+@router.get("/years", response_model=YearlyStats)
+async def get_yearly_wrapped(
+    provider: Annotated[Provider, Query(description="The anime tracking provider")],
+    username: Annotated[
+        str, Query(description="The user's username on the specified platform")
+    ],
+    start: Annotated[
+        int,
+        Query(ge=MIN_YEAR, description="The first year to calculate stats for"),
+    ],
+    wrapped_service: Annotated[WrappedService, Depends()],
+    config: Annotated[AniwrapConfig, Depends(get_config)],
+    end: Annotated[
+        int | None,
+        Query(
+            description="The last year to calculate stats for; defaults to this year"
+        ),
+    ] = None,
+) -> Response:
+    current_year = date.today().year
+    if end is None:
+        end = current_year
+    if not start <= end <= current_year:
+        raise HTTPException(
+            status_code=422,
+            detail=f"The years have to be in order, and no later than {current_year}",
+        )
+    if end - start + 1 > config.wrapped.max_years:
+        raise HTTPException(
+            status_code=422,
+            detail=f"At most {config.wrapped.max_years} years can be requested at once",
+        )
+
+    content = await wrapped_service.get_yearly_wrapped_json(
+        ProviderType(provider), username, start, end
+    )
+    return Response(content, media_type="application/json")
+
+
+@router.post("/batch", response_model=BatchStats)
+async def get_batch_wrapped(
+    request: Annotated[BatchWrappedRequest, Body()],
+    wrapped_service: Annotated[WrappedService, Depends()],
+    config: Annotated[AniwrapConfig, Depends(get_config)],
+) -> Response:
+    if len(set(request.usernames)) > config.wrapped.max_batch_users:
+        raise HTTPException(
+            status_code=422,
+            detail=f"At most {config.wrapped.max_batch_users} users can be requested at once",
+        )
+
+    content = await wrapped_service.get_batch_wrapped_json(
+        ProviderType(request.provider), request.usernames
+    )
+    return Response(content, media_type="application/json")
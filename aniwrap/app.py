@@ -1,20 +1,145 @@
+import asyncio
+import time
 from contextlib import asynccontextmanager
+from functools import partial
+from logging import getLogger
 
-import aiohttp
-from fastapi import FastAPI
+from cattrs import unstructure
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
 
 from aniwrap.api.watch_history import router as watch_history_router
 from aniwrap.api.wrapped import router as wrapped_router
+from aniwrap.config import AniwrapConfig, CacheConfig, get_config
+from aniwrap.db.dependencies import make_engine, make_sessionmaker
+from aniwrap.metrics import ServerTimingMiddleware
+from aniwrap.misc import (
+    get_http_pool_stats,
+    get_statistics_service,
+    make_http_client,
+)
+from aniwrap.service.anilist_client import AnilistClient
+from aniwrap.service.cache import TTLCache
+from aniwrap.service.executor import StatsExecutor
+from aniwrap.service.mal_client import MalClient
+from aniwrap.service.media.anilist import AnilistMediaService
+from aniwrap.service.prewarm import PrewarmWorker
+from aniwrap.service.singleflight import SingleFlight
+from aniwrap.service.snapshot import SnapshotService
+from aniwrap.service.stats import warm_up_stats_worker
+from aniwrap.service.user_registry import UserRegistry
+from aniwrap.service.watch_history.anilist import AnilistWatchHistoryService
+from aniwrap.service.watch_history.mal import MalWatchHistoryService
+from aniwrap.service.wrapped import WrappedService
+
+log = getLogger(__name__)
+
+
+def make_wrapped_service(app: FastAPI, config: AniwrapConfig) -> WrappedService:
+    # what the dependencies would put together for a request, for work that
+    # happens outside of one
+    sessionmaker = app.state.sessionmaker
+    media = AnilistMediaService(
+        config, app.state.anilist, app.state.media_cache, sessionmaker
+    )
+    return WrappedService(
+        AnilistWatchHistoryService(
+            config,
+            app.state.anilist,
+            app.state.watch_history_cache,
+            app.state.singleflight,
+            media,
+        ),
+        MalWatchHistoryService(
+            config,
+            app.state.mal,
+            app.state.watch_history_cache,
+            app.state.singleflight,
+        ),
+        get_statistics_service(config),
+        app.state.stats_executor,
+        SnapshotService(config, sessionmaker),
+        app.state.singleflight,
+        app.state.user_registry,
+        config,
+    )
+
+
+async def warm_up(app: FastAPI, config: AniwrapConfig) -> None:
+    # Runs in the background once the app is up, so it can answer /ping (and
+    # the load balancer's health checks) right away; /ready says when this is
+    # done, and the app can take its share of the traffic without the first
+    # requests paying for cold workers and connections.
+    start = time.perf_counter()
+    try:
+        await app.state.stats_executor.warm_up(
+            partial(warm_up_stats_worker, get_statistics_service(config))
+        )
+    except Exception:
+        # the stats workers are broken, so this never gets ready
+        log.exception("Failed to warm up the stats workers")
+        return
+    try:
+        async with app.state.db.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+    except (SQLAlchemyError, OSError) as e:
+        # everything that uses the database falls back to working without it,
+        # and each of those logs its own errors
+        log.warning("Failed to connect to the database while warming up: %s", e)
+    app.state.warm_up_seconds = time.perf_counter() - start
+    log.info("Warmed up in %.2fs", app.state.warm_up_seconds)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    app.state.http = aiohttp.ClientSession()
+    config = get_config()
+    app.state.db = make_engine(config.database_url, config.db)
+    app.state.sessionmaker = make_sessionmaker(app.state.db)
+    app.state.user_registry = UserRegistry(config.user_registry, app.state.sessionmaker)
+    app.state.http = make_http_client(config.http)
+    app.state.anilist = AnilistClient(config.anilist, app.state.http)
+    app.state.mal = (
+        MalClient(config.mal, app.state.http) if config.mal is not None else None
+    )
+    app.state.stats_executor = StatsExecutor(config.stats)
+    app.state.watch_history_cache = TTLCache(config.cache)
+    app.state.media_cache = TTLCache(
+        CacheConfig(
+            enabled=config.media_cache.enabled,
+            ttl=config.media_cache.max_age,
+            stale_ttl=0,
+            max_entries=config.media_cache.max_entries,
+            max_bytes=config.media_cache.max_bytes,
+        )
+    )
+    app.state.singleflight = SingleFlight()
+    app.state.prewarm = PrewarmWorker(
+        config.prewarm,
+        app.state.sessionmaker,
+        app.state.anilist,
+        make_wrapped_service(app, config),
+    )
+    app.state.prewarm.start()
+    app.state.user_registry.start()
+    app.state.warm_up_seconds = None
+    app.state.warm_up = asyncio.create_task(warm_up(app, config))
     yield
+    app.state.warm_up.cancel()
+    await asyncio.gather(app.state.warm_up, return_exceptions=True)
+    await app.state.prewarm.stop()
+    await app.state.user_registry.stop()
+    await app.state.watch_history_cache.close()
+    await app.state.anilist.close()
     await app.state.http.close()
+    app.state.stats_executor.shutdown()
+    await app.state.db.dispose()
 
 
 app = FastAPI(lifespan=lifespan)
+app.add_middleware(ServerTimingMiddleware)
 
 app.include_router(watch_history_router)
 app.include_router(wrapped_router)
@@ -23,3 +148,37 @@ app.include_router(wrapped_router)
 @app.get("/ping")
 def ping():
     return {"message": "pong!"}
+
+
+@app.get("/ready")
+def ready(request: Request) -> JSONResponse:
+    # for readiness probes; unlike /ping, this waits for the warm up
+    warm_up_seconds = request.app.state.warm_up_seconds
+    return JSONResponse(
+        {"ready": warm_up_seconds is not None, "warm_up_seconds": warm_up_seconds},
+        status_code=200 if warm_up_seconds is not None else 503,
+    )
+
+
+@app.get("/metrics")
+def metrics() -> Response:
+    # these are per process; with several workers, each is scraped separately
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+@app.get("/cache/stats")
+def cache_stats(request: Request) -> dict:
+    return {
+        "watch_history": unstructure(request.app.state.watch_history_cache.stats()),
+        "media": unstructure(request.app.state.media_cache.stats()),
+    }
+
+
+@app.get("/prewarm/stats")
+def prewarm_stats(request: Request) -> dict:
+    return unstructure(request.app.state.prewarm.progress())
+
+
+@app.get("/http/stats")
+def http_stats(request: Request) -> dict:
+    return get_http_pool_stats(request.app.state.http)
@@ -1,5 +1,6 @@
 from functools import cache
 from logging import getLogger
+from typing import Literal
 
 from pydantic import BaseModel
 from pydantic_settings import BaseSettings, SettingsConfigDict
@@ -10,6 +11,162 @@ log = getLogger(__name__)
 class AnilistConfig(BaseModel):
     client_id: int
     client_secret: str
+    # GraphQL endpoint; can be pointed at a stand-in server for load tests
+    api_base_url: str = "https://graphql.anilist.co"
+    # MediaListCollection returns entries in chunks; 500 is the most the API allows
+    per_chunk: int = 500
+    # how many chunks past the first one are requested at the same time
+    chunk_concurrency: int = 4
+    # hard limit, so one absurdly large list can't hog the upstream rate limit
+    max_chunks: int = 40
+    # requests per minute; corrected from AniList's rate limit headers at runtime
+    rate_limit: int = 90
+    # retries on 429s, 5xx responses and connection errors
+    max_retries: int = 3
+    # seconds; retries wait a random time up to min(backoff_max, backoff_base * 2^n)
+    backoff_base: float = 0.5
+    backoff_max: float = 10
+
+
+class MalConfig(BaseModel):
+    # the API client id, sent as X-MAL-CLIENT-ID; no OAuth needed for public lists
+    client_id: str
+    api_base_url: str = "https://api.myanimelist.net/v2"
+    # animelist entries per page; 1000 is the most the API allows
+    page_size: int = 1000
+    # how many pages past the first one are requested at the same time
+    page_concurrency: int = 4
+    # hard limit, same as `anilist.max_chunks`
+    max_pages: int = 20
+    # retries on 429s, 5xx responses and connection errors
+    max_retries: int = 3
+    # seconds; retries wait a random time up to min(backoff_max, backoff_base * 2^n)
+    backoff_base: float = 0.5
+    backoff_max: float = 10
+
+
+class HttpConfig(BaseModel):
+    # Settings for the HTTP client used to talk to upstream providers.
+    # maximum number of open connections, in total and per host
+    pool_size: int = 100
+    pool_size_per_host: int = 30
+    # seconds an idle connection is kept around for reuse
+    keepalive_timeout: float = 60
+    # seconds a DNS lookup is cached for
+    dns_cache_ttl: int = 300
+    # request timeouts, in seconds
+    total_timeout: float = 60
+    connect_timeout: float = 5
+    read_timeout: float = 30
+
+
+class StatsConfig(BaseModel):
+    # "thread" keeps everything in one process, with a DuckDB connection per thread.
+    # "process" sidesteps the GIL for the Python-heavy parts (dataframe building,
+    # model validation), at the cost of pickling data across the process boundary.
+    executor: Literal["thread", "process"] = "thread"
+    # defaults to the number of CPUs
+    max_workers: int | None = None
+    # how many stats jobs may wait for a free worker before new requests block
+    max_queued: int = 32
+    # threads used by each DuckDB connection; keep this low since every
+    # worker has its own connection
+    duckdb_threads: int = 1
+    # what the stats are computed with; both give the same results (see
+    # benchmarks/pipeline.py, which compares them)
+    engine: Literal["duckdb", "polars"] = "duckdb"
+
+
+class CacheConfig(BaseModel):
+    enabled: bool = True
+    # seconds for which a cached watch history is considered fresh
+    ttl: float = 300
+    # seconds past the TTL for which a stale entry is still served,
+    # while it is refreshed in the background
+    stale_ttl: float = 1800
+    max_entries: int = 1024
+    # measured as the size of the upstream response bodies, so the actual
+    # memory use is a few times more than this
+    max_bytes: int = 128 * 1024 * 1024
+
+
+class MediaCacheConfig(BaseModel):
+    # When enabled, watch lists are fetched without the media metadata, which
+    # is filled in from a cache shared by all users instead.
+    enabled: bool = True
+    max_entries: int = 100_000
+    max_bytes: int = 256 * 1024 * 1024
+    # seconds for which cached media (scores and such change over time) is used
+    max_age: float = 24 * 60 * 60
+    # also keep the media in the database, so it survives restarts
+    persist: bool = False
+    # if looking up the uncached media of a list would take more than this many
+    # requests, the full watch list is fetched instead
+    max_lookup_pages: int = 4
+
+
+class SnapshotConfig(BaseModel):
+    enabled: bool = True
+    # seconds after which a stored watch history is re-fetched from upstream
+    max_age: float = 6 * 60 * 60
+    # Past max_age, only fetch the entries updated since the snapshot was taken.
+    # Deleted entries don't show up that way, so after full_refresh_age the
+    # watch history is re-fetched in full anyway.
+    incremental: bool = True
+    full_refresh_age: float = 7 * 24 * 60 * 60
+    # if more than this many pages (of 50) of entries were updated, fetch in full
+    max_update_pages: int = 4
+
+
+class WrappedConfig(BaseModel):
+    # most years /wrapped/years can cover in one request; the whole range is
+    # fetched at once, so this bounds how big that gets
+    max_years: int = 10
+    # most users /wrapped/batch takes in one request
+    max_batch_users: int = 20
+    # how many of a batch's watch histories are fetched at the same time
+    batch_concurrency: int = 4
+
+
+class PrewarmConfig(BaseModel):
+    # Periodically precomputes the current year's wrapped stats of every known
+    # user, so /wrapped is a lookup during traffic spikes. Only needs to be
+    # enabled on one replica.
+    enabled: bool = False
+    # seconds after startup before the first pass, and between passes; keep the
+    # interval under `snapshot.max_age`, or the stats go stale in between
+    initial_delay: float = 60
+    interval: float = 4 * 60 * 60
+    # users are loaded from the database this many at a time
+    batch_size: int = 100
+    # how many users are prewarmed at the same time
+    concurrency: int = 2
+    # share of the AniList rate limit left for interactive requests; no user is
+    # prewarmed while less than this is available
+    rate_reserve: float = 0.5
+
+
+class DatabaseConfig(BaseModel):
+    # connections kept open, and how many more can be opened when they're all busy
+    pool_size: int = 5
+    max_overflow: int = 10
+    # seconds to wait for a free connection before giving up
+    pool_timeout: float = 30
+    # seconds after which a connection is replaced; -1 keeps them forever
+    pool_recycle: int = -1
+    # prepared statements cached per connection; set to 0 behind pgbouncer in
+    # transaction mode, where the next query may be on a different connection
+    statement_cache_size: int = 100
+
+
+class UserRegistryConfig(BaseModel):
+    # Records the users wrapped stats are looked up for in the users table (which
+    # is what the prewarm worker goes through). Lookups are buffered in memory,
+    # and written in batches every `flush_interval` seconds.
+    enabled: bool = True
+    flush_interval: float = 5
+    # users held in memory at most; any more are dropped until the next flush
+    max_pending: int = 100_000
 
 
 class AniwrapConfig(BaseSettings):
@@ -18,8 +175,19 @@ class AniwrapConfig(BaseSettings):
     )
 
     database_url: str
+    db: DatabaseConfig = DatabaseConfig()
     anilist: AnilistConfig
     gemini_api_key: str
+    # MyAnimeList users get a 503 without this
+    mal: MalConfig | None = None
+    http: HttpConfig = HttpConfig()
+    stats: StatsConfig = StatsConfig()
+    cache: CacheConfig = CacheConfig()
+    media_cache: MediaCacheConfig = MediaCacheConfig()
+    snapshot: SnapshotConfig = SnapshotConfig()
+    wrapped: WrappedConfig = WrappedConfig()
+    prewarm: PrewarmConfig = PrewarmConfig()
+    user_registry: UserRegistryConfig = UserRegistryConfig()
 
 
 @cache
@@ -1,7 +1,13 @@
-"""DB connection dependency."""
+"""DB connection dependency.
+
+The engine is created in the app's lifespan (see `make_engine`), rather than when
+this module is imported, so importing anything that uses the database doesn't
+need the configuration or build a connection pool.
+"""
 
 from collections.abc import AsyncGenerator
 
+from fastapi import Request
 from sqlalchemy.ext.asyncio import (
     AsyncEngine,
     AsyncSession,
@@ -9,18 +15,37 @@ from sqlalchemy.ext.asyncio import (
     create_async_engine,
 )
 
-from aniwrap.config import get_config
+from aniwrap.config import DatabaseConfig
 
-DATABASE_URL = get_config().database_url
 
+def make_engine(database_url: str, config: DatabaseConfig) -> AsyncEngine:
+    return create_async_engine(
+        database_url,
+        pool_size=config.pool_size,
+        max_overflow=config.max_overflow,
+        pool_timeout=config.pool_timeout,
+        pool_recycle=config.pool_recycle,
+        connect_args={
+            # SQLAlchemy's own cache of prepared statements, and asyncpg's
+            "prepared_statement_cache_size": config.statement_cache_size,
+            "statement_cache_size": config.statement_cache_size,
+        },
+    )
 
-engine: AsyncEngine = create_async_engine(DATABASE_URL)
-async_session = async_sessionmaker(
-    bind=engine, class_=AsyncSession, expire_on_commit=False
-)
+
+def make_sessionmaker(engine: AsyncEngine) -> async_sessionmaker[AsyncSession]:
+    return async_sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
 
 
-async def get_db() -> AsyncGenerator[AsyncSession, None]:
+async def get_db(request: Request) -> AsyncGenerator[AsyncSession, None]:
     """Dependency used to supply database session."""
-    async with async_session() as session:
+    async with request.app.state.sessionmaker() as session:
         yield session
+
+
+def get_sessionmaker(request: Request) -> async_sessionmaker[AsyncSession]:
+    """Dependency used to supply the session factory.
+
+    Use this instead of `get_db` for work that may outlive the request that started it.
+    """
+    return request.app.state.sessionmaker
@@ -2,10 +2,22 @@
 
 import enum
 import uuid
-from datetime import datetime
+from datetime import date, datetime
+from typing import Any
 
-from sqlalchemy import DateTime, String, text
+from sqlalchemy import (
+    BigInteger,
+    Date,
+    DateTime,
+    Integer,
+    LargeBinary,
+    String,
+    Text,
+    UniqueConstraint,
+    text,
+)
 from sqlalchemy.dialects.postgresql import ENUM as dbEnum
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.dialects.postgresql import UUID as dbUuid
 from sqlalchemy.orm import (
     DeclarativeBase,
@@ -26,6 +38,7 @@ class Base(DeclarativeBase, MappedAsDataclass):
 
 class User(Base):
     __tablename__ = "users"
+    __table_args__ = (UniqueConstraint("provider", "username"),)
 
     id: Mapped[uuid.UUID] = mapped_column(
         dbUuid(as_uuid=True),
@@ -47,3 +60,61 @@ class User(Base):
         nullable=False,
         server_default=text("timezone('utc', now())"),
     )
+
+
+class WatchHistorySnapshot(Base):
+    """The last fetched watch history of a user, for a given date range.
+
+    `data` holds the flattened watch history dataframe, as zstd-compressed Arrow IPC.
+    """
+
+    __tablename__ = "watch_history_snapshots"
+    __table_args__ = (
+        UniqueConstraint("provider", "username", "range_start", "range_end"),
+    )
+
+    id: Mapped[uuid.UUID] = mapped_column(
+        dbUuid(as_uuid=True),
+        primary_key=True,
+        init=False,
+        server_default=text("gen_random_uuid()"),
+    )
+    provider: Mapped[ProviderType] = mapped_column(
+        dbEnum("anilist", "mal", name="ProviderType", create_type=False),
+        nullable=False,
+    )
+    username: Mapped[str] = mapped_column(String(50), nullable=False)
+    range_start: Mapped[date] = mapped_column(Date, nullable=False)
+    range_end: Mapped[date] = mapped_column(Date, nullable=False)
+    data: Mapped[bytes] = mapped_column(LargeBinary, nullable=False)
+    # highest `updatedAt` among the entries; null for an empty list
+    max_updated_at: Mapped[int | None] = mapped_column(BigInteger, nullable=True)
+    # the stats aggregates (StatsState) of `data`, so they can be updated
+    # incrementally; null for snapshots taken before they were stored
+    state: Mapped[dict[str, Any] | None] = mapped_column(JSONB, nullable=True)
+    # the CalculatedStats of `data`, as JSON, so they can be served as-is;
+    # cleared whenever `data` changes
+    stats: Mapped[str | None] = mapped_column(Text, nullable=True)
+    fetched_at: Mapped[datetime] = mapped_column(
+        DateTime,
+        init=False,
+        nullable=False,
+        server_default=text("timezone('utc', now())"),
+    )
+
+
+class AnilistMedia(Base):
+    """Cached AniList media metadata, shared between all users."""
+
+    __tablename__ = "anilist_media"
+
+    media_id: Mapped[int] = mapped_column(
+        Integer, primary_key=True, autoincrement=False
+    )
+    data: Mapped[dict[str, Any]] = mapped_column(JSONB, nullable=False)
+    fetched_at: Mapped[datetime] = mapped_column(
+        DateTime,
+        init=False,
+        nullable=False,
+        server_default=text("timezone('utc', now())"),
+    )
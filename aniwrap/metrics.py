@@ -0,0 +1,165 @@
+"""Prometheus metrics, and per-request timings for the Server-Timing header.
+
+Each stage of handling a request (fetching from upstream, building the dataframe,
+each stats query...) is timed with `timed`, which records it both in a histogram
+and in the timings of the request it's part of; those are sent back in the
+response's `Server-Timing` header, so a slow response can be told apart as slow
+upstream or slow us.
+
+Stats jobs run on the stats executor, possibly in another process, so their
+timings are collected in the worker and recorded once the job is back (see
+`collect_timings` and `record_timings`).
+"""
+
+import time
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from prometheus_client import Counter, Histogram
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# stage -> seconds, in the order they happened
+type Timings = list[tuple[str, float]]
+
+STAGE_SECONDS = Histogram(
+    "aniwrap_stage_seconds",
+    "Time spent in each stage of handling a request",
+    ["stage"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+UPSTREAM_REQUEST_SECONDS = Histogram(
+    "aniwrap_upstream_request_seconds",
+    "Time taken by each HTTP request to an upstream provider",
+    ["provider"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 32, 64),
+)
+UPSTREAM_RESPONSE_BYTES = Histogram(
+    "aniwrap_upstream_response_bytes",
+    "Size of the response bodies from upstream providers",
+    ["provider"],
+    buckets=tuple(1024 * 4**i for i in range(9)),
+)
+UPSTREAM_ERRORS = Counter(
+    "aniwrap_upstream_errors_total",
+    "Error responses from upstream providers, by status code "
+    "('connection' for requests that didn't get a response)",
+    ["provider", "status"],
+)
+WATCH_LIST_TRUNCATED = Counter(
+    "aniwrap_watch_list_truncated_total",
+    "Watch lists that had more chunks than we're willing to fetch",
+    ["provider"],
+)
+MEDIA_MISSING = Counter(
+    "aniwrap_media_missing_total",
+    "Watch list entries dropped because AniList didn't return their media "
+    "(ex: it was deleted since the list was fetched)",
+)
+PREWARM_USERS = Counter(
+    "aniwrap_prewarm_users_total",
+    "Users handled by the prewarm worker, by whether their stats were calculated "
+    "('warmed'), already stored ('skipped'), or couldn't be ('failed')",
+    ["result"],
+)
+REGISTERED_USERS = Counter(
+    "aniwrap_registered_users_total",
+    "Users recorded by the user registry, by whether they were written to the "
+    "database ('written'; including ones already there), or dropped because the "
+    "buffer was full ('dropped')",
+    ["result"],
+)
+
+# Timings of the request being handled. A coalesced request (see SingleFlight)
+# only gets the timings of the work it did itself.
+_request_timings: ContextVar[Timings | None] = ContextVar(
+    "request_timings", default=None
+)
+# set while running a stats job, whose timings are recorded after it's done
+_job_timings: ContextVar[Timings | None] = ContextVar("job_timings", default=None)
+
+
+def record(stage: str, seconds: float) -> None:
+    job_timings = _job_timings.get()
+    if job_timings is not None:
+        job_timings.append((stage, seconds))
+        return
+
+    STAGE_SECONDS.labels(stage).observe(seconds)
+    request_timings = _request_timings.get()
+    if request_timings is not None:
+        request_timings.append((stage, seconds))
+
+
+@contextmanager
+def timed(stage: str) -> Iterator[None]:
+    """Times the block as the given stage of the current request."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - start)
+
+
+def collect_timings[T](fn: Callable[[], T]) -> tuple[T, Timings]:
+    """Runs `fn`, and returns its result along with the timings recorded in it.
+
+    Meant to be run on the stats executor's workers; the timings are then passed
+    to `record_timings` on the event loop.
+    """
+    timings: Timings = []
+    token = _job_timings.set(timings)
+    try:
+        return fn(), timings
+    finally:
+        _job_timings.reset(token)
+
+
+def record_timings(timings: Timings) -> None:
+    for stage, seconds in timings:
+        record(stage, seconds)
+
+
+def server_timing(timings: Timings) -> str:
+    # stages that happened more than once (ex: one per chunk) are added up
+    totals: dict[str, float] = {}
+    for stage, seconds in timings:
+        totals[stage] = totals.get(stage, 0) + seconds
+    return ", ".join(
+        f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in totals.items()
+    )
+
+
+class ServerTimingMiddleware:
+    """Adds the timings recorded while handling a request as a `Server-Timing` header.
+
+    Written as plain ASGI middleware rather than with `BaseHTTPMiddleware`, so it
+    doesn't get in the way of streaming responses.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings: Timings = []
+        token = _request_timings.set(timings)
+        start = time.perf_counter()
+
+        async def send_with_timings(message: Message) -> None:
+            if message["type"] == "http.response.start" and timings:
+                total = ("total", time.perf_counter() - start)
+                header = server_timing([*timings, total])
+                message["headers"] = [
+                    *message.get("headers", []),
+                    (b"server-timing", header.encode("latin-1")),
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timings)
+        finally:
+            _request_timings.reset(token)
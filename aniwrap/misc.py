@@ -1,8 +1,147 @@
 """Miscellaneous helper functions and stuff."""
 
-from aiohttp import ClientSession
-from fastapi import Request
+from datetime import UTC, datetime
+from typing import Annotated
+
+from aiohttp import ClientSession, ClientTimeout, TCPConnector, TraceConfig
+from fastapi import Depends, Request
+
+from aniwrap.config import AniwrapConfig, HttpConfig, get_config
+from aniwrap.service.anilist_client import AnilistClient
+from aniwrap.service.cache import TTLCache
+from aniwrap.service.executor import StatsExecutor
+from aniwrap.service.mal_client import MalClient
+from aniwrap.service.singleflight import SingleFlight
+from aniwrap.service.stats import StatisticsService
+from aniwrap.service.stats_polars import PolarsStatisticsService
+from aniwrap.service.user_registry import UserRegistry
+
+
+def current_year_range() -> tuple[datetime, datetime]:
+    """The (exclusive) date range covering the current year.
+
+    The year is UTC's, same as the timestamps stored with snapshots; the bounds
+    are naive, like the dates they're compared with.
+    """
+    year = datetime.now(UTC).year
+    return datetime(year - 1, 12, 31), datetime(year + 1, 1, 1)
+
+
+class _PoolTraceConfig(TraceConfig):
+    # Counts what the connection pool is up to, from aiohttp's tracing hooks;
+    # the connector itself only keeps track of that in private attributes.
+    def __init__(self) -> None:
+        super().__init__()
+        # requests sent and waiting for their response (headers)
+        self.requests_in_flight = 0
+        # requests waiting for a free connection, because the pool is full
+        self.queued = 0
+        # connections opened, and reused from the pool, since startup
+        self.created = 0
+        self.reused = 0
+
+        async def on_request_start(*_: object) -> None:
+            self.requests_in_flight += 1
+
+        async def on_request_done(*_: object) -> None:
+            self.requests_in_flight -= 1
+
+        async def on_queued_start(*_: object) -> None:
+            self.queued += 1
+
+        async def on_queued_end(*_: object) -> None:
+            self.queued -= 1
+
+        async def on_created(*_: object) -> None:
+            self.created += 1
+
+        async def on_reused(*_: object) -> None:
+            self.reused += 1
+
+        self.on_request_start.append(on_request_start)
+        self.on_request_end.append(on_request_done)
+        self.on_request_exception.append(on_request_done)
+        self.on_connection_queued_start.append(on_queued_start)
+        self.on_connection_queued_end.append(on_queued_end)
+        self.on_connection_create_end.append(on_created)
+        self.on_connection_reuseconn.append(on_reused)
+
+
+def make_http_client(config: HttpConfig) -> ClientSession:
+    connector = TCPConnector(
+        limit=config.pool_size,
+        limit_per_host=config.pool_size_per_host,
+        keepalive_timeout=config.keepalive_timeout,
+        ttl_dns_cache=config.dns_cache_ttl,
+    )
+    timeout = ClientTimeout(
+        total=config.total_timeout,
+        connect=config.connect_timeout,
+        sock_read=config.read_timeout,
+    )
+    # watch lists are big, repetitive JSON; they compress really well
+    return ClientSession(
+        connector=connector,
+        timeout=timeout,
+        headers={"Accept-Encoding": "gzip, deflate"},
+        auto_decompress=True,
+        trace_configs=[_PoolTraceConfig()],
+    )
+
+
+def get_http_pool_stats(http: ClientSession) -> dict[str, int]:
+    """Current usage of the HTTP client's connection pool."""
+    connector = http.connector
+    if not isinstance(connector, TCPConnector):
+        return {}
+    stats = {"limit": connector.limit, "limit_per_host": connector.limit_per_host}
+    for trace in http.trace_configs:
+        if isinstance(trace, _PoolTraceConfig):
+            stats |= {
+                "requests_in_flight": trace.requests_in_flight,
+                "queued": trace.queued,
+                "created": trace.created,
+                "reused": trace.reused,
+            }
+    return stats
 
 
 def get_http_client(request: Request) -> ClientSession:
     return request.app.state.http
+
+
+def get_anilist_client(request: Request) -> AnilistClient:
+    return request.app.state.anilist
+
+
+def get_mal_client(request: Request) -> MalClient | None:
+    # None if MAL isn't configured
+    return request.app.state.mal
+
+
+def get_stats_executor(request: Request) -> StatsExecutor:
+    return request.app.state.stats_executor
+
+
+def get_statistics_service(
+    config: Annotated[AniwrapConfig, Depends(get_config)],
+) -> StatisticsService:
+    if config.stats.engine == "polars":
+        return PolarsStatisticsService()
+    return StatisticsService()
+
+
+def get_watch_history_cache(request: Request) -> TTLCache:
+    return request.app.state.watch_history_cache
+
+
+def get_singleflight(request: Request) -> SingleFlight:
+    return request.app.state.singleflight
+
+
+def get_media_cache(request: Request) -> TTLCache:
+    return request.app.state.media_cache
+
+
+def get_user_registry(request: Request) -> UserRegistry:
+    return request.app.state.user_registry
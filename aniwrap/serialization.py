@@ -0,0 +1,33 @@
+"""JSON serialization of the attrs types, for responses.
+
+Returning `cattrs.unstructure(...)` from a route builds a dict tree, which FastAPI
+then walks again with `jsonable_encoder` before the JSON encoder walks it a third
+time. The orjson converter unstructures straight into what orjson can dump, and
+the bytes go out in a plain `Response`.
+"""
+
+from collections.abc import Iterator
+
+from cattrs.preconf.orjson import make_converter
+
+from aniwrap.types.anilist.watch_history import MediaListCollection
+
+converter = make_converter()
+
+
+def dumps(o: object) -> bytes:
+    return converter.dumps(o)
+
+
+def iter_media_list_collection(collection: MediaListCollection) -> Iterator[bytes]:
+    """Serializes a MediaListCollection one list at a time.
+
+    Joined together, the chunks are the same JSON as `dumps(collection)`; but
+    only one list's worth of unstructured objects and bytes exists at a time.
+    """
+    yield b'{"lists":['
+    for i, watch_list in enumerate(collection.lists):
+        if i:
+            yield b","
+        yield converter.dumps(watch_list)
+    yield b'],"hasNextChunk":' + converter.dumps(collection.hasNextChunk) + b"}"
@@ -0,0 +1,182 @@
+"""Rate limit aware client for AniList's GraphQL API.
+
+AniList allows a fixed number of requests per minute. Every request goes through
+a token bucket which is kept in sync with the `X-RateLimit-*` headers AniList
+sends back; since those headers report the budget left for *all* our workers,
+each worker's bucket tracks the shared limit rather than just its own usage.
+When the bucket is empty, requests queue up and are let through by priority.
+"""
+
+import asyncio
+import enum
+import heapq
+import itertools
+import time
+from logging import getLogger
+from typing import Any
+
+from aiohttp import ClientResponse, ClientSession
+
+from aniwrap.config import AnilistConfig
+from aniwrap.service.upstream import int_header, request_with_retries
+
+log = getLogger(__name__)
+
+
+class Priority(enum.IntEnum):
+    # lower goes first
+    INTERACTIVE = 0
+    BACKGROUND = 1
+
+
+class _TokenBucket:
+    def __init__(self, per_minute: int) -> None:
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated_at) * self.capacity / 60
+        )
+        self.updated_at = now
+
+    def delay(self) -> float:
+        """Seconds until a token is available."""
+        self._refill()
+        now = time.monotonic()
+        if self.blocked_until > now:
+            return self.blocked_until - now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) * 60 / self.capacity
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+    def headroom(self) -> float:
+        """Share of the budget currently available, from 0 to 1."""
+        self._refill()
+        if self.blocked_until > time.monotonic():
+            return 0.0
+        return max(0.0, self.tokens / self.capacity)
+
+    def sync(self, limit: int | None, remaining: int | None) -> None:
+        self._refill()
+        if limit is not None:
+            self.capacity = float(limit)
+        if remaining is not None:
+            # other workers may have used up some of the budget
+            self.tokens = min(self.tokens, float(remaining))
+
+    def block(self, seconds: float) -> None:
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+
+class AnilistClient:
+    def __init__(self, config: AnilistConfig, http: ClientSession) -> None:
+        self.config = config
+        self.http = http
+        self._bucket = _TokenBucket(config.rate_limit)
+        self._waiters: list[tuple[Priority, int, asyncio.Future[None]]] = []
+        self._counter = itertools.count()
+        self._pending = asyncio.Event()
+        self._dispatcher: asyncio.Task[None] | None = None
+
+    async def query(
+        self,
+        query: str,
+        variables: dict[str, Any],
+        priority: Priority = Priority.INTERACTIVE,
+    ) -> bytes:
+        """Sends a GraphQL query, retrying on rate limits and server errors.
+
+        Arguments:
+            query: GraphQL query
+            variables: the query's variables
+            priority: requests with a higher priority are sent first when rate limited
+
+        Returns:
+            The raw response body
+        """
+
+        def on_response(res: ClientResponse) -> None:
+            self._bucket.sync(
+                int_header(res, "X-RateLimit-Limit"),
+                int_header(res, "X-RateLimit-Remaining"),
+            )
+            retry_after = int_header(res, "Retry-After")
+            if res.status == 429 and retry_after is not None:
+                self._bucket.block(retry_after)
+
+        return await request_with_retries(
+            "anilist",
+            "AniList",
+            self.config,
+            lambda: self.http.post(
+                self.config.api_base_url,
+                json={"query": query, "variables": variables},
+            ),
+            before_attempt=lambda: self._acquire(priority),
+            on_response=on_response,
+        )
+
+    def headroom(self) -> float:
+        """Share of the rate limit that's currently unused, from 0 to 1.
+
+        Background work can check this to leave room for interactive requests,
+        rather than queueing up behind the limit.
+        """
+        return self._bucket.headroom()
+
+    async def _acquire(self, priority: Priority) -> None:
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._counter), future))
+        self._pending.set()
+        await future
+
+    async def _dispatch(self) -> None:
+        # A bug in here would otherwise leave every queued request waiting
+        # forever, so they're failed instead, and the loop carries on with the
+        # requests that come in after.
+        while True:
+            try:
+                await self._dispatch_tokens()
+            except Exception as e:
+                log.exception("AniList rate limiter failed")
+                waiters, self._waiters = self._waiters, []
+                self._pending.clear()
+                for _, _, future in waiters:
+                    if not future.done():
+                        future.set_exception(e)
+
+    async def _dispatch_tokens(self) -> None:
+        # Hands out tokens to waiting requests, highest priority (then oldest) first.
+        while True:
+            await self._pending.wait()
+            delay = self._bucket.delay()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+
+            # the waiter stays queued until it's handed its token, so that it
+            # gets failed along with the rest if anything goes wrong before then
+            future = self._waiters[0][2]
+            if not future.done():
+                self._bucket.take()
+                future.set_result(None)
+            # otherwise the caller was cancelled while waiting
+            heapq.heappop(self._waiters)
+            if not self._waiters:
+                self._pending.clear()
+
+    async def close(self) -> None:
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            await asyncio.gather(self._dispatcher, return_exceptions=True)
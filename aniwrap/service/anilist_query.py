@@ -0,0 +1,199 @@
+"""GraphQL queries for AniList, built from field selections.
+
+Rather than one query that fetches everything, each consumer of watch list data
+gets a query selecting only the fields it uses. The selections are derived from
+the types the data ends up in: the attrs types for `/watched`, and the columnar
+schema for `/wrapped`.
+"""
+
+import enum
+import types
+from typing import Union, get_args, get_origin, get_type_hints
+
+import attrs
+import polars as pl
+
+from aniwrap.types.anilist.columnar import WRAPPED_ENTRY_SCHEMA
+from aniwrap.types.anilist.watch_history import AdvancedScore, Media, MediaList
+
+# field name -> sub-selection, or None for scalar fields
+type Selection = dict[str, Selection | None]
+
+# attrs types which are plain JSON scalars in AniList's schema;
+# these can't have a sub-selection
+_JSON_SCALARS: set[type] = {AdvancedScore}
+
+
+def _attrs_subselection(tp: object) -> Selection | None:
+    origin = get_origin(tp)
+    if origin is list:
+        return _attrs_subselection(get_args(tp)[0])
+    if origin in (Union, types.UnionType):
+        (inner,) = (arg for arg in get_args(tp) if arg is not type(None))
+        return _attrs_subselection(inner)
+    if isinstance(tp, type) and attrs.has(tp) and tp not in _JSON_SCALARS:
+        return selection_from_attrs(tp)
+    return None
+
+
+def selection_from_attrs(cls: type, exclude: frozenset[str] = frozenset()) -> Selection:
+    """Selects every field of an attrs class, recursing into nested attrs classes."""
+    hints = get_type_hints(cls)
+    return {
+        field.name: _attrs_subselection(hints[field.name])
+        for field in attrs.fields(cls)
+        if field.name not in exclude
+    }
+
+
+def _schema_subselection(dtype: pl.DataType) -> Selection | None:
+    if isinstance(dtype, pl.List):
+        return _schema_subselection(dtype.inner)
+    if isinstance(dtype, pl.Struct):
+        return selection_from_schema(
+            {field.name: field.dtype for field in dtype.fields}
+        )
+    return None
+
+
+def selection_from_schema(
+    schema: dict[str, pl.DataType] | pl.Schema, exclude: frozenset[str] = frozenset()
+) -> Selection:
+    """Selects every column of a Polars schema, recursing into structs."""
+    return {
+        name: _schema_subselection(dtype)
+        for name, dtype in schema.items()
+        if name not in exclude
+    }
+
+
+def render_selection(selection: Selection, depth: int = 0) -> str:
+    lines = []
+    pad = "  " * depth
+    for name, subselection in selection.items():
+        if subselection is None:
+            lines.append(f"{pad}{name}")
+        else:
+            lines.append(f"{pad}{name} {{")
+            lines.append(render_selection(subselection, depth + 1))
+            lines.append(f"{pad}}}")
+    return "\n".join(lines)
+
+
+_MEDIALISTCOLLECTION_QUERY_TEMPLATE = """query WatchList(
+  $userName: String
+  $type: MediaType
+  $sort: [MediaListSort]
+  $completedAtLesser: FuzzyDateInt
+  $startedAtGreater: FuzzyDateInt
+  $chunk: Int
+  $perChunk: Int
+) {
+  MediaListCollection(
+    userName: $userName
+    type: $type
+    sort: $sort
+    completedAt_lesser: $completedAtLesser
+    startedAt_greater: $startedAtGreater
+    chunk: $chunk
+    perChunk: $perChunk
+  ) {
+%s
+    hasNextChunk
+  }
+}
+"""
+
+_MEDIA_PAGE_QUERY_TEMPLATE = """query MediaPage($ids: [Int], $perPage: Int) {
+  Page(perPage: $perPage) {
+    media(id_in: $ids) {
+%s
+    }
+  }
+}
+"""
+
+
+def medialistcollection_query(entries: Selection, with_media: bool) -> str:
+    """Builds a MediaListCollection query selecting the given entry fields.
+
+    Without media, the entries need to be hydrated through AnilistMediaService.
+    """
+    if with_media:
+        entries = {**entries, "media": MEDIA_SELECTION}
+    lists = {"lists": {"name": None, "status": None, "entries": entries}}
+    return _MEDIALISTCOLLECTION_QUERY_TEMPLATE % render_selection(lists, depth=2)
+
+
+# The media selection is the same for every consumer, so that media cached
+# for one of them can be used for all. (/wrapped needs nearly all of it anyway.)
+MEDIA_SELECTION = selection_from_attrs(Media)
+
+ANILIST_MEDIA_PAGE_QUERY = _MEDIA_PAGE_QUERY_TEMPLATE % render_selection(
+    {"id": None, **MEDIA_SELECTION}, depth=3
+)
+
+
+class WatchListFields(enum.StrEnum):
+    """Which fields of a watch list to fetch."""
+
+    # everything in MediaListCollection; used by /watched
+    FULL = enum.auto()
+    # only what the stats use; used by /wrapped
+    WRAPPED = enum.auto()
+
+
+_ENTRY_SELECTIONS: dict[WatchListFields, Selection] = {
+    WatchListFields.FULL: selection_from_attrs(MediaList, exclude=frozenset({"media"})),
+    WatchListFields.WRAPPED: selection_from_schema(
+        WRAPPED_ENTRY_SCHEMA, exclude=frozenset({"media"})
+    ),
+}
+
+ANILIST_MEDIALISTCOLLECTION_QUERIES: dict[WatchListFields, str] = {
+    fields: medialistcollection_query(selection, with_media=True)
+    for fields, selection in _ENTRY_SELECTIONS.items()
+}
+ANILIST_MEDIALISTCOLLECTION_SLIM_QUERIES: dict[WatchListFields, str] = {
+    fields: medialistcollection_query(selection, with_media=False)
+    for fields, selection in _ENTRY_SELECTIONS.items()
+}
+
+
+_MEDIALIST_PAGE_QUERY_TEMPLATE = """query UpdatedEntries(
+  $userName: String
+  $type: MediaType
+  $completedAtLesser: FuzzyDateInt
+  $startedAtGreater: FuzzyDateInt
+  $page: Int
+  $perPage: Int
+) {
+  Page(page: $page, perPage: $perPage) {
+    pageInfo {
+      hasNextPage
+    }
+    mediaList(
+      userName: $userName
+      type: $type
+      sort: UPDATED_TIME_DESC
+      completedAt_lesser: $completedAtLesser
+      startedAt_greater: $startedAtGreater
+    ) {
+%s
+    }
+  }
+}
+"""
+
+
+def medialist_page_query(entries: Selection) -> str:
+    """Builds a query for a page of a user's list entries, most recently updated first."""
+    return _MEDIALIST_PAGE_QUERY_TEMPLATE % render_selection(entries, depth=3)
+
+
+# For incremental refreshes of /wrapped: the changed entries in the date range,
+# and the ids of every changed entry (to find the ones that left the range).
+ANILIST_UPDATED_ENTRIES_QUERY = medialist_page_query(
+    {**_ENTRY_SELECTIONS[WatchListFields.WRAPPED], "media": MEDIA_SELECTION}
+)
+ANILIST_UPDATED_IDS_QUERY = medialist_page_query({"mediaId": None, "updatedAt": None})
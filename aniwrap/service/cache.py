@@ -0,0 +1,149 @@
+"""In-process cache for data fetched from upstream providers."""
+
+import asyncio
+import time
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable, Hashable
+from logging import getLogger
+
+from attrs import define
+
+from aniwrap.config import CacheConfig
+
+log = getLogger(__name__)
+
+
+@define
+class _CacheEntry[V]:
+    value: V
+    size: int
+    fetched_at: float
+
+
+@define
+class CacheStats:
+    hits: int = 0
+    stale_hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    refresh_errors: int = 0
+    entries: int = 0
+    bytes: int = 0
+
+
+class TTLCache[K: Hashable, V]:
+    """LRU cache with a TTL, bounded both by entry count and (approximate) size.
+
+    Entries older than the TTL are still served for `stale_ttl` more seconds,
+    while a fresh copy is fetched in the background (stale-while-revalidate).
+    """
+
+    def __init__(self, config: CacheConfig) -> None:
+        self.config = config
+        self._entries: OrderedDict[K, _CacheEntry[V]] = OrderedDict()
+        self._bytes = 0
+        self._refreshing: dict[K, asyncio.Task[None]] = {}
+        self._stats = CacheStats()
+
+    async def get_or_fetch(
+        self,
+        key: K,
+        fetch: Callable[[], Awaitable[tuple[V, int]]],
+        refresh: Callable[[], Awaitable[tuple[V, int]]] | None = None,
+    ) -> V:
+        """Returns the cached value for `key`, calling `fetch` if needed.
+
+        Arguments:
+            key: cache key
+            fetch: coroutine function returning the value, and its size in bytes
+            refresh: used instead of `fetch` for background refreshes of stale entries
+
+        Returns:
+            The cached or freshly fetched value
+        """
+        if not self.config.enabled:
+            value, _ = await fetch()
+            return value
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            age = time.monotonic() - entry.fetched_at
+            if age < self.config.ttl:
+                self._stats.hits += 1
+                self._entries.move_to_end(key)
+                return entry.value
+            if age < self.config.ttl + self.config.stale_ttl:
+                self._stats.stale_hits += 1
+                self._entries.move_to_end(key)
+                self._schedule_refresh(key, refresh or fetch)
+                return entry.value
+
+        self._stats.misses += 1
+        value, size = await fetch()
+        self._put(key, value, size)
+        return value
+
+    def get(self, key: K) -> V | None:
+        """Returns the cached value for `key` if it's fresh, without fetching anything."""
+        entry = self._entries.get(key) if self.config.enabled else None
+        if entry is None or time.monotonic() - entry.fetched_at >= self.config.ttl:
+            self._stats.misses += 1
+            return None
+        self._stats.hits += 1
+        self._entries.move_to_end(key)
+        return entry.value
+
+    def put(self, key: K, value: V, size: int) -> None:
+        if self.config.enabled:
+            self._put(key, value, size)
+
+    def stats(self) -> CacheStats:
+        self._stats.entries = len(self._entries)
+        self._stats.bytes = self._bytes
+        return self._stats
+
+    def _schedule_refresh(
+        self, key: K, fetch: Callable[[], Awaitable[tuple[V, int]]]
+    ) -> None:
+        if key in self._refreshing:
+            return
+
+        async def refresh() -> None:
+            try:
+                value, size = await fetch()
+                self._put(key, value, size)
+            except Exception:
+                self._stats.refresh_errors += 1
+                log.exception("Failed to refresh stale cache entry %s", key)
+            finally:
+                self._refreshing.pop(key, None)
+
+        self._refreshing[key] = asyncio.create_task(refresh())
+
+    def _put(self, key: K, value: V, size: int) -> None:
+        if size > self.config.max_bytes:
+            log.warning(
+                "Not caching %s; its size (%d bytes) is over the cache limit", key, size
+            )
+            return
+
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= old.size
+
+        self._entries[key] = _CacheEntry(value, size, time.monotonic())
+        self._bytes += size
+
+        while (
+            len(self._entries) > self.config.max_entries
+            or self._bytes > self.config.max_bytes
+        ):
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.size
+            self._stats.evictions += 1
+
+    async def close(self) -> None:
+        """Cancels any background refreshes that are still running."""
+        for task in list(self._refreshing.values()):
+            task.cancel()
+        await asyncio.gather(*self._refreshing.values(), return_exceptions=True)
@@ -0,0 +1,89 @@
+"""Executor to run CPU-bound stats work off the event loop."""
+
+import asyncio
+import multiprocessing
+import os
+from collections.abc import Callable
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from logging import getLogger
+
+from aniwrap.config import StatsConfig
+from aniwrap.metrics import collect_timings, record_timings
+from aniwrap.service.stats import init_stats_worker
+
+log = getLogger(__name__)
+
+
+class StatsExecutor:
+    """Runs stats jobs on a pool of workers, each with its own DuckDB connection
+    (when the stats are computed with DuckDB).
+
+    At most `max_workers + max_queued` jobs are accepted at a time; any further
+    callers wait (asynchronously) for a slot to open up, instead of piling up
+    an unbounded backlog on the pool.
+    """
+
+    def __init__(self, config: StatsConfig) -> None:
+        max_workers = config.max_workers or os.cpu_count() or 1
+        # the Polars engine doesn't need a connection
+        initializer = init_stats_worker if config.engine == "duckdb" else None
+
+        self._pool: Executor
+        if config.executor == "process":
+            self._pool = ProcessPoolExecutor(
+                max_workers,
+                # forking a process that already has DuckDB/Polars threads running
+                # is asking for trouble
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=initializer,
+                initargs=(config.duckdb_threads,),
+            )
+        else:
+            self._pool = ThreadPoolExecutor(
+                max_workers,
+                thread_name_prefix="aniwrap-stats",
+                initializer=initializer,
+                initargs=(config.duckdb_threads,),
+            )
+        self._max_workers = max_workers
+        self._slots = asyncio.Semaphore(max_workers + config.max_queued)
+        log.info(
+            "Initialized stats executor: %s pool with %d workers, using %s",
+            config.executor,
+            max_workers,
+            config.engine,
+        )
+
+    async def run[**P, T](
+        self, fn: Callable[P, T], *args: P.args, **kwargs: P.kwargs
+    ) -> T:
+        """Runs `fn` on the pool and waits for the result.
+
+        When running on a process pool, `fn` and its arguments must be picklable.
+        """
+        async with self._slots:
+            loop = asyncio.get_running_loop()
+            result, timings = await loop.run_in_executor(
+                self._pool, partial(collect_timings, partial(fn, *args, **kwargs))
+            )
+        record_timings(timings)
+        return result
+
+    async def warm_up(self, fn: Callable[[], object]) -> None:
+        """Starts every worker, by giving them all `fn` to run at once.
+
+        Workers are otherwise started as jobs come in, so the first requests
+        would pay for it (for a process pool, that's a whole interpreter starting
+        up and importing the stats). Timings recorded by `fn` are discarded.
+        """
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(
+            *(
+                loop.run_in_executor(self._pool, partial(collect_timings, fn))
+                for _ in range(self._max_workers)
+            )
+        )
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=True, cancel_futures=True)
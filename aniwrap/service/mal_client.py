@@ -0,0 +1,39 @@
+"""Client for MyAnimeList's REST API (v2)."""
+
+from typing import Any
+
+from aiohttp import ClientSession
+
+from aniwrap.config import MalConfig
+from aniwrap.service.upstream import request_with_retries
+
+
+class MalClient:
+    # MAL doesn't publish a rate limit, or send rate limit headers; going over it
+    # just gets 429s (or, at times, 403s), so there's nothing to schedule around
+    # the way AnilistClient does. Requests are retried with backoff instead.
+
+    def __init__(self, config: MalConfig, http: ClientSession) -> None:
+        self.config = config
+        self.http = http
+
+    async def get(self, path: str, params: dict[str, Any]) -> bytes:
+        """Sends a GET request to the API, retrying on rate limits and server errors.
+
+        Arguments:
+            path: path of the endpoint, relative to `mal.api_base_url`
+            params: query parameters
+
+        Returns:
+            The raw response body
+        """
+        return await request_with_retries(
+            "mal",
+            "MyAnimeList",
+            self.config,
+            lambda: self.http.get(
+                f"{self.config.api_base_url}{path}",
+                params=params,
+                headers={"X-MAL-CLIENT-ID": self.config.client_id},
+            ),
+        )
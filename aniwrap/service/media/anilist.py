@@ -0,0 +1,195 @@
+"""Service to fetch (and cache) AniList media metadata.
+
+Media metadata doesn't depend on whose list it's on, and popular shows are on
+almost every list. So instead of downloading the full media object with every
+list entry, watch lists can be fetched without it, and the media filled in
+from a cache shared between all users; only the misses are looked up upstream.
+"""
+
+import asyncio
+import json
+import math
+from datetime import UTC, datetime, timedelta
+from logging import getLogger
+from typing import Annotated, Any
+
+from fastapi import Depends
+from sqlalchemy import select, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from aniwrap.config import AniwrapConfig, get_config
+from aniwrap.db.dependencies import get_sessionmaker
+from aniwrap.db.models import AnilistMedia
+from aniwrap.metrics import MEDIA_MISSING
+from aniwrap.misc import get_anilist_client, get_media_cache
+from aniwrap.service.anilist_client import AnilistClient, Priority
+from aniwrap.service.anilist_query import ANILIST_MEDIA_PAGE_QUERY
+from aniwrap.service.cache import TTLCache
+
+log = getLogger(__name__)
+
+
+# the most the API returns in one page
+ANILIST_MEDIA_PER_PAGE = 50
+
+
+class AnilistMediaService:
+    def __init__(
+        self,
+        config: Annotated[AniwrapConfig, Depends(get_config)],
+        anilist: Annotated[AnilistClient, Depends(get_anilist_client)],
+        cache: Annotated[TTLCache, Depends(get_media_cache)],
+        sessionmaker: Annotated[
+            async_sessionmaker[AsyncSession], Depends(get_sessionmaker)
+        ],
+    ) -> None:
+        self.config = config
+        self.anilist = anilist
+        self.cache = cache
+        self.sessionmaker = sessionmaker
+
+    async def hydrate(
+        self, collection: dict[str, Any], priority: Priority = Priority.INTERACTIVE
+    ) -> bool:
+        """Fills in the `media` of every entry in a MediaListCollection fetched without it.
+
+        Gives up (returning False, with the collection untouched) if more media is
+        missing from the cache than `media_cache.max_lookup_pages` pages' worth;
+        for a mostly uncached list, fetching the full watch list is cheaper.
+        Entries whose media AniList didn't return are dropped, and counted in
+        the `aniwrap_media_missing_total` metric.
+        """
+        ids = {
+            entry["mediaId"]
+            for watch_list in collection["lists"]
+            for entry in watch_list["entries"]
+        }
+        media = await self.get_many(ids, priority)
+        if media is None:
+            return False
+
+        dropped = 0
+        for watch_list in collection["lists"]:
+            entries = []
+            for entry in watch_list["entries"]:
+                if entry["mediaId"] in media:
+                    entries.append({**entry, "media": media[entry["mediaId"]]})
+                else:
+                    dropped += 1
+            watch_list["entries"] = entries
+
+        if missing := ids - media.keys():
+            log.warning(
+                "AniList did not return media %s; dropped %d entries from the list",
+                sorted(missing),
+                dropped,
+            )
+            MEDIA_MISSING.inc(dropped)
+        return True
+
+    async def get_many(
+        self, ids: set[int], priority: Priority = Priority.INTERACTIVE
+    ) -> dict[int, dict[str, Any]] | None:
+        """Gets the metadata of the given media, from the cache where possible.
+
+        Returns None if too many of them would need to be looked up upstream.
+        """
+        media: dict[int, dict[str, Any]] = {}
+        for media_id in ids:
+            if (m := self.cache.get(media_id)) is not None:
+                media[media_id] = m
+
+        missing = ids - media.keys()
+        if missing and self.config.media_cache.persist:
+            stored = await self._load(missing)
+            for media_id, m in stored.items():
+                self.cache.put(media_id, m, len(json.dumps(m)))
+            media |= stored
+            missing -= stored.keys()
+
+        pages = math.ceil(len(missing) / ANILIST_MEDIA_PER_PAGE)
+        if pages > self.config.media_cache.max_lookup_pages:
+            log.info(
+                "%d media (%d pages) missing from the cache; not looking them up",
+                len(missing),
+                pages,
+            )
+            return None
+
+        if missing:
+            fetched = await self._fetch(sorted(missing), priority)
+            await self.store(fetched)
+            media |= fetched
+
+        return media
+
+    async def store(self, media: dict[int, dict[str, Any]]) -> None:
+        """Puts the given media in the cache (and the database, if enabled)."""
+        for media_id, m in media.items():
+            self.cache.put(media_id, m, len(json.dumps(m)))
+        if media and self.config.media_cache.persist:
+            await self._save(media)
+
+    async def _fetch(
+        self, ids: list[int], priority: Priority
+    ) -> dict[int, dict[str, Any]]:
+        pages = [
+            ids[i : i + ANILIST_MEDIA_PER_PAGE]
+            for i in range(0, len(ids), ANILIST_MEDIA_PER_PAGE)
+        ]
+        bodies = await asyncio.gather(
+            *(
+                self.anilist.query(
+                    ANILIST_MEDIA_PAGE_QUERY,
+                    {"ids": page, "perPage": ANILIST_MEDIA_PER_PAGE},
+                    priority,
+                )
+                for page in pages
+            )
+        )
+
+        media = {}
+        for body in bodies:
+            for m in json.loads(body)["data"]["Page"]["media"]:
+                media_id = m.pop("id")
+                media[media_id] = m
+        log.info("Fetched %d media from AniList", len(media))
+        return media
+
+    async def _load(self, ids: set[int]) -> dict[int, dict[str, Any]]:
+        oldest = datetime.now(UTC).replace(tzinfo=None) - timedelta(
+            seconds=self.config.media_cache.max_age
+        )
+        try:
+            async with self.sessionmaker() as db:
+                rows = await db.execute(
+                    select(AnilistMedia.media_id, AnilistMedia.data).where(
+                        AnilistMedia.media_id.in_(ids),
+                        AnilistMedia.fetched_at >= oldest,
+                    )
+                )
+                return {media_id: data for media_id, data in rows}
+        except (SQLAlchemyError, OSError):
+            log.exception("Failed to load cached media")
+            return {}
+
+    async def _save(self, media: dict[int, dict[str, Any]]) -> None:
+        rows = [{"media_id": media_id, "data": m} for media_id, m in media.items()]
+        try:
+            async with self.sessionmaker() as db:
+                # keeps each statement well under Postgres' limit on bind parameters
+                for i in range(0, len(rows), 1000):
+                    stmt = insert(AnilistMedia).values(rows[i : i + 1000])
+                    stmt = stmt.on_conflict_do_update(
+                        index_elements=["media_id"],
+                        set_={
+                            "data": stmt.excluded.data,
+                            "fetched_at": text("timezone('utc', now())"),
+                        },
+                    )
+                    await db.execute(stmt)
+                await db.commit()
+        except (SQLAlchemyError, OSError):
+            log.exception("Failed to save media to the database")
@@ -0,0 +1,190 @@
+"""Background worker that precomputes the wrapped stats of known users.
+
+Traffic peaks when wrapped season starts, mostly from users who've used the app
+before. So ahead of time, every user in the `users` table has their watch
+history fetched and their stats calculated and stored along with their snapshot
+(see `WrappedService.prewarm`), which makes their `/wrapped` a database lookup.
+
+Upstream requests are sent with `Priority.BACKGROUND`, and no AniList user is
+started on while less than `prewarm.rate_reserve` of the AniList rate limit is
+free, so interactive requests always get the upstream budget first. (MAL doesn't
+say how much of its rate limit is left, so MAL users only have `concurrency`
+holding them back.)
+"""
+
+import asyncio
+import time
+from collections.abc import AsyncIterator
+from logging import getLogger
+
+from aiohttp import ClientResponseError
+from attrs import define
+from fastapi import HTTPException
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from aniwrap.config import PrewarmConfig
+from aniwrap.db.models import ProviderType, User
+from aniwrap.metrics import PREWARM_USERS
+from aniwrap.service.anilist_client import AnilistClient
+from aniwrap.service.wrapped import WrappedService
+
+log = getLogger(__name__)
+
+# seconds between checks of the rate limit, while waiting for it to free up
+_RATE_POLL_INTERVAL = 1.0
+# seconds before retrying a failed pass; doubled with every failure in a row,
+# up to `prewarm.interval`
+_RETRY_DELAY = 30.0
+
+
+@define
+class PrewarmProgress:
+    running: bool = False
+    # passes over the users table since startup, including the current one
+    passes: int = 0
+    # Unix timestamps of the current (or last) pass
+    started_at: float | None = None
+    finished_at: float | None = None
+    # users in the table when the pass started
+    total: int = 0
+    # users handled so far this pass, and what came of them
+    done: int = 0
+    warmed: int = 0
+    skipped: int = 0
+    failed: int = 0
+
+
+class PrewarmWorker:
+    def __init__(
+        self,
+        config: PrewarmConfig,
+        sessionmaker: async_sessionmaker[AsyncSession],
+        anilist: AnilistClient,
+        wrapped: WrappedService,
+    ) -> None:
+        self.config = config
+        self.sessionmaker = sessionmaker
+        self.anilist = anilist
+        self.wrapped = wrapped
+        self._progress = PrewarmProgress()
+        self._task: asyncio.Task[None] | None = None
+
+    def start(self) -> None:
+        if self.config.enabled and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def progress(self) -> PrewarmProgress:
+        return self._progress
+
+    async def _run(self) -> None:
+        await asyncio.sleep(self.config.initial_delay)
+        failures = 0
+        while True:
+            try:
+                await self.run_once()
+            except Exception:
+                # whatever went wrong, the worker has to outlive it
+                failures += 1
+                delay = min(self.config.interval, _RETRY_DELAY * 2 ** (failures - 1))
+                log.exception("Prewarming pass failed; retrying in %.0fs", delay)
+            else:
+                failures = 0
+                delay = self.config.interval
+            await asyncio.sleep(delay)
+
+    async def run_once(self) -> None:
+        """Prewarms every known user once."""
+        progress = self._progress
+        progress.running = True
+        progress.passes += 1
+        progress.started_at, progress.finished_at = time.time(), None
+        progress.done = progress.warmed = progress.skipped = progress.failed = 0
+        try:
+            async with self.sessionmaker() as db:
+                progress.total = await db.scalar(
+                    select(func.count()).where(User.provider.in_(self._providers()))
+                )
+            log.info("Prewarming the stats of %d users", progress.total)
+
+            slots = asyncio.Semaphore(self.config.concurrency)
+            async for batch in self._batches():
+                await asyncio.gather(
+                    *(
+                        self._prewarm(provider, username, slots)
+                        for provider, username in batch
+                    )
+                )
+        finally:
+            progress.running = False
+
+        progress.finished_at = time.time()
+        log.info(
+            "Prewarmed %d users (%d already were, %d failed) in %.0fs",
+            progress.warmed,
+            progress.skipped,
+            progress.failed,
+            progress.finished_at - progress.started_at,
+        )
+
+    def _providers(self) -> list[ProviderType]:
+        # MAL users are skipped when MAL isn't configured
+        if self.wrapped.config.mal is None:
+            return [ProviderType.ANILIST]
+        return list(ProviderType)
+
+    async def _batches(self) -> AsyncIterator[list[tuple[ProviderType, str]]]:
+        # keyset pagination, so users added during the pass don't shift the pages
+        last_id = None
+        while True:
+            query = (
+                select(User.id, User.provider, User.username)
+                .where(User.provider.in_(self._providers()))
+                .order_by(User.id)
+                .limit(self.config.batch_size)
+            )
+            if last_id is not None:
+                query = query.where(User.id > last_id)
+            async with self.sessionmaker() as db:
+                rows = (await db.execute(query)).all()
+            if not rows:
+                return
+            last_id = rows[-1].id
+            yield [(ProviderType(row.provider), row.username) for row in rows]
+
+    async def _prewarm(
+        self, provider: ProviderType, username: str, slots: asyncio.Semaphore
+    ) -> None:
+        async with slots:
+            # MAL doesn't tell us how much of its rate limit is left
+            while (
+                provider == ProviderType.ANILIST
+                and self.anilist.headroom() < self.config.rate_reserve
+            ):
+                await asyncio.sleep(_RATE_POLL_INTERVAL)
+
+            try:
+                warmed = await self.wrapped.prewarm(provider, username)
+            except Exception as e:
+                # one user failing (renamed, deleted, private...) shouldn't stop the pass
+                expected = isinstance(e, (HTTPException, ClientResponseError))
+                log.warning(
+                    "Failed to prewarm %s's stats", username, exc_info=not expected
+                )
+                self._progress.failed += 1
+                result = "failed"
+            else:
+                if warmed:
+                    self._progress.warmed += 1
+                else:
+                    self._progress.skipped += 1
+                result = "warmed" if warmed else "skipped"
+
+        self._progress.done += 1
+        PREWARM_USERS.labels(result).inc()
@@ -0,0 +1,52 @@
+"""Coalescing of concurrent identical work."""
+
+import asyncio
+from collections.abc import Awaitable, Callable, Hashable
+from logging import getLogger
+from typing import Any
+
+from attrs import define
+
+log = getLogger(__name__)
+
+
+@define
+class _Call:
+    task: asyncio.Task[Any]
+    waiters: int = 0
+
+
+class SingleFlight:
+    """Runs at most one call per key at a time; concurrent callers share its result.
+
+    If the call raises, every caller waiting on it gets the exception. A caller
+    being cancelled only stops that caller from waiting; the call itself is
+    cancelled once nobody is waiting on it anymore.
+    """
+
+    def __init__(self) -> None:
+        self._calls: dict[Hashable, _Call] = {}
+
+    async def do[V](self, key: Hashable, fn: Callable[[], Awaitable[V]]) -> V:
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(fn()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _: self._forget(key, call))
+        else:
+            log.debug("Joining in-flight call for %s", key)
+
+        call.waiters += 1
+        try:
+            # shield, so that cancelling one caller doesn't cancel the shared task
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                call.task.cancel()
+                self._forget(key, call)
+
+    def _forget(self, key: Hashable, call: _Call) -> None:
+        # a new call for the same key may have started since this one finished
+        if self._calls.get(key) is call:
+            del self._calls[key]
@@ -0,0 +1,253 @@
+"""Service to persist users' watch histories in the database.
+
+Snapshots survive restarts and are shared between replicas, so a deploy
+doesn't send every returning user straight to the upstream API.
+"""
+
+import io
+from datetime import UTC, datetime, timedelta
+from logging import getLogger
+from typing import Annotated
+
+import polars as pl
+from attrs import define
+from fastapi import Depends
+from sqlalchemy import select, text, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from aniwrap.config import AniwrapConfig, get_config
+from aniwrap.db.dependencies import get_sessionmaker
+from aniwrap.db.models import ProviderType, WatchHistorySnapshot
+from aniwrap.service.stats_state import StatsState
+from aniwrap.types.anilist.columnar import to_watch_history
+
+log = getLogger(__name__)
+
+
+def serialize_dataframe(df: pl.DataFrame) -> bytes:
+    buf = io.BytesIO()
+    df.write_ipc(buf, compression="zstd")
+    return buf.getvalue()
+
+
+def deserialize_dataframe(data: bytes) -> pl.DataFrame:
+    df = pl.read_ipc(io.BytesIO(data))
+    if "mediaId" in df.columns:
+        # taken before watch histories had their own schema; these were all
+        # AniList's fields, already flattened
+        return to_watch_history(df)
+    return df
+
+
+@define
+class Snapshot:
+    df: pl.DataFrame
+    state: StatsState | None
+    max_updated_at: int | None
+    # older than `snapshot.max_age`; should be brought up to date before use
+    stale: bool
+
+
+class SnapshotService:
+    def __init__(
+        self,
+        config: Annotated[AniwrapConfig, Depends(get_config)],
+        sessionmaker: Annotated[
+            async_sessionmaker[AsyncSession], Depends(get_sessionmaker)
+        ],
+    ) -> None:
+        self.config = config
+        # Snapshots are loaded/saved from work shared between requests
+        # (see SingleFlight), so each operation uses its own short-lived session.
+        self.sessionmaker = sessionmaker
+
+    async def load(
+        self, provider: ProviderType, username: str, lo: datetime, hi: datetime
+    ) -> Snapshot | None:
+        """Fetches the user's watch history snapshot, if there is a recent enough one.
+
+        With `snapshot.incremental`, snapshots up to `snapshot.full_refresh_age`
+        old are returned, marked stale past `snapshot.max_age`.
+        Database errors are logged and treated as there being no snapshot;
+        the caller can always fall back to fetching from upstream.
+        """
+        if not self.config.snapshot.enabled:
+            return None
+
+        now = datetime.now(UTC).replace(tzinfo=None)
+        max_age = self.config.snapshot.max_age
+        if self.config.snapshot.incremental:
+            max_age = max(max_age, self.config.snapshot.full_refresh_age)
+        try:
+            async with self.sessionmaker() as db:
+                row = (
+                    await db.execute(
+                        select(
+                            WatchHistorySnapshot.data,
+                            WatchHistorySnapshot.state,
+                            WatchHistorySnapshot.max_updated_at,
+                            WatchHistorySnapshot.fetched_at,
+                        ).where(
+                            WatchHistorySnapshot.provider == provider,
+                            WatchHistorySnapshot.username == username,
+                            WatchHistorySnapshot.range_start == lo.date(),
+                            WatchHistorySnapshot.range_end == hi.date(),
+                            WatchHistorySnapshot.fetched_at
+                            >= now - timedelta(seconds=max_age),
+                        )
+                    )
+                ).one_or_none()
+        except (SQLAlchemyError, OSError):
+            log.exception("Failed to load watch history snapshot for %s", username)
+            return None
+
+        if row is None:
+            return None
+        data, state, max_updated_at, fetched_at = row
+        stale = fetched_at < now - timedelta(seconds=self.config.snapshot.max_age)
+        log.info(
+            "Using %swatch history snapshot for %s", "stale " if stale else "", username
+        )
+        return Snapshot(
+            df=deserialize_dataframe(data),
+            state=StatsState.from_json(state) if state is not None else None,
+            max_updated_at=max_updated_at,
+            stale=stale,
+        )
+
+    async def save(
+        self,
+        provider: ProviderType,
+        username: str,
+        lo: datetime,
+        hi: datetime,
+        df: pl.DataFrame,
+        state: StatsState | None = None,
+        max_updated_at: int | None = None,
+        stats: str | None = None,
+    ) -> None:
+        """Creates or replaces the user's watch history snapshot.
+
+        `max_updated_at` defaults to the highest `updated_at` in `df`. Stats stored
+        for the previous snapshot are replaced with `stats`, since they no longer
+        match; see `save_stats` for storing them once they're calculated.
+        """
+        if not self.config.snapshot.enabled:
+            return
+
+        values = {
+            "provider": provider,
+            "username": username,
+            "range_start": lo.date(),
+            "range_end": hi.date(),
+            "data": serialize_dataframe(df),
+            "max_updated_at": (
+                max_updated_at if max_updated_at is not None else df["updated_at"].max()
+            ),
+            "state": state.to_json() if state is not None else None,
+            "stats": stats,
+        }
+        stmt = insert(WatchHistorySnapshot).values(values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["provider", "username", "range_start", "range_end"],
+            set_={
+                "data": stmt.excluded.data,
+                "max_updated_at": stmt.excluded.max_updated_at,
+                "state": stmt.excluded.state,
+                "stats": stmt.excluded.stats,
+                "fetched_at": text("timezone('utc', now())"),
+            },
+        )
+        try:
+            async with self.sessionmaker() as db:
+                await db.execute(stmt)
+                await db.commit()
+        except (SQLAlchemyError, OSError):
+            log.exception("Failed to save watch history snapshot for %s", username)
+
+    async def load_stats(
+        self, provider: ProviderType, username: str, lo: datetime, hi: datetime
+    ) -> str | None:
+        """Fetches the stats stored for the user's snapshot, if it's up to date.
+
+        Returns:
+            CalculatedStats, serialized to JSON
+        """
+        if not self.config.snapshot.enabled:
+            return None
+
+        now = datetime.now(UTC).replace(tzinfo=None)
+        try:
+            async with self.sessionmaker() as db:
+                return (
+                    await db.execute(
+                        select(WatchHistorySnapshot.stats).where(
+                            WatchHistorySnapshot.provider == provider,
+                            WatchHistorySnapshot.username == username,
+                            WatchHistorySnapshot.range_start == lo.date(),
+                            WatchHistorySnapshot.range_end == hi.date(),
+                            WatchHistorySnapshot.fetched_at
+                            >= now - timedelta(seconds=self.config.snapshot.max_age),
+                        )
+                    )
+                ).scalar_one_or_none()
+        except (SQLAlchemyError, OSError):
+            log.exception("Failed to load stored stats for %s", username)
+            return None
+
+    async def save_stats(
+        self,
+        provider: ProviderType,
+        username: str,
+        lo: datetime,
+        hi: datetime,
+        stats: str,
+    ) -> None:
+        """Stores the stats calculated from the user's current snapshot.
+
+        Arguments:
+            stats: CalculatedStats, serialized to JSON
+        """
+        if not self.config.snapshot.enabled:
+            return
+
+        try:
+            async with self.sessionmaker() as db:
+                await db.execute(
+                    update(WatchHistorySnapshot)
+                    .where(
+                        WatchHistorySnapshot.provider == provider,
+                        WatchHistorySnapshot.username == username,
+                        WatchHistorySnapshot.range_start == lo.date(),
+                        WatchHistorySnapshot.range_end == hi.date(),
+                    )
+                    .values(stats=stats)
+                )
+                await db.commit()
+        except (SQLAlchemyError, OSError):
+            log.exception("Failed to store stats for %s", username)
+
+    async def touch(
+        self, provider: ProviderType, username: str, lo: datetime, hi: datetime
+    ) -> None:
+        """Marks the user's snapshot as up to date, when nothing in it has changed."""
+        if not self.config.snapshot.enabled:
+            return
+
+        try:
+            async with self.sessionmaker() as db:
+                await db.execute(
+                    update(WatchHistorySnapshot)
+                    .where(
+                        WatchHistorySnapshot.provider == provider,
+                        WatchHistorySnapshot.username == username,
+                        WatchHistorySnapshot.range_start == lo.date(),
+                        WatchHistorySnapshot.range_end == hi.date(),
+                    )
+                    .values(fetched_at=text("timezone('utc', now())"))
+                )
+                await db.commit()
+        except (SQLAlchemyError, OSError):
+            log.exception("Failed to update watch history snapshot for %s", username)
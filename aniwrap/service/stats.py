@@ -1,20 +1,34 @@
+import threading
+from collections.abc import Iterator
+from contextlib import contextmanager, suppress
 from datetime import date
 from logging import getLogger
-from typing import Any, TypedDict
+from typing import TYPE_CHECKING, Any, TypedDict
 
-import duckdb
 import polars as pl
 from cattrs import unstructure
+from pydantic import TypeAdapter
 
+from aniwrap.metrics import timed
+from aniwrap.service.stats_state import StatsState
+from aniwrap.types.anilist.columnar import WRAPPED_ENTRY_SCHEMA, to_watch_history
 from aniwrap.types.anilist.watch_history import MediaListCollection
 from aniwrap.types.dto import (
     AnimeData,
     CalculatedStats,
+    GroupStats,
+    StatsDelta,
+    YearlyStats,
     _GroupCounts,
     _MediaAndDate,
+    _SharedAnime,
     _SignatureGenre,
+    _UserOverlap,
 )
 
+if TYPE_CHECKING:
+    import duckdb
+
 log = getLogger(__name__)
 
 
@@ -27,6 +41,96 @@ def _to_date(d: DateDict) -> date | None:
     return date(**d)
 
 
+# genre, decade and format counts
+type GroupedCounts = tuple[list[_GroupCounts], list[_GroupCounts], list[_GroupCounts]]
+
+_ANIME_ADAPTER = TypeAdapter(dict[int, AnimeData])
+
+# how many of the anime shared between users /wrapped/batch lists
+MAX_SHARED_ANIME = 100
+
+# the summary of a year (or user) with no entries
+EMPTY_SUMMARY: dict[str, Any] = {
+    "n": 0,
+    "n_completed": 0,
+    "n_ongoing": 0,
+    "n_dropped": 0,
+    "other_statuses": None,
+    "n_episodes": 0,
+    "avg_score": None,
+    "fraction_non_zero_scores": None,
+    "first_completed_id": None,
+    "first_completed_at": None,
+    "last_completed_id": None,
+    "last_completed_at": None,
+    "signature_genre": None,
+    "signature_genre_count": None,
+    "signature_genre_score": None,
+}
+
+
+# DuckDB's module-level functions all go through one shared default connection.
+# Each stats worker gets its own connection instead, so concurrent stats jobs
+# don't contend over (or clobber the registered views of) a single connection.
+# DuckDB itself is only imported once a connection is made, so it's never
+# loaded with the Polars engine, and isn't part of the app's import time.
+_local = threading.local()
+
+
+def init_stats_worker(duckdb_threads: int) -> None:
+    """Sets up the DuckDB connection for the current worker thread/process."""
+    _local.config = {"threads": duckdb_threads}
+    _get_connection()
+
+
+def _get_connection() -> "duckdb.DuckDBPyConnection":
+    con = getattr(_local, "con", None)
+    if con is None:
+        import duckdb
+
+        # without init_stats_worker (ex: called directly from a script), this
+        # uses DuckDB's default config
+        con = _local.con = duckdb.connect(config=getattr(_local, "config", {}))
+    return con
+
+
+def _drop_connection() -> None:
+    import duckdb
+
+    con, _local.con = getattr(_local, "con", None), None
+    if con is not None:
+        with suppress(duckdb.Error):
+            con.close()
+
+
+def _for_duckdb(df: pl.DataFrame) -> pl.DataFrame:
+    # DuckDB fails on UNNEST of a List(Categorical) column whose lists are all
+    # empty (and that invalidates the whole connection), so genres go over as
+    # plain strings; the Enum columns are fine, DuckDB reads them as VARCHAR anyway
+    return df.with_columns(pl.col("genres").cast(pl.List(pl.String)))
+
+
+@contextmanager
+def _registered(df: pl.DataFrame) -> Iterator["duckdb.DuckDBPyConnection"]:
+    """The worker's connection, with `df` registered as the `watch_history` view."""
+    import duckdb
+
+    con = _get_connection()
+    try:
+        con.register("watch_history", _for_duckdb(df))
+        try:
+            yield con
+        finally:
+            con.unregister("watch_history")
+    except (duckdb.FatalException, duckdb.InternalException):
+        # After a fatal (or internal) error, DuckDB invalidates the database, and
+        # every later query on the connection fails too; so it's replaced with a
+        # new one on the next job, rather than taking the worker down for good.
+        log.warning("DuckDB connection invalidated; opening a new one on next use")
+        _drop_connection()
+        raise
+
+
 class StatisticsService:
     @staticmethod
     def _flatten_anilist_data(data: MediaListCollection) -> list[dict[str, Any]]:
@@ -46,134 +150,608 @@ class StatisticsService:
         return rows
 
     def make_dataframe_from_anilist(self, data: MediaListCollection) -> pl.DataFrame:
-        return pl.from_dicts(self._flatten_anilist_data(data))
+        """Builds the watch history dataframe (see `WATCH_HISTORY_SCHEMA`)."""
+        # the first hundred rows can easily all have null dates (ex: a long
+        # planning list), so the schema is inferred from every row
+        with timed("dataframe"):
+            return to_watch_history(
+                pl.from_dicts(
+                    self._flatten_anilist_data(data), infer_schema_length=None
+                )
+            )
+
+    def make_dataframe_from_anilist_json(self, data: dict[str, Any]) -> pl.DataFrame:
+        """Builds the same dataframe as `make_dataframe_from_anilist`, directly from
+        the MediaListCollection JSON (AniList's, or another provider's normalized
+        into it).
+
+        Each list's entries are loaded in one go against a fixed schema, and the
+        dates are converted column-wise, so no per-entry Python objects are made.
+        """
+        with timed("dataframe"):
+            return self._make_dataframe_from_anilist_json(data)
+
+    def _make_dataframe_from_anilist_json(self, data: dict[str, Any]) -> pl.DataFrame:
+        frames = [
+            pl.from_dicts(
+                watch_list["entries"], schema=WRAPPED_ENTRY_SCHEMA
+            ).with_columns(pl.lit(watch_list["name"], pl.String).alias("list_name"))
+            for watch_list in data["lists"]
+        ]
+        if not frames:
+            frames = [
+                pl.DataFrame(schema=WRAPPED_ENTRY_SCHEMA).with_columns(
+                    pl.lit(None, pl.String).alias("list_name")
+                )
+            ]
+
+        return to_watch_history(
+            pl.concat(frames, how="vertical", rechunk=True).unnest("media")
+        )
 
     def calculate_stats(self, df: pl.DataFrame) -> CalculatedStats:
-        # I've made individual functions for each calculation and delegated to them
-        # otherwise this function would be too long.
-        media = self._get_media(df)
-        n, n_completed, n_ongoing, n_dropped = self._get_counts(df)
-        n_episodes = self._get_episodes_watched_count(df)
-        first_completed = self._get_first_completed(df)
-        last_completed = self._get_last_completed(df)
-        scores_valid = self._get_scores_validity(df)
-        average_score = self._get_average_score(df)
-
-        genre_counts = self._get_genre_counts(df)
-        decade_counts = self._get_decade_counts(df)
-        format_counts = self._get_format_counts(df)
-        signature_genre = self._get_favourite_genre(df)
-
-        return CalculatedStats(
-            n=n,
-            n_completed=n_completed,
-            n_dropped=n_dropped,
-            n_ongoing=n_ongoing,
-            n_episodes=n_episodes,
-            avg_score=average_score,
-            scores_valid=scores_valid,
-            first_completed=first_completed,
-            last_completed=last_completed,
-            genre_counts=genre_counts,
-            decade_counts=decade_counts,
-            format_counts=format_counts,
-            signature_genre=signature_genre,
-            anime={obj["media_id"]: AnimeData.model_validate(obj) for obj in media},
+        # Everything is computed from two queries over the same registered frame:
+        # one for the single-row summary stats, one for the per-group counts.
+        # Running a separate query per stat meant re-scanning the frame a dozen times.
+        with _registered(df) as con:
+            with timed("summary"):
+                summary = self._get_summary(con)
+            with timed("group_counts"):
+                genre_counts, decade_counts, format_counts = self._get_group_counts(con)
+
+        return self._make_stats(summary, genre_counts, decade_counts, format_counts, df)
+
+    def calculate_state(self, df: pl.DataFrame) -> StatsState:
+        """Aggregates the watch history, for `calculate_stats_from_state`."""
+        with timed("state"):
+            return StatsState.from_frame(df, date.today().year)
+
+    def calculate_stats_from_state(
+        self, state: StatsState, df: pl.DataFrame
+    ) -> CalculatedStats:
+        """Same as `calculate_stats`, but from the (already computed) aggregates."""
+        genre_counts, decade_counts, format_counts = (
+            [_GroupCounts(group=group, count=count) for group, count in groups]
+            for groups in state.group_counts()
+        )
+        return self._make_stats(
+            state.summary(), genre_counts, decade_counts, format_counts, df
+        )
+
+    def apply_changes(
+        self,
+        df: pl.DataFrame,
+        state: StatsState,
+        changed_ids: list[int],
+        changed: dict[str, Any],
+    ) -> tuple[pl.DataFrame, StatsState]:
+        """Updates a watch history, and its aggregates, with the entries that changed.
+
+        Arguments:
+            df: the watch history
+            state: its aggregates
+            changed_ids: ids of all the entries that changed, in the date range or not
+            changed: MediaListCollection JSON with the changed entries that are in
+                the date range; the rest of `changed_ids` get removed
+
+        Returns:
+            The updated watch history and aggregates
+        """
+        added = self.make_dataframe_from_anilist_json(changed)
+        is_changed = pl.col("media_id").is_in(changed_ids)
+        removed = df.filter(is_changed)
+
+        # An entry on a custom list has a row for that list too. Changed entries
+        # keep the rows (lists) they had; an entry fetched on its own doesn't say
+        # which lists it's on, so entries new to the range get one unnamed row.
+        replaced = (
+            removed.select("media_id", "list_name")
+            .join(added.drop("list_name"), on="media_id", how="inner")
+            .select(added.columns)
+        )
+        new = added.join(removed.select("media_id"), on="media_id", how="anti")
+        added = pl.concat([replaced, new], how="vertical")
+        merged = pl.concat(
+            [df.filter(~is_changed).select(added.columns), added],
+            how="vertical",
+            rechunk=True,
         )
 
-    def _get_genre_counts(self, df: pl.DataFrame) -> list[_GroupCounts]:
-        res = (
-            duckdb.sql(
-                "SELECT genre, COUNT(*) AS count "
-                "FROM (SELECT UNNEST(genres) AS genre FROM df) "
-                "GROUP BY genre ORDER BY count DESC"
+        year = date.today().year
+        with timed("state"):
+            if state.year != year:
+                # first/last completion are for a different year now
+                return merged, StatsState.from_frame(merged, year)
+            return merged, state.fold(removed, added, merged)
+
+    def calculate_yearly_stats(
+        self, df: pl.DataFrame, start: int, end: int
+    ) -> YearlyStats:
+        """Calculates the stats for each year from `start` to `end` (inclusive),
+        and how they changed from year to year.
+
+        `df` is the watch history for the whole range. Rather than a query per year,
+        the same two queries `calculate_stats` runs are grouped by year.
+        """
+        df = self._with_year(df, start, end)
+        with _registered(df) as con:
+            with timed("summary"):
+                summaries = self._get_grouped_summaries(
+                    con, by="year", completion_year="year"
+                )
+            with timed("group_counts"):
+                group_counts = self._get_grouped_group_counts(con, by="year")
+
+        return self._make_yearly_stats(df, start, end, summaries, group_counts)
+
+    def calculate_batch_stats(
+        self, frames: dict[str, pl.DataFrame]
+    ) -> tuple[dict[str, CalculatedStats], GroupStats]:
+        """Calculates each user's stats, and what the users have in common.
+
+        The watch histories are put together into one frame, so each query runs
+        once for all the users, grouped by user, rather than once per user.
+
+        Arguments:
+            frames: username -> the user's watch history
+
+        Returns:
+            username -> the user's stats, and the stats of the group
+        """
+        df = self._with_username(frames)
+        with _registered(df) as con:
+            with timed("summary"):
+                summaries = self._get_grouped_summaries(
+                    con, by="username", completion_year="DATE_PART('year', NOW())"
+                )
+            with timed("group_counts"):
+                group_counts = self._get_grouped_group_counts(con, by="username")
+            with timed("group"):
+                group = self._get_group_stats(con)
+
+        return self._make_batch_stats(frames, df, summaries, group_counts), group
+
+    def _make_yearly_stats(
+        self,
+        df: pl.DataFrame,
+        start: int,
+        end: int,
+        summaries: dict[Any, dict[str, Any]],
+        group_counts: dict[Any, GroupedCounts],
+    ) -> YearlyStats:
+        # df has the `year` column added by _with_year
+        years: dict[int, CalculatedStats] = {}
+        for year in range(start, end + 1):
+            genre_counts, decade_counts, format_counts = group_counts.get(
+                year, ([], [], [])
             )
-            .pl()
-            .to_dicts()
+            years[year] = self._make_stats(
+                summaries.get(year, EMPTY_SUMMARY),
+                genre_counts,
+                decade_counts,
+                format_counts,
+                df.filter(pl.col("year") == year),
+            )
+
+        return YearlyStats.model_construct(
+            years=years,
+            deltas={
+                year: self._get_delta(years[year - 1], years[year])
+                for year in range(start + 1, end + 1)
+            },
         )
-        return [_GroupCounts(group=i["genre"], count=i["count"]) for i in res]
-
-    def _get_decade_counts(self, df: pl.DataFrame) -> list[_GroupCounts]:
-        res = (
-            duckdb.sql(
-                "SELECT ((seasonYear // 10) * 10)::VARCHAR AS decade, COUNT(*) AS count "
-                "FROM df "
-                "GROUP BY (seasonYear // 10) * 10 "
-                "ORDER BY decade"
+
+    def _make_batch_stats(
+        self,
+        frames: dict[str, pl.DataFrame],
+        df: pl.DataFrame,
+        summaries: dict[Any, dict[str, Any]],
+        group_counts: dict[Any, GroupedCounts],
+    ) -> dict[str, CalculatedStats]:
+        # df has every user's watch history, with the `username` column added
+        # by _with_username
+        users: dict[str, CalculatedStats] = {}
+        for username in frames:
+            genre_counts, decade_counts, format_counts = group_counts.get(
+                username, ([], [], [])
             )
-            .pl()
-            .to_dicts()
+            users[username] = self._make_stats(
+                summaries.get(username, EMPTY_SUMMARY),
+                genre_counts,
+                decade_counts,
+                format_counts,
+                df.filter(pl.col("username") == username),
+            )
+        return users
+
+    @staticmethod
+    def _with_username(frames: dict[str, pl.DataFrame]) -> pl.DataFrame:
+        return pl.concat(
+            [
+                frame.with_columns(pl.lit(username, pl.String).alias("username"))
+                for username, frame in frames.items()
+            ],
+            how="vertical",
+        )
+
+    @staticmethod
+    def _with_year(df: pl.DataFrame, start: int, end: int) -> pl.DataFrame:
+        # An entry is part of the year it was started in, as long as it wasn't
+        # completed in a later year - same as what fetching just that year would
+        # give. Entries without a start date go by their completion date instead.
+        started = pl.col("started_at").dt.year()
+        completed = pl.col("completed_at").dt.year()
+        return df.with_columns(pl.coalesce(started, completed).alias("year")).filter(
+            pl.col("year").is_between(start, end)
+            & (completed.is_null() | (completed == pl.col("year")))
         )
-        return [_GroupCounts(group=i["decade"], count=i["count"]) for i in res]
-
-    def _get_format_counts(self, df: pl.DataFrame) -> list[_GroupCounts]:
-        res = (
-            duckdb.sql(
-                "SELECT format, COUNT(*) AS count "
-                "FROM df "
-                "GROUP BY format "
-                "ORDER BY count"
+
+    @staticmethod
+    def _get_delta(previous: CalculatedStats, current: CalculatedStats) -> StatsDelta:
+        previous_genres = {g["group"]: g["count"] for g in previous.genre_counts}
+        current_genres = {g["group"]: g["count"] for g in current.genre_counts}
+        genre_deltas = [
+            _GroupCounts(
+                group=genre,
+                count=current_genres.get(genre, 0) - previous_genres.get(genre, 0),
             )
-            .pl()
-            .to_dicts()
+            for genre in current_genres.keys() | previous_genres.keys()
+        ]
+        return StatsDelta.model_construct(
+            n=current.n - previous.n,
+            n_completed=current.n_completed - previous.n_completed,
+            n_ongoing=current.n_ongoing - previous.n_ongoing,
+            n_dropped=current.n_dropped - previous.n_dropped,
+            n_episodes=current.n_episodes - previous.n_episodes,
+            avg_score=current.avg_score - previous.avg_score,
+            # biggest changes first
+            genre_counts=sorted(
+                genre_deltas, key=lambda g: (-abs(g["count"]), g["group"] or "")
+            ),
+        )
+
+    def _make_stats(
+        self,
+        summary: dict[str, Any],
+        genre_counts: list[_GroupCounts],
+        decade_counts: list[_GroupCounts],
+        format_counts: list[_GroupCounts],
+        df: pl.DataFrame,
+    ) -> CalculatedStats:
+        with timed("media"):
+            media = self._get_media(df)
+
+        # The summary values come straight out of our own aggregates, so the model
+        # is constructed without validation. The media is still validated, but in
+        # one batch; validating each AnimeData on its own was most of the time
+        # spent on a long list.
+        with timed("validate"):
+            anime = _ANIME_ADAPTER.validate_python(
+                {obj["media_id"]: obj for obj in media}
+            )
+        return CalculatedStats.model_construct(
+            n=summary["n"],
+            n_completed=summary["n_completed"],
+            n_dropped=summary["n_dropped"],
+            n_ongoing=summary["n_ongoing"],
+            n_episodes=summary["n_episodes"],
+            avg_score=self._get_average_score(summary),
+            scores_valid=self._get_scores_validity(summary),
+            first_completed=self._get_first_completed(summary),
+            last_completed=self._get_last_completed(summary),
+            genre_counts=genre_counts,
+            decade_counts=decade_counts,
+            format_counts=format_counts,
+            signature_genre=self._get_favourite_genre(summary),
+            anime=anime,
         )
-        return [_GroupCounts(group=i["format"], count=i["count"]) for i in res]
 
-    def _get_favourite_genre(self, df: pl.DataFrame) -> _SignatureGenre | None:
-        res = duckdb.sql("""
+    def _get_summary(self, con: "duckdb.DuckDBPyConnection") -> dict[str, Any]:
+        rel = con.sql("""
             WITH genre_stats AS (
                 SELECT genre, COUNT(*) AS anime_count, AVG(score) AS avg_score
-                FROM (SELECT UNNEST(genres) AS genre, score FROM df)
+                FROM (SELECT UNNEST(genres) AS genre, score FROM watch_history)
                 WHERE score != 0 AND score IS NOT NULL
                 GROUP BY genre
+            ),
+            signature_genre AS (
+                SELECT
+                    genre AS signature_genre,
+                    anime_count AS signature_genre_count,
+                    avg_score AS signature_genre_score
+                FROM genre_stats
+                ORDER BY anime_count * avg_score DESC, genre ASC
+                LIMIT 1
+            ),
+            totals AS (
+                SELECT
+                    COUNT(*) AS n,
+                    COUNT(*) FILTER (status = 'COMPLETED') AS n_completed,
+                    COUNT(*) FILTER (status = 'CURRENT') AS n_ongoing,
+                    COUNT(*) FILTER (status = 'DROPPED') AS n_dropped,
+                    LIST(DISTINCT status) FILTER (
+                        status NOT IN ('COMPLETED', 'CURRENT', 'DROPPED')
+                    ) AS other_statuses,
+                    COALESCE(SUM(episodes) FILTER (status = 'COMPLETED'), 0)
+                        AS n_episodes,
+                    AVG(score) FILTER (
+                        status = 'COMPLETED' AND score != 0 AND score IS NOT NULL
+                    )::DOUBLE AS avg_score,
+                    -- people will only score anime they've completed, right?
+                    AVG(CASE WHEN score = 0 OR score IS NULL THEN 0 ELSE 1 END)
+                        FILTER (status = 'COMPLETED') AS fraction_non_zero_scores,
+                    ARG_MIN(media_id::VARCHAR, completed_at) FILTER (
+                        DATE_PART('year', completed_at) = DATE_PART('year', NOW())
+                    ) AS first_completed_id,
+                    MIN(completed_at) FILTER (
+                        DATE_PART('year', completed_at) = DATE_PART('year', NOW())
+                    ) AS first_completed_at,
+                    ARG_MAX(media_id::VARCHAR, completed_at) FILTER (
+                        DATE_PART('year', completed_at) = DATE_PART('year', NOW())
+                    ) AS last_completed_id,
+                    MAX(completed_at) FILTER (
+                        DATE_PART('year', completed_at) = DATE_PART('year', NOW())
+                    ) AS last_completed_at
+                FROM watch_history
+            )
+            SELECT * FROM totals LEFT JOIN signature_genre ON TRUE
+        """)
+        row = rel.fetchone()
+        # an aggregate without GROUP BY always returns exactly one row
+        assert row is not None
+        summary = dict(zip(rel.columns, row))
+
+        if summary["other_statuses"]:
+            # I am not exactly certain that only these three statuses exist
+            log.warning(
+                f"Got unexpected values for 'status' while calculating totals: {summary['other_statuses']}"
+            )
+        return summary
+
+    def _get_group_counts(
+        self, con: "duckdb.DuckDBPyConnection"
+    ) -> tuple[list[_GroupCounts], list[_GroupCounts], list[_GroupCounts]]:
+        # Genres need to be unnested, so they can't share the GROUPING SETS
+        # with decade and format - those count entries, not entry-genre pairs.
+        res: list[tuple[str, str, int]] = con.sql("""
+            WITH group_counts AS (
+                SELECT 'genre' AS dimension, genre AS "group", COUNT(*) AS count
+                FROM (SELECT UNNEST(genres) AS genre FROM watch_history)
+                GROUP BY genre
+                UNION ALL
+                SELECT
+                    CASE WHEN GROUPING(decade) = 0 THEN 'decade' ELSE 'format' END,
+                    CASE WHEN GROUPING(decade) = 0 THEN decade ELSE format END,
+                    COUNT(*)
+                FROM (
+                    SELECT ((season_year // 10) * 10)::VARCHAR AS decade, format
+                    FROM watch_history
+                )
+                GROUP BY GROUPING SETS ((decade), (format))
+            )
+            SELECT dimension, "group", count
+            FROM group_counts
+            ORDER BY
+                dimension,
+                CASE dimension WHEN 'genre' THEN -count WHEN 'format' THEN count END,
+                "group"
+        """).fetchall()
+
+        groups: dict[str, list[_GroupCounts]] = {
+            "genre": [],
+            "decade": [],
+            "format": [],
+        }
+        for dimension, group, count in res:
+            groups[dimension].append(_GroupCounts(group=group, count=count))
+        return groups["genre"], groups["decade"], groups["format"]
+
+    def _get_grouped_summaries(
+        self, con: "duckdb.DuckDBPyConnection", by: str, completion_year: str
+    ) -> dict[Any, dict[str, Any]]:
+        # Same as _get_summary, per value of the `by` column (values without any
+        # rows are left out). First/last completion are looked for in the year
+        # given by the `completion_year` SQL expression.
+        rel = con.sql(f"""
+            WITH genre_stats AS (
+                SELECT {by}, genre, COUNT(*) AS anime_count, AVG(score) AS avg_score
+                FROM (SELECT {by}, UNNEST(genres) AS genre, score FROM watch_history)
+                WHERE score != 0 AND score IS NOT NULL
+                GROUP BY {by}, genre
+            ),
+            signature_genre AS (
+                SELECT
+                    {by},
+                    genre AS signature_genre,
+                    anime_count AS signature_genre_count,
+                    avg_score AS signature_genre_score
+                FROM genre_stats
+                QUALIFY ROW_NUMBER() OVER (
+                    PARTITION BY {by} ORDER BY anime_count * avg_score DESC, genre ASC
+                ) = 1
+            ),
+            totals AS (
+                SELECT
+                    {by},
+                    COUNT(*) AS n,
+                    COUNT(*) FILTER (status = 'COMPLETED') AS n_completed,
+                    COUNT(*) FILTER (status = 'CURRENT') AS n_ongoing,
+                    COUNT(*) FILTER (status = 'DROPPED') AS n_dropped,
+                    LIST(DISTINCT status) FILTER (
+                        status NOT IN ('COMPLETED', 'CURRENT', 'DROPPED')
+                    ) AS other_statuses,
+                    COALESCE(SUM(episodes) FILTER (status = 'COMPLETED'), 0)
+                        AS n_episodes,
+                    AVG(score) FILTER (
+                        status = 'COMPLETED' AND score != 0 AND score IS NOT NULL
+                    )::DOUBLE AS avg_score,
+                    AVG(CASE WHEN score = 0 OR score IS NULL THEN 0 ELSE 1 END)
+                        FILTER (status = 'COMPLETED') AS fraction_non_zero_scores,
+                    ARG_MIN(media_id::VARCHAR, completed_at) FILTER (
+                        DATE_PART('year', completed_at) = {completion_year}
+                    ) AS first_completed_id,
+                    MIN(completed_at) FILTER (
+                        DATE_PART('year', completed_at) = {completion_year}
+                    ) AS first_completed_at,
+                    ARG_MAX(media_id::VARCHAR, completed_at) FILTER (
+                        DATE_PART('year', completed_at) = {completion_year}
+                    ) AS last_completed_id,
+                    MAX(completed_at) FILTER (
+                        DATE_PART('year', completed_at) = {completion_year}
+                    ) AS last_completed_at
+                FROM watch_history
+                GROUP BY {by}
+            )
+            SELECT * FROM totals LEFT JOIN signature_genre USING ({by})
+        """)
+        summaries = {
+            row[0]: dict(zip(rel.columns[1:], row[1:])) for row in rel.fetchall()
+        }
+
+        other_statuses = {
+            status
+            for summary in summaries.values()
+            for status in summary["other_statuses"] or []
+        }
+        if other_statuses:
+            log.warning(
+                f"Got unexpected values for 'status' while calculating totals: {sorted(other_statuses)}"
+            )
+        return summaries
+
+    def _get_grouped_group_counts(
+        self, con: "duckdb.DuckDBPyConnection", by: str
+    ) -> dict[Any, GroupedCounts]:
+        # Same as _get_group_counts, per value of the `by` column.
+        res: list[tuple[Any, str, str, int]] = con.sql(f"""
+            WITH group_counts AS (
+                SELECT {by}, 'genre' AS dimension, genre AS "group", COUNT(*) AS count
+                FROM (SELECT {by}, UNNEST(genres) AS genre FROM watch_history)
+                GROUP BY {by}, genre
+                UNION ALL
+                SELECT
+                    {by},
+                    CASE WHEN GROUPING(decade) = 0 THEN 'decade' ELSE 'format' END,
+                    CASE WHEN GROUPING(decade) = 0 THEN decade ELSE format END,
+                    COUNT(*)
+                FROM (
+                    SELECT {by}, ((season_year // 10) * 10)::VARCHAR AS decade, format
+                    FROM watch_history
+                )
+                GROUP BY GROUPING SETS (({by}, decade), ({by}, format))
+            )
+            SELECT {by}, dimension, "group", count
+            FROM group_counts
+            ORDER BY
+                {by},
+                dimension,
+                CASE dimension WHEN 'genre' THEN -count WHEN 'format' THEN count END,
+                "group"
+        """).fetchall()
+
+        groups: dict[Any, dict[str, list[_GroupCounts]]] = {}
+        for key, dimension, group, count in res:
+            key_groups = groups.setdefault(
+                key, {"genre": [], "decade": [], "format": []}
+            )
+            key_groups[dimension].append(_GroupCounts(group=group, count=count))
+        return {
+            key: (g["genre"], g["decade"], g["format"]) for key, g in groups.items()
+        }
+
+    def _get_group_stats(self, con: "duckdb.DuckDBPyConnection") -> GroupStats:
+        shared_genres = con.sql("""
+            SELECT genre, COUNT(DISTINCT username) AS count
+            FROM (SELECT username, UNNEST(genres) AS genre FROM watch_history)
+            GROUP BY genre
+            HAVING count > 1
+            ORDER BY count DESC, genre
+        """).fetchall()
+        shared_anime = con.sql(f"""
+            SELECT media_id, LIST_SORT(LIST(DISTINCT username))
+            FROM watch_history
+            GROUP BY media_id
+            HAVING COUNT(DISTINCT username) > 1
+            ORDER BY COUNT(DISTINCT username) DESC, media_id
+            LIMIT {MAX_SHARED_ANIME}
+        """).fetchall()
+        overlaps = con.sql("""
+            WITH entries AS (SELECT DISTINCT username, media_id FROM watch_history),
+            sizes AS (SELECT username, COUNT(*) AS n FROM entries GROUP BY username)
+            SELECT
+                a.username,
+                b.username,
+                COUNT(*) AS shared,
+                COUNT(*) / (sa.n + sb.n - COUNT(*)) AS similarity
+            FROM entries a
+            JOIN entries b ON a.media_id = b.media_id AND a.username < b.username
+            JOIN sizes sa ON sa.username = a.username
+            JOIN sizes sb ON sb.username = b.username
+            GROUP BY a.username, b.username, sa.n, sb.n
+            ORDER BY similarity DESC, a.username, b.username
+        """).fetchall()
+
+        return GroupStats.model_construct(
+            shared_genres=[
+                _GroupCounts(group=genre, count=count) for genre, count in shared_genres
+            ],
+            shared_anime=[
+                _SharedAnime(media_id=media_id, usernames=usernames)
+                for media_id, usernames in shared_anime
+            ],
+            overlaps=[
+                _UserOverlap(usernames=[a, b], shared=shared, similarity=similarity)
+                for a, b, shared, similarity in overlaps
+            ],
+        )
+
+    def _get_favourite_genre(self, summary: dict[str, Any]) -> _SignatureGenre | None:
+        if summary["signature_genre"] is not None:
+            return _SignatureGenre(
+                name=summary["signature_genre"],
+                anime_count=summary["signature_genre_count"],
+                avg_score=summary["signature_genre_score"],
             )
-            SELECT genre, anime_count, avg_score
-            FROM genre_stats
-            ORDER BY (anime_count * avg_score) DESC
-            LIMIT 1
-        """).fetchone()
-
-        if res:
-            return _SignatureGenre(name=res[0], anime_count=res[1], avg_score=res[2])
         else:
             log.warning(
                 "Favourite genre query did NOT return a result; defaulting to None"
             )
             return None
 
-    def _get_first_completed(self, df: pl.DataFrame) -> _MediaAndDate | None:
-        first_completed_rel = duckdb.sql(
-            "SELECT mediaId::VARCHAR AS media_id, completedAt FROM df "
-            "WHERE DATE_PART('year', completedAt) = DATE_PART('year', NOW()) "
-            "ORDER BY completedAt LIMIT 1"
-        ).fetchone()
-        if first_completed_rel:
+    def _get_first_completed(self, summary: dict[str, Any]) -> _MediaAndDate | None:
+        if summary["first_completed_at"] is not None:
             return _MediaAndDate(
                 {
-                    "media_id": first_completed_rel[0],
-                    "completed_at": first_completed_rel[1],
+                    "media_id": summary["first_completed_id"],
+                    "completed_at": summary["first_completed_at"],
                 }
             )
         else:
             log.warning(
-                f"First completed query did NOT return a result: {first_completed_rel}; defaulting to None"
+                "First completed query did NOT return a result; defaulting to None"
             )
             return None
 
-    def _get_average_score(self, df: pl.DataFrame) -> float:
-        res = duckdb.sql(
-            "SELECT AVG(score)::DOUBLE FROM df "
-            "WHERE status = 'COMPLETED' AND score != 0 AND score IS NOT NULL"
-        ).fetchone()
-        if res and res[0]:
-            return res[0]
+    def _get_last_completed(self, summary: dict[str, Any]) -> _MediaAndDate | None:
+        if summary["last_completed_at"] is not None:
+            return _MediaAndDate(
+                {
+                    "media_id": summary["last_completed_id"],
+                    "completed_at": summary["last_completed_at"],
+                }
+            )
+        return None
+
+    def _get_average_score(self, summary: dict[str, Any]) -> float:
+        if summary["avg_score"]:
+            return summary["avg_score"]
         else:
             log.warning(
-                f"Average score query did NOT return a result: {res}; defaulting to 0"
+                f"Average score query did NOT return a result: {summary['avg_score']}; defaulting to 0"
             )
             return 0.0
 
-    def _get_scores_validity(self, df: pl.DataFrame) -> bool:
+    def _get_scores_validity(self, summary: dict[str, Any]) -> bool:
         # Some users just don't put scores for the anime they watch
         # In which case, doing any computation based on the score field
         # would be meaningless
@@ -181,86 +759,61 @@ class StatisticsService:
         # based on the score field to be VALID.
 
         ENTRIES_SCORED_THRESHOLD = 0.5
-        res = duckdb.sql(
-            "SELECT "
-            "AVG(CASE WHEN score = 0 OR score IS NULL THEN 0 ELSE 1 END) AS fraction_non_zero_scores "
-            "FROM df "
-            "WHERE status = 'COMPLETED'"  # people will only score anime they've completed, right?
-        ).fetchone()
-        if res:
-            return res[0] >= ENTRIES_SCORED_THRESHOLD
+        if summary["fraction_non_zero_scores"] is not None:
+            return summary["fraction_non_zero_scores"] >= ENTRIES_SCORED_THRESHOLD
         else:
             log.warning(
                 "Score validity query did NOT return a result; defaulting to scores being valid."
             )
             return True
 
-    def _get_last_completed(self, df: pl.DataFrame) -> _MediaAndDate | None:
-        last_completed_rel = duckdb.sql(
-            "SELECT mediaId::VARCHAR, completedAt FROM df "
-            "WHERE DATE_PART('year', completedAt) = DATE_PART('year', NOW()) "
-            "ORDER BY completedAt DESC LIMIT 1"
-        ).fetchone()
-        if last_completed_rel:
-            return _MediaAndDate(
-                {
-                    "media_id": last_completed_rel[0],
-                    "completed_at": last_completed_rel[1],
-                }
-            )
-
-    def _get_counts(self, df: pl.DataFrame) -> tuple[int, int, int, int]:
-        total_count = duckdb.sql("SELECT COUNT(*) as cnt FROM df").fetchone()
-        n = total_count[0] if total_count else 0
-
-        # I am not exactly certain that only these three statuses exist
-        # which is why I ran another query for the total anime
-        totals: list[tuple[str, int]] = duckdb.sql(
-            "SELECT status, COUNT(*) as cnt FROM df GROUP BY status"
-        ).fetchall()
-        n_completed, n_ongoing, n_dropped = 0, 0, 0
-        for status, count in totals:
-            match status:
-                case "CURRENT":
-                    n_ongoing = count
-                case "DROPPED":
-                    n_dropped = count
-                case "COMPLETED":
-                    n_completed = count
-                case _:
-                    log.warning(
-                        f"Got unexpected value for 'status' while calculating totals: {status} = {count}"
-                    )
-
-        return n, n_completed, n_ongoing, n_dropped
-
-    def _get_episodes_watched_count(self, df: pl.DataFrame) -> int:
-        episodes_rel = duckdb.sql(
-            "SELECT SUM(episodes) FROM df WHERE status = 'COMPLETED'"
-        ).fetchone()
-        return episodes_rel[0] if episodes_rel else 0
-
     def _get_media(self, df: pl.DataFrame) -> list[dict[str, Any]]:
+        # This is a plain projection, no aggregation involved, so there's
+        # no need to send it through DuckDB at all. The watch history's media
+        # columns are named after AnimeData's fields.
         return (
-            duckdb.sql(
-                "SELECT "
-                " DISTINCT mediaId AS media_id,"
-                " title.userPreferred AS title,"
-                " bannerImage AS banner_url,"
-                " coverImage.medium AS cover_url,"
-                " description, "
-                " averageScore AS average_score,"
-                " meanScore AS mean_score,"
-                " episodes,"
-                " genres,"
-                " season,"
-                " seasonYear AS season_year,"
-                " siteUrl AS site_url,"
-                " isAdult AS is_adult,"
-                " isFavourite AS is_favourite,"
-                " type "
-                "FROM df"
-            )
-            .pl()
+            df.select(list(AnimeData.model_fields))
+            .unique(subset="media_id", keep="first", maintain_order=True)
             .to_dicts()
         )
+
+
+def warm_up_stats_worker(stats: StatisticsService) -> None:
+    """Calculates the stats of a one-entry watch list.
+
+    The first stats job on a worker pays for a lot of one-off setup (imports,
+    the engines' lazy initialization, building validators...); this gets that
+    done before the worker sees any real traffic.
+    """
+    year = date.today().year
+    media = {
+        "averageScore": 0,
+        "bannerImage": "",
+        "coverImage": {"medium": ""},
+        "description": "",
+        "episodes": 1,
+        "genres": ["Action"],
+        "isAdult": False,
+        "isFavourite": False,
+        "meanScore": 0,
+        "season": "WINTER",
+        "seasonYear": year,
+        "siteUrl": "",
+        "title": {"userPreferred": ""},
+        "duration": 24,
+        "format": "TV",
+        "type": "ANIME",
+    }
+    entry = {
+        "mediaId": 0,
+        "score": 1.0,
+        "startedAt": {"year": year, "month": 1, "day": 1},
+        "completedAt": {"year": year, "month": 1, "day": 1},
+        "status": "COMPLETED",
+        "updatedAt": 0,
+        "media": media,
+    }
+    df = stats.make_dataframe_from_anilist_json(
+        {"lists": [{"name": "Completed", "status": "COMPLETED", "entries": [entry]}]}
+    )
+    stats.calculate_stats(df)
@@ -0,0 +1,297 @@
+"""The wrapped stats, computed with Polars alone (`stats.engine = "polars"`).
+
+Same results as StatisticsService's DuckDB queries, but every aggregate is a
+LazyFrame over the one watch history, and they're all collected together with
+`pl.collect_all`; so what they have in common (ex: the exploded genres) is only
+computed once, and no data has to cross over into DuckDB and back.
+
+Everything is aggregated per value of a key column: the year or the username,
+or for a single user's stats, a constant.
+"""
+
+from datetime import date
+from logging import getLogger
+from typing import Any
+
+import polars as pl
+
+from aniwrap.metrics import timed
+from aniwrap.service.stats import (
+    EMPTY_SUMMARY,
+    MAX_SHARED_ANIME,
+    GroupedCounts,
+    StatisticsService,
+)
+from aniwrap.types.dto import (
+    CalculatedStats,
+    GroupStats,
+    YearlyStats,
+    _GroupCounts,
+    _SharedAnime,
+    _UserOverlap,
+)
+
+log = getLogger(__name__)
+
+# the key column for a single user's stats
+_ALL = "_all"
+_KNOWN_STATUSES = ["COMPLETED", "CURRENT", "DROPPED"]
+
+
+def _is_scored() -> pl.Expr:
+    return pl.col("score").is_not_null() & (pl.col("score") != 0)
+
+
+def _genres(lf: pl.LazyFrame, *columns: str) -> pl.LazyFrame:
+    # one row per entry and genre, like UNNEST; rows with no genres shouldn't
+    # come out of it as having a null genre
+    return (
+        lf.select(*columns, "genres")
+        .filter(pl.col("genres").list.len() > 0)
+        .explode("genres")
+        .select(*columns, pl.col("genres").cast(pl.String).alias("genre"))
+    )
+
+
+def _summaries(lf: pl.LazyFrame, by: str, completion_year: pl.Expr) -> pl.LazyFrame:
+    # Same as StatisticsService._get_grouped_summaries.
+    status = pl.col("status")
+    is_completed = status == "COMPLETED"
+    in_year = pl.col("completed_at").dt.year() == completion_year
+    completed_in_year = pl.col("completed_at").filter(in_year)
+
+    def completion_id(descending: bool) -> pl.Expr:
+        # the first row with the earliest (or latest) date, like ARG_MIN/ARG_MAX
+        return (
+            pl.col("media_id")
+            .filter(in_year)
+            .sort_by(completed_in_year, descending=descending, maintain_order=True)
+            .first()
+            .cast(pl.String)
+        )
+
+    totals = lf.group_by(by).agg(
+        pl.len().alias("n"),
+        is_completed.sum().alias("n_completed"),
+        (status == "CURRENT").sum().alias("n_ongoing"),
+        (status == "DROPPED").sum().alias("n_dropped"),
+        status.filter(~status.is_in(_KNOWN_STATUSES))
+        .unique()
+        .cast(pl.String)
+        .alias("other_statuses"),
+        pl.col("episodes").filter(is_completed).sum().alias("n_episodes"),
+        pl.col("score").filter(is_completed & _is_scored()).mean().alias("avg_score"),
+        _is_scored()
+        .filter(is_completed)
+        .cast(pl.Float64)
+        .mean()
+        .alias("fraction_non_zero_scores"),
+        completion_id(descending=False).alias("first_completed_id"),
+        completed_in_year.min().alias("first_completed_at"),
+        completion_id(descending=True).alias("last_completed_id"),
+        completed_in_year.max().alias("last_completed_at"),
+    )
+
+    weight = pl.col("signature_genre_count") * pl.col("signature_genre_score")
+    signature_genres = (
+        _genres(lf.filter(_is_scored()), by, "score")
+        .group_by(by, "genre")
+        .agg(
+            pl.len().alias("signature_genre_count"),
+            pl.col("score").mean().alias("signature_genre_score"),
+        )
+        .rename({"genre": "signature_genre"})
+        .group_by(by)
+        .agg(
+            pl.all()
+            .sort_by(weight, "signature_genre", descending=[True, False])
+            .first()
+        )
+    )
+    return totals.join(signature_genres, on=by, how="left")
+
+
+def _group_counts(lf: pl.LazyFrame, by: str) -> pl.LazyFrame:
+    # Same as StatisticsService._get_grouped_group_counts; one row per key,
+    # dimension and group. Groups are ordered like DuckDB does, nulls last.
+    genres = (
+        _genres(lf, by)
+        .group_by(by, "genre")
+        .agg(pl.len().alias("count"))
+        .sort(by, "count", "genre", descending=[False, True, False], nulls_last=True)
+        .select(
+            by,
+            pl.lit("genre").alias("dimension"),
+            pl.col("genre").alias("group"),
+            "count",
+        )
+    )
+    decades = (
+        lf.group_by(
+            by, ((pl.col("season_year") // 10) * 10).cast(pl.String).alias("group")
+        )
+        .agg(pl.len().alias("count"))
+        .sort(by, "group", nulls_last=True)
+        .select(by, pl.lit("decade").alias("dimension"), "group", "count")
+    )
+    formats = (
+        lf.group_by(by, pl.col("format").cast(pl.String).alias("group"))
+        .agg(pl.len().alias("count"))
+        .sort(by, "count", "group", nulls_last=True)
+        .select(by, pl.lit("format").alias("dimension"), "group", "count")
+    )
+    return pl.concat([genres, decades, formats], how="vertical")
+
+
+def _to_grouped_counts(df: pl.DataFrame, by: str) -> dict[Any, GroupedCounts]:
+    groups: dict[Any, dict[str, list[_GroupCounts]]] = {}
+    for key, dimension, group, count in df.select(
+        by, "dimension", "group", "count"
+    ).iter_rows():
+        key_groups = groups.setdefault(key, {"genre": [], "decade": [], "format": []})
+        key_groups[dimension].append(_GroupCounts(group=group, count=count))
+    return {key: (g["genre"], g["decade"], g["format"]) for key, g in groups.items()}
+
+
+def _to_summaries(df: pl.DataFrame, by: str) -> dict[Any, dict[str, Any]]:
+    summaries = {}
+    for row in df.to_dicts():
+        key = row.pop(by)
+        row["other_statuses"] = row["other_statuses"] or None
+        summaries[key] = row
+
+    other_statuses = {
+        status
+        for summary in summaries.values()
+        for status in summary["other_statuses"] or []
+    }
+    if other_statuses:
+        log.warning(
+            f"Got unexpected values for 'status' while calculating totals: {sorted(other_statuses)}"
+        )
+    return summaries
+
+
+def _group_stats(lf: pl.LazyFrame) -> list[pl.LazyFrame]:
+    # Same as StatisticsService._get_group_stats: shared genres, shared anime,
+    # and the overlap between each pair of users.
+    users = pl.col("username").n_unique()
+    shared_genres = (
+        _genres(lf, "username")
+        .group_by("genre")
+        .agg(users.alias("count"))
+        .filter(pl.col("count") > 1)
+        .sort("count", "genre", descending=[True, False], nulls_last=True)
+    )
+    shared_anime = (
+        lf.group_by("media_id")
+        .agg(users.alias("count"), pl.col("username").unique().sort())
+        .filter(pl.col("count") > 1)
+        .sort("count", "media_id", descending=[True, False])
+        .head(MAX_SHARED_ANIME)
+        .select("media_id", "username")
+    )
+
+    entries = lf.select("username", "media_id").unique()
+    sizes = entries.group_by("username").agg(pl.len().alias("n"))
+    overlaps = (
+        entries.join(entries, on="media_id", suffix="_b")
+        .filter(pl.col("username") < pl.col("username_b"))
+        .group_by("username", "username_b")
+        .agg(pl.len().alias("shared"))
+        .join(sizes, on="username")
+        .join(sizes, left_on="username_b", right_on="username", suffix="_b")
+        .select(
+            "username",
+            "username_b",
+            "shared",
+            (pl.col("shared") / (pl.col("n") + pl.col("n_b") - pl.col("shared"))).alias(
+                "similarity"
+            ),
+        )
+        .sort("similarity", "username", "username_b", descending=[True, False, False])
+    )
+    return [shared_genres, shared_anime, overlaps]
+
+
+class PolarsStatisticsService(StatisticsService):
+    def calculate_stats(self, df: pl.DataFrame) -> CalculatedStats:
+        lf = df.lazy().with_columns(pl.lit(0).alias(_ALL))
+        with timed("aggregate"):
+            summaries, group_counts = pl.collect_all(
+                [
+                    _summaries(lf, _ALL, pl.lit(date.today().year)),
+                    _group_counts(lf, _ALL),
+                ]
+            )
+
+        genre_counts, decade_counts, format_counts = _to_grouped_counts(
+            group_counts, _ALL
+        ).get(0, ([], [], []))
+        return self._make_stats(
+            _to_summaries(summaries, _ALL).get(0, EMPTY_SUMMARY),
+            genre_counts,
+            decade_counts,
+            format_counts,
+            df,
+        )
+
+    def calculate_yearly_stats(
+        self, df: pl.DataFrame, start: int, end: int
+    ) -> YearlyStats:
+        df = self._with_year(df, start, end)
+        lf = df.lazy()
+        with timed("aggregate"):
+            summaries, group_counts = pl.collect_all(
+                [_summaries(lf, "year", pl.col("year")), _group_counts(lf, "year")]
+            )
+
+        return self._make_yearly_stats(
+            df,
+            start,
+            end,
+            _to_summaries(summaries, "year"),
+            _to_grouped_counts(group_counts, "year"),
+        )
+
+    def calculate_batch_stats(
+        self, frames: dict[str, pl.DataFrame]
+    ) -> tuple[dict[str, CalculatedStats], GroupStats]:
+        df = self._with_username(frames)
+        lf = df.lazy()
+        with timed("aggregate"):
+            (
+                summaries,
+                group_counts,
+                shared_genres,
+                shared_anime,
+                overlaps,
+            ) = pl.collect_all(
+                [
+                    _summaries(lf, "username", pl.lit(date.today().year)),
+                    _group_counts(lf, "username"),
+                    *_group_stats(lf),
+                ]
+            )
+
+        group = GroupStats.model_construct(
+            shared_genres=[
+                _GroupCounts(group=genre, count=count)
+                for genre, count in shared_genres.iter_rows()
+            ],
+            shared_anime=[
+                _SharedAnime(media_id=media_id, usernames=usernames)
+                for media_id, usernames in shared_anime.iter_rows()
+            ],
+            overlaps=[
+                _UserOverlap(usernames=[a, b], shared=shared, similarity=similarity)
+                for a, b, shared, similarity in overlaps.iter_rows()
+            ],
+        )
+        users = self._make_batch_stats(
+            frames,
+            df,
+            _to_summaries(summaries, "username"),
+            _to_grouped_counts(group_counts, "username"),
+        )
+        return users, group
@@ -0,0 +1,273 @@
+"""Decomposable aggregates behind the wrapped stats.
+
+Other than the anime metadata, every stat in CalculatedStats comes out of counts
+and sums over the watch history's rows. So when a few entries change, the
+aggregates can be brought up to date by taking away the old rows' share and
+adding the new rows', without going over the rest of the list again.
+
+First/last completion are the exception: they're a min/max, which can't be
+taken away from; they're recomputed from the rows if a removed row was one.
+"""
+
+from datetime import date
+from typing import Any, get_origin
+
+import polars as pl
+from attrs import define, evolve
+from cattrs.preconf.json import make_converter
+
+# group -> count; the group is null where the column is (ex: unknown format)
+type Histogram = dict[str | None, int]
+type Completion = tuple[date, int]
+type _Groups = list[tuple[str | None, int]]
+
+
+def _is_dict(tp: Any) -> bool:
+    return get_origin(getattr(tp, "__value__", tp)) is dict
+
+
+_converter = make_converter()
+# JSON object keys can't be null, so histograms are stored as [group, count] pairs
+_converter.register_unstructure_hook_func(_is_dict, lambda h: list(h.items()))
+_converter.register_structure_hook_func(_is_dict, lambda pairs, _: dict(pairs))
+
+
+def _histogram(column: pl.Series) -> Histogram:
+    counts = column.value_counts()
+    return dict(zip(counts[column.name].to_list(), counts["count"].to_list()))
+
+
+def _combine[T: (int, float)](
+    a: dict[str | None, T], b: dict[str | None, T], sign: int
+) -> dict[str | None, T]:
+    out = dict(a)
+    for key, value in b.items():
+        out[key] = out.get(key, 0) + sign * value
+    return out
+
+
+def _group_order(group: str | None) -> tuple[bool, str]:
+    # same as DuckDB's default; nulls last
+    return group is None, group or ""
+
+
+@define
+class StatsState:
+    # the year that first/last completion are looked for in
+    year: int
+    n: int
+    status_counts: Histogram
+    # episodes of completed entries
+    n_episodes: int
+    # completed entries with a score, and the sum of those scores
+    completed_scored: int
+    completed_score_sum: float
+    genre_counts: Histogram
+    # same as above, but only counting scored entries, and the sum of their scores
+    genre_scored: Histogram
+    genre_score_sum: dict[str | None, float]
+    decade_counts: Histogram
+    format_counts: Histogram
+    first_completed: Completion | None
+    last_completed: Completion | None
+
+    @classmethod
+    def from_frame(cls, df: pl.DataFrame, year: int) -> "StatsState":
+        """Aggregates a watch history dataframe (see StatisticsService)."""
+        is_scored = pl.col("score").is_not_null() & (pl.col("score") != 0)
+        is_completed = pl.col("status") == "COMPLETED"
+        completed = df.filter(is_completed)
+        completed_scored = completed.filter(is_scored)
+
+        # rows with no genres shouldn't count as having a null genre
+        with_genres = df.filter(pl.col("genres").list.len() > 0)
+        genres = with_genres["genres"].explode()
+        scored_genres = (
+            with_genres.filter(is_scored)
+            .select("genres", "score")
+            .explode("genres")
+            .group_by("genres")
+            .agg(pl.len().alias("count"), pl.col("score").sum())
+        )
+
+        decades = df.select(
+            ((pl.col("season_year") // 10) * 10).cast(pl.String).alias("decade")
+        )["decade"]
+
+        return cls(
+            year=year,
+            n=df.height,
+            status_counts=_histogram(df["status"]),
+            n_episodes=completed["episodes"].sum() or 0,
+            completed_scored=completed_scored.height,
+            completed_score_sum=completed_scored["score"].sum() or 0.0,
+            genre_counts=_histogram(genres),
+            genre_scored=dict(
+                zip(scored_genres["genres"].to_list(), scored_genres["count"])
+            ),
+            genre_score_sum=dict(
+                zip(scored_genres["genres"].to_list(), scored_genres["score"])
+            ),
+            decade_counts=_histogram(decades),
+            format_counts=_histogram(df["format"]),
+            first_completed=_completion(df, year, last=False),
+            last_completed=_completion(df, year, last=True),
+        )
+
+    def fold(
+        self, removed: pl.DataFrame, added: pl.DataFrame, merged: pl.DataFrame
+    ) -> "StatsState":
+        """Takes the `removed` rows out of the aggregates, and puts the `added` ones in.
+
+        `merged` is the watch history after the change; it's only looked at if
+        first/last completion need recomputing.
+        """
+        old = StatsState.from_frame(removed, self.year)
+        new = StatsState.from_frame(added, self.year)
+
+        def combine(field: str) -> Any:
+            counts = _combine(getattr(self, field), getattr(new, field), 1)
+            return {
+                k: v
+                for k, v in _combine(counts, getattr(old, field), -1).items()
+                if v != 0
+            }
+
+        genre_scored = combine("genre_scored")
+        state = evolve(
+            self,
+            n=self.n + new.n - old.n,
+            status_counts=combine("status_counts"),
+            n_episodes=self.n_episodes + new.n_episodes - old.n_episodes,
+            completed_scored=(
+                self.completed_scored + new.completed_scored - old.completed_scored
+            ),
+            completed_score_sum=(
+                self.completed_score_sum
+                + new.completed_score_sum
+                - old.completed_score_sum
+            ),
+            genre_counts=combine("genre_counts"),
+            genre_scored=genre_scored,
+            genre_score_sum={
+                k: v
+                for k, v in _combine(
+                    _combine(self.genre_score_sum, new.genre_score_sum, 1),
+                    old.genre_score_sum,
+                    -1,
+                ).items()
+                if k in genre_scored
+            },
+            decade_counts=combine("decade_counts"),
+            format_counts=combine("format_counts"),
+        )
+
+        if (
+            old.first_completed is not None
+            and self.first_completed is not None
+            and old.first_completed <= self.first_completed
+        ) or (
+            old.last_completed is not None
+            and self.last_completed is not None
+            and old.last_completed >= self.last_completed
+        ):
+            return evolve(
+                state,
+                first_completed=_completion(merged, self.year, last=False),
+                last_completed=_completion(merged, self.year, last=True),
+            )
+        return evolve(
+            state,
+            first_completed=min(
+                filter(None, (self.first_completed, new.first_completed)),
+                default=None,
+            ),
+            last_completed=max(
+                filter(None, (self.last_completed, new.last_completed)),
+                default=None,
+            ),
+        )
+
+    def summary(self) -> dict[str, Any]:
+        """The same summary `StatisticsService._get_summary` gets from DuckDB."""
+        n_completed = self.status_counts.get("COMPLETED", 0)
+        # the highest (count * average) score; the first genre by name on a tie,
+        # same as the queries
+        signature_genre = min(
+            self.genre_score_sum,
+            key=lambda g: (-self.genre_score_sum[g], _group_order(g)),
+            default=None,
+        )
+        return {
+            "n": self.n,
+            "n_completed": n_completed,
+            "n_ongoing": self.status_counts.get("CURRENT", 0),
+            "n_dropped": self.status_counts.get("DROPPED", 0),
+            "other_statuses": [
+                s
+                for s in self.status_counts
+                if s not in ("COMPLETED", "CURRENT", "DROPPED")
+            ]
+            or None,
+            "n_episodes": self.n_episodes,
+            "avg_score": (
+                self.completed_score_sum / self.completed_scored
+                if self.completed_scored
+                else None
+            ),
+            "fraction_non_zero_scores": (
+                self.completed_scored / n_completed if n_completed else None
+            ),
+            "first_completed_id": (
+                str(self.first_completed[1]) if self.first_completed else None
+            ),
+            "first_completed_at": (
+                self.first_completed[0] if self.first_completed else None
+            ),
+            "last_completed_id": (
+                str(self.last_completed[1]) if self.last_completed else None
+            ),
+            "last_completed_at": self.last_completed[0]
+            if self.last_completed
+            else None,
+            "signature_genre": signature_genre,
+            "signature_genre_count": (
+                self.genre_scored[signature_genre] if signature_genre else None
+            ),
+            "signature_genre_score": (
+                self.genre_score_sum[signature_genre]
+                / self.genre_scored[signature_genre]
+                if signature_genre
+                else None
+            ),
+        }
+
+    def group_counts(self) -> tuple[_Groups, _Groups, _Groups]:
+        """Genre, decade and format counts, ordered the same as in `_get_group_counts`."""
+        genres = sorted(
+            self.genre_counts.items(), key=lambda kv: (-kv[1], _group_order(kv[0]))
+        )
+        decades = sorted(self.decade_counts.items(), key=lambda kv: _group_order(kv[0]))
+        formats = sorted(
+            self.format_counts.items(), key=lambda kv: (kv[1], _group_order(kv[0]))
+        )
+        return genres, decades, formats
+
+    def to_json(self) -> dict[str, Any]:
+        return _converter.unstructure(self)
+
+    @classmethod
+    def from_json(cls, data: dict[str, Any]) -> "StatsState":
+        return _converter.structure(data, cls)
+
+
+def _completion(df: pl.DataFrame, year: int, last: bool) -> Completion | None:
+    completed = (
+        df.filter(pl.col("completed_at").dt.year() == year)
+        .select("completed_at", "media_id")
+        .sort("completed_at", "media_id", descending=last)
+    )
+    if completed.is_empty():
+        return None
+    completed_at, media_id = completed.row(0)
+    return completed_at, media_id
@@ -0,0 +1,110 @@
+"""Retries and metrics shared by the clients for the upstream APIs.
+
+AniList and MyAnimeList get the same treatment: 429s, 5xx responses and
+connection errors are retried with exponential backoff, and a 429 that's still
+there after the last retry is turned into a 503 for our own clients. What each
+client adds on top (ex: AniList's rate limit bucket) goes in the hooks.
+"""
+
+import asyncio
+import random
+import time
+from collections.abc import Awaitable, Callable
+from contextlib import AbstractAsyncContextManager
+from logging import getLogger
+
+from aiohttp import ClientError, ClientResponse, ClientResponseError
+from fastapi import HTTPException
+
+from aniwrap.config import AnilistConfig, MalConfig
+from aniwrap.metrics import (
+    UPSTREAM_ERRORS,
+    UPSTREAM_REQUEST_SECONDS,
+    UPSTREAM_RESPONSE_BYTES,
+)
+
+log = getLogger(__name__)
+
+_RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def int_header(res: ClientResponse, name: str) -> int | None:
+    value = res.headers.get(name)
+    try:
+        return int(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+async def request_with_retries(
+    upstream: str,
+    display_name: str,
+    config: AnilistConfig | MalConfig,
+    send: Callable[[], AbstractAsyncContextManager[ClientResponse]],
+    before_attempt: Callable[[], Awaitable[None]] | None = None,
+    on_response: Callable[[ClientResponse], None] | None = None,
+) -> bytes:
+    """Sends a request, retrying on rate limits and server errors.
+
+    Arguments:
+        upstream: the upstream's label in the metrics
+        display_name: the upstream's name in logs and errors
+        config: the upstream's retry and backoff settings
+        send: sends the request (ex: `lambda: http.get(...)`); called once per attempt
+        before_attempt: awaited before each attempt
+        on_response: called with every response, before it's checked
+
+    Returns:
+        The raw response body
+    """
+    for attempt in range(config.max_retries + 1):
+        if before_attempt is not None:
+            await before_attempt()
+        start = time.perf_counter()
+        try:
+            async with send() as res:
+                if on_response is not None:
+                    on_response(res)
+                if res.status >= 400:
+                    UPSTREAM_ERRORS.labels(upstream, str(res.status)).inc()
+
+                if res.status not in _RETRY_STATUSES or attempt == config.max_retries:
+                    if res.status == 429:
+                        retry_after = int_header(res, "Retry-After")
+                        raise HTTPException(
+                            status_code=503,
+                            detail=f"{display_name} rate limit reached; try again later",
+                            headers={"Retry-After": str(retry_after or 60)},
+                        )
+                    res.raise_for_status()
+                    body = await res.read()
+                    UPSTREAM_REQUEST_SECONDS.labels(upstream).observe(
+                        time.perf_counter() - start
+                    )
+                    UPSTREAM_RESPONSE_BYTES.labels(upstream).observe(len(body))
+                    return body
+
+                log.warning(
+                    "%s responded with %d; retrying (attempt %d)",
+                    display_name,
+                    res.status,
+                    attempt + 1,
+                )
+        except ClientResponseError:
+            raise
+        except ClientError:
+            UPSTREAM_ERRORS.labels(upstream, "connection").inc()
+            if attempt == config.max_retries:
+                raise
+            log.warning(
+                "Request to %s failed; retrying (attempt %d)",
+                display_name,
+                attempt + 1,
+                exc_info=True,
+            )
+
+        # full jitter, so that retries from concurrent requests spread out
+        backoff = min(config.backoff_max, config.backoff_base * 2**attempt)
+        await asyncio.sleep(random.uniform(0, backoff))
+
+    raise AssertionError("unreachable")
@@ -0,0 +1,101 @@
+"""Records the users whose wrapped stats are looked up, in the `users` table.
+
+Recording a user only adds them to an in-memory set; a background task writes
+the set out every `user_registry.flush_interval` seconds, with one upsert that
+skips users who are already there. So a lookup never waits on the database for
+this, and a user looked up many times between flushes is only written once.
+
+The upsert is one single-row INSERT run for every user (asyncpg's executemany),
+so it's the same statement each time, prepared once per pooled connection, and
+the rows are pipelined rather than sent one round trip at a time.
+
+Users still in the buffer when the process dies are lost, which is harmless:
+they're recorded again on their next lookup.
+"""
+
+import asyncio
+from logging import getLogger
+
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from aniwrap.config import UserRegistryConfig
+from aniwrap.db.models import ProviderType, User
+from aniwrap.metrics import REGISTERED_USERS
+
+log = getLogger(__name__)
+
+_MAX_USERNAME_LENGTH = User.__table__.c.username.type.length
+
+
+class UserRegistry:
+    def __init__(
+        self,
+        config: UserRegistryConfig,
+        sessionmaker: async_sessionmaker[AsyncSession],
+    ) -> None:
+        self.config = config
+        self.sessionmaker = sessionmaker
+        self._pending: set[tuple[ProviderType, str]] = set()
+        self._task: asyncio.Task[None] | None = None
+
+    def record(self, provider: ProviderType, username: str) -> None:
+        """Adds the user to the next flush."""
+        if not self.config.enabled:
+            return
+        if len(username) > _MAX_USERNAME_LENGTH:
+            # wouldn't fit, and would fail the whole flush; no real user's is this long
+            return
+        if len(self._pending) >= self.config.max_pending:
+            REGISTERED_USERS.labels("dropped").inc()
+            return
+        self._pending.add((provider, username))
+
+    def start(self) -> None:
+        if self.config.enabled and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        # whatever was recorded since the last flush
+        await self.flush()
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.config.flush_interval)
+            await self.flush()
+
+    async def flush(self) -> None:
+        """Writes out the users recorded since the last flush."""
+        if not self._pending:
+            return
+        # Sorted, so that replicas flushing the same users at the same time take
+        # the rows' locks in the same order, rather than deadlocking.
+        pending, self._pending = sorted(self._pending), set()
+        stmt = insert(User).on_conflict_do_nothing(
+            index_elements=["provider", "username"]
+        )
+        try:
+            async with self.sessionmaker() as db:
+                await db.execute(
+                    stmt,
+                    [
+                        {"provider": provider, "username": username}
+                        for provider, username in pending
+                    ],
+                )
+                await db.commit()
+        except (SQLAlchemyError, OSError):
+            log.exception("Failed to write %d users to the database", len(pending))
+            # tried again with the next flush, as long as there's room
+            room = max(0, self.config.max_pending - len(self._pending))
+            self._pending.update(pending[:room])
+            if len(pending) > room:
+                REGISTERED_USERS.labels("dropped").inc(len(pending) - room)
+            return
+        REGISTERED_USERS.labels("written").inc(len(pending))
+        log.debug("Wrote %d users to the database", len(pending))
@@ -1,102 +1,85 @@
 """Service to fetch a user's watch history from AniList."""
 
+import asyncio
+import json
 from datetime import datetime
 from logging import getLogger
-from typing import Annotated
+from typing import Annotated, Any
 
-from aiohttp import ClientSession
 from cattrs import structure
 from fastapi import Depends
 
 from aniwrap.config import AniwrapConfig, get_config
-from aniwrap.misc import get_http_client
+from aniwrap.metrics import WATCH_LIST_TRUNCATED, timed
+from aniwrap.misc import (
+    current_year_range,
+    get_anilist_client,
+    get_singleflight,
+    get_watch_history_cache,
+)
+from aniwrap.service.anilist_client import AnilistClient, Priority
+from aniwrap.service.anilist_query import (
+    ANILIST_MEDIALISTCOLLECTION_QUERIES,
+    ANILIST_MEDIALISTCOLLECTION_SLIM_QUERIES,
+    ANILIST_UPDATED_ENTRIES_QUERY,
+    ANILIST_UPDATED_IDS_QUERY,
+    WatchListFields,
+)
+from aniwrap.service.cache import TTLCache
+from aniwrap.service.media.anilist import AnilistMediaService
+from aniwrap.service.singleflight import SingleFlight
 from aniwrap.types.anilist.watch_history import MediaListCollection
 
 log = getLogger(__name__)
 
 
-ANILIST_API_BASE_URL = "https://graphql.anilist.co"
-ANILIST_MEDIALISTCOLLECTION_QUERY = """query ExampleQuery(
-  $userName: String
-  $type: MediaType
-  $sort: [MediaListSort]
-  $completedAtLesser: FuzzyDateInt
-  $startedAtGreater: FuzzyDateInt
-) {
-  MediaListCollection(
-    userName: $userName
-    type: $type
-    sort: $sort
-    completedAt_lesser: $completedAtLesser
-    startedAt_greater: $startedAtGreater
-  ) {
-    lists {
-      name
-      status
-      entries {
-        advancedScores
-        mediaId
-        private
-        score
-        startedAt {
-          year
-          month
-          day
-        }
-        completedAt {
-          year
-          month
-          day
-        }
-        status
-        notes
-        repeat
-        updatedAt
-        media {
-          averageScore
-          bannerImage
-          coverImage {
-            medium
-          }
-          description
-          episodes
-          genres
-          isAdult
-          isFavourite
-          meanScore
-          season
-          seasonYear
-          type
-          siteUrl
-          duration
-          format
-          title {
-            userPreferred
-          }
-        }
-      }
-    }
-    hasNextChunk
-  }
-}
-"""
 ANILIST_MEDIALISTCOLLECTION_VARIABLES = {
     "userName": "",
     "type": "ANIME",
     "startedAtGreater": "",
     "completedAtLesser": "",
     "sort": "FINISHED_ON",
+    "chunk": 1,
+    "perChunk": 500,
 }
+# the most the API returns in one page
+ANILIST_MEDIALIST_PER_PAGE = 50
+
+
+def _merge_chunks(chunks: list[dict[str, Any]]) -> dict[str, Any]:
+    """Merges MediaListCollection chunks into one collection.
+
+    Every chunk has its own `lists`, each holding that chunk's share of the
+    entries; lists with the same name are joined together (in chunk order).
+    """
+    lists: dict[str, dict[str, Any]] = {}
+    for chunk in chunks:
+        for watch_list in chunk["lists"]:
+            if watch_list["name"] in lists:
+                lists[watch_list["name"]]["entries"].extend(watch_list["entries"])
+            else:
+                lists[watch_list["name"]] = {
+                    **watch_list,
+                    "entries": list(watch_list["entries"]),
+                }
+
+    return {"lists": list(lists.values()), "hasNextChunk": chunks[-1]["hasNextChunk"]}
 
 
 class AnilistWatchHistoryService:
     def __init__(
         self,
         config: Annotated[AniwrapConfig, Depends(get_config)],
-        http: Annotated[ClientSession, Depends(get_http_client)],
+        anilist: Annotated[AnilistClient, Depends(get_anilist_client)],
+        cache: Annotated[TTLCache, Depends(get_watch_history_cache)],
+        singleflight: Annotated[SingleFlight, Depends(get_singleflight)],
+        media: Annotated[AnilistMediaService, Depends()],
     ) -> None:
         self.config = config
-        self.http = http
+        self.anilist = anilist
+        self.cache = cache
+        self.singleflight = singleflight
+        self.media = media
         log.debug("Initialized AnilistWatchHistoryService")
 
     async def get_watch_history(
@@ -112,17 +95,148 @@ class AnilistWatchHistoryService:
         Returns:
             MediaListCollection
         """
+        raw = await self.get_watch_history_raw(username, lo, hi)
+        with timed("structure"):
+            return structure(raw, MediaListCollection)
+
+    async def get_watch_history_raw(
+        self,
+        username: str,
+        lo: datetime | None = None,
+        hi: datetime | None = None,
+        priority: Priority = Priority.INTERACTIVE,
+        fields: WatchListFields = WatchListFields.FULL,
+    ) -> dict[str, Any]:
+        """Same as `get_watch_history`, but returns the MediaListCollection JSON as-is.
+
+        Use this when the data is going to be turned into a dataframe anyway;
+        there's no point building the attrs objects just to flatten them again.
+        Pass `Priority.BACKGROUND` for fetches nobody is waiting on, and
+        `WatchListFields.WRAPPED` to only fetch the fields the stats use (the
+        result then can't be structured into a MediaListCollection).
+        """
+        default_lo, default_hi = current_year_range()
         if lo is None:
-            lo = datetime(datetime.today().year - 1, 12, 31)
+            lo = default_lo
 
         if hi is None:
-            hi = datetime(datetime.today().year + 1, 1, 1)
+            hi = default_hi
+
+        key = ("anilist", username, lo.date(), hi.date(), fields)
+        return await self.cache.get_or_fetch(
+            key,
+            lambda: self.singleflight.do(
+                ("watch_history", *key),
+                lambda: self._fetch_watch_history(username, lo, hi, priority, fields),
+            ),
+            refresh=lambda: self.singleflight.do(
+                ("watch_history", *key),
+                lambda: self._fetch_watch_history(
+                    username, lo, hi, Priority.BACKGROUND, fields
+                ),
+            ),
+        )
+
+    async def get_updated_entries(
+        self,
+        username: str,
+        lo: datetime,
+        hi: datetime,
+        since: int,
+        priority: Priority = Priority.INTERACTIVE,
+    ) -> tuple[list[int], dict[str, Any], int] | None:
+        """Fetches the entries of the user's watch list updated at or after `since`.
+
+        Only has the fields `WatchListFields.WRAPPED` does.
+
+        Arguments:
+            username: AniList username
+            lo: lower bound of date range
+            hi: upper bound of date range
+            since: a Unix timestamp, as in `MediaList.updatedAt`
 
+        Returns:
+            The ids of all the updated entries (in the date range or not), the
+            updated entries in the date range as MediaListCollection JSON, and the
+            latest `updatedAt` among them. Or None, if more than
+            `snapshot.max_update_pages` pages of entries were updated.
+        """
+        variables = {
+            "userName": username,
+            "type": "ANIME",
+            "perPage": ANILIST_MEDIALIST_PER_PAGE,
+        }
+        with timed("fetch"):
+            updated_ids, updated_entries = await asyncio.gather(
+                self._fetch_updated(
+                    ANILIST_UPDATED_IDS_QUERY, variables, since, priority
+                ),
+                self._fetch_updated(
+                    ANILIST_UPDATED_ENTRIES_QUERY,
+                    {
+                        **variables,
+                        "startedAtGreater": lo.strftime(r"%Y%m%d"),
+                        "completedAtLesser": hi.strftime(r"%Y%m%d"),
+                    },
+                    since,
+                    priority,
+                ),
+            )
+        if updated_ids is None or updated_entries is None:
+            return None
+
+        # an entry can be updated in between the two queries
+        updated = updated_ids + updated_entries
+        log.info(
+            "%d entries of %s's watch list were updated since %d",
+            len({entry["mediaId"] for entry in updated}),
+            username,
+            since,
+        )
+        return (
+            list({entry["mediaId"] for entry in updated}),
+            {
+                "lists": [{"name": None, "status": None, "entries": updated_entries}],
+                "hasNextChunk": False,
+            },
+            max((entry["updatedAt"] for entry in updated), default=since),
+        )
+
+    async def _fetch_updated(
+        self, query: str, variables: dict[str, Any], since: int, priority: Priority
+    ) -> list[dict[str, Any]] | None:
+        # The entries come most recently updated first, so stop at the first page
+        # that reaches back to before `since`.
+        entries = []
+        for page in range(1, self.config.snapshot.max_update_pages + 1):
+            body = await self.anilist.query(
+                query, {**variables, "page": page}, priority
+            )
+            raw = json.loads(body)["data"]["Page"]
+            updated = [e for e in raw["mediaList"] if e["updatedAt"] >= since]
+            entries.extend(updated)
+            if (
+                len(updated) < len(raw["mediaList"])
+                or not raw["pageInfo"]["hasNextPage"]
+            ):
+                return entries
+        return None
+
+    async def _fetch_watch_history(
+        self,
+        username: str,
+        lo: datetime,
+        hi: datetime,
+        priority: Priority,
+        fields: WatchListFields,
+    ) -> tuple[dict[str, Any], int]:
+        # Returns the collection, and the total size of the responses in bytes
         variables = {
             **ANILIST_MEDIALISTCOLLECTION_VARIABLES,
             "userName": username,
             "startedAtGreater": lo.strftime(r"%Y%m%d"),
             "completedAtLesser": hi.strftime(r"%Y%m%d"),
+            "perChunk": self.config.anilist.per_chunk,
         }
 
         log.info(
@@ -132,18 +246,93 @@ class AnilistWatchHistoryService:
             variables["completedAtLesser"],
         )
 
-        async with self.http.post(
-            ANILIST_API_BASE_URL,
-            json={"query": ANILIST_MEDIALISTCOLLECTION_QUERY, "variables": variables},
-        ) as res:
-            res.raise_for_status()
-            raw = await res.json()
-            log.info("Fetched AniList watch history for user %s", variables["userName"])
+        if self.config.media_cache.enabled:
+            with timed("fetch"):
+                collection, size = await self._fetch_collection(
+                    ANILIST_MEDIALISTCOLLECTION_SLIM_QUERIES[fields],
+                    variables,
+                    priority,
+                )
+            with timed("hydrate"):
+                hydrated = await self.media.hydrate(collection, priority)
+            if hydrated:
+                return collection, size
+            log.info(
+                "Too much of %s's watch list is missing from the media cache; fetching it in full",
+                username,
+            )
+
+        with timed("fetch"):
+            collection, size = await self._fetch_collection(
+                ANILIST_MEDIALISTCOLLECTION_QUERIES[fields], variables, priority
+            )
+        if self.config.media_cache.enabled:
+            await self.media.store(
+                {
+                    entry["mediaId"]: entry["media"]
+                    for watch_list in collection["lists"]
+                    for entry in watch_list["entries"]
+                }
+            )
+        return collection, size
 
-        obj = structure(raw["data"]["MediaListCollection"], MediaListCollection)
-        if obj.hasNextChunk:
+    async def _fetch_collection(
+        self, query: str, variables: dict[str, Any], priority: Priority
+    ) -> tuple[dict[str, Any], int]:
+        # We can't know how many chunks there are until one says it's the last one.
+        # So after the first chunk, the next few are requested together, until a
+        # round contains the last chunk; latency grows with the number of rounds
+        # rather than the number of chunks.
+        chunks, sizes = [], []
+        first_chunk, size = await self._fetch_chunk(query, variables, 1, priority)
+        chunks.append(first_chunk)
+        sizes.append(size)
+        max_chunks = self.config.anilist.max_chunks
+        while chunks[-1]["hasNextChunk"] and len(chunks) < max_chunks:
+            first = len(chunks) + 1
+            last = min(first + self.config.anilist.chunk_concurrency, max_chunks + 1)
+            round_ = await asyncio.gather(
+                *(
+                    self._fetch_chunk(query, variables, i, priority)
+                    for i in range(first, last)
+                )
+            )
+            for chunk, size in round_:
+                chunks.append(chunk)
+                sizes.append(size)
+                if not chunk["hasNextChunk"]:
+                    # anything after this is past the end of the list, and empty
+                    break
+
+        log.info(
+            "Fetched AniList watch history for user %s in %d chunk(s)",
+            variables["userName"],
+            len(chunks),
+        )
+
+        collection = _merge_chunks(chunks)
+        if collection["hasNextChunk"]:
+            WATCH_LIST_TRUNCATED.labels("anilist").inc()
             log.warning(
-                "API says there is more data left to be fetched for username %s, but we have stopped at one chunk",
-                username,
+                "API says there is more data left to be fetched for username %s, but we have stopped at %d chunks",
+                variables["userName"],
+                max_chunks,
             )
-        return obj
+        return collection, sum(sizes)
+
+    async def _fetch_chunk(
+        self, query: str, variables: dict[str, Any], chunk: int, priority: Priority
+    ) -> tuple[dict[str, Any], int]:
+        body = await self.anilist.query(
+            query,
+            {**variables, "chunk": chunk},
+            priority,
+        )
+        log.debug(
+            "Fetched chunk %d of AniList watch history for user %s",
+            chunk,
+            variables["userName"],
+        )
+
+        raw = json.loads(body)
+        return raw["data"]["MediaListCollection"], len(body)
@@ -0,0 +1,348 @@
+"""Service to fetch a user's watch history from MyAnimeList.
+
+MAL's animelist is normalized into the same MediaListCollection JSON that
+AniList returns, so everything downstream (the `/watched` types, the stats
+dataframe, snapshots) works on MAL lists unchanged. Fields MAL doesn't have
+(banners, favourites, advanced scores) are filled in with the nearest thing, or
+left empty.
+"""
+
+import asyncio
+import json
+from datetime import datetime
+from logging import getLogger
+from typing import Annotated, Any
+from urllib.parse import quote
+
+from cattrs import structure
+from fastapi import Depends, HTTPException
+
+from aniwrap.config import AniwrapConfig, get_config
+from aniwrap.metrics import WATCH_LIST_TRUNCATED, timed
+from aniwrap.misc import (
+    current_year_range,
+    get_mal_client,
+    get_singleflight,
+    get_watch_history_cache,
+)
+from aniwrap.service.anilist_client import Priority
+from aniwrap.service.anilist_query import WatchListFields
+from aniwrap.service.cache import TTLCache
+from aniwrap.service.mal_client import MalClient
+from aniwrap.service.singleflight import SingleFlight
+from aniwrap.types.anilist.watch_history import MediaListCollection
+
+log = getLogger(__name__)
+
+
+# everything the normalized entries are made from
+MAL_ANIMELIST_FIELDS = (
+    "list_status{status,score,is_rewatching,num_times_rewatched,start_date,"
+    "finish_date,updated_at,comments},title,main_picture,synopsis,mean,"
+    "num_episodes,average_episode_duration,genres,start_season,media_type,rating"
+)
+# entries per page when looking for updated entries; most refreshes only need one
+MAL_UPDATED_PER_PAGE = 100
+
+# MAL list status -> AniList status, and the name of the list it's on
+_STATUSES = {
+    "watching": ("CURRENT", "Watching"),
+    "completed": ("COMPLETED", "Completed"),
+    "on_hold": ("PAUSED", "On-Hold"),
+    "dropped": ("DROPPED", "Dropped"),
+    "plan_to_watch": ("PLANNING", "Plan to Watch"),
+}
+_REWATCHING = ("REPEATING", "Rewatching")
+# MAL media types without an AniList format of the same name
+_FORMATS = {"tv_special": "SPECIAL", "cm": "SPECIAL", "pv": "SPECIAL"}
+_NO_ADVANCED_SCORES = {
+    "Story": 0,
+    "Characters": 0,
+    "Visuals": 0,
+    "Audio": 0,
+    "Enjoyment": 0,
+}
+
+
+def _to_fuzzy_date(value: str | None) -> dict[str, int | None]:
+    # MAL dates can be partial: "2024-05-17", "2024-05" or "2024"
+    parts = [int(part) for part in value.split("-")] if value else []
+    parts += [None] * (3 - len(parts))
+    return dict(zip(("year", "month", "day"), parts))
+
+
+def _fuzzy_date_int(d: dict[str, int | None]) -> int | None:
+    # same as AniList's FuzzyDateInt, which its date filters compare
+    if d["year"] is None:
+        return None
+    return d["year"] * 10_000 + (d["month"] or 0) * 100 + (d["day"] or 0)
+
+
+def _to_media(node: dict[str, Any]) -> dict[str, Any]:
+    picture = node.get("main_picture") or {}
+    season = node.get("start_season") or {}
+    mean = node.get("mean")
+    score = round(mean * 10) if mean is not None else None
+    duration = node.get("average_episode_duration")
+    media_type = node.get("media_type") or "unknown"
+    # Media's strings are never null; MAL leaves these out for obscure entries,
+    # while the scores and season are null, same as AniList's for such media
+    return {
+        "averageScore": score,
+        "bannerImage": picture.get("large") or picture.get("medium") or "",
+        "coverImage": {"medium": picture.get("medium") or ""},
+        "description": node.get("synopsis") or "",
+        # 0 when MAL doesn't know yet
+        "episodes": node.get("num_episodes") or None,
+        "genres": [genre["name"] for genre in node.get("genres", [])],
+        "isAdult": node.get("rating") == "rx",
+        # MAL's API doesn't expose a user's favourites
+        "isFavourite": False,
+        "meanScore": score,
+        "season": season["season"].upper() if season.get("season") else None,
+        "seasonYear": season.get("year"),
+        "siteUrl": f"https://myanimelist.net/anime/{node['id']}",
+        "title": {"userPreferred": node["title"]},
+        # MAL's is in seconds
+        "duration": round(duration / 60) if duration else None,
+        "format": _FORMATS.get(media_type, media_type.upper()),
+        "type": "ANIME",
+    }
+
+
+def _to_entry(item: dict[str, Any]) -> tuple[str, dict[str, Any]]:
+    # Returns the name of the list the entry is on, and the entry as a MediaList.
+    node, list_status = item["node"], item["list_status"]
+    status, list_name = (
+        _REWATCHING
+        if list_status.get("is_rewatching")
+        else _STATUSES[list_status["status"]]
+    )
+    return list_name, {
+        "advancedScores": _NO_ADVANCED_SCORES,
+        "mediaId": node["id"],
+        "private": False,
+        "score": float(list_status.get("score", 0)),
+        "startedAt": _to_fuzzy_date(list_status.get("start_date")),
+        "completedAt": _to_fuzzy_date(list_status.get("finish_date")),
+        "repeat": list_status.get("num_times_rewatched", 0),
+        "updatedAt": int(datetime.fromisoformat(list_status["updated_at"]).timestamp()),
+        "status": status,
+        "notes": list_status.get("comments") or None,
+        "media": _to_media(node),
+    }
+
+
+def _in_range(entry: dict[str, Any], lo: datetime, hi: datetime) -> bool:
+    # Filters like AniList's startedAt_greater/completedAt_lesser do, which MAL
+    # can't do itself. Entries without any dates can't be placed in the range.
+    started = _fuzzy_date_int(entry["startedAt"])
+    completed = _fuzzy_date_int(entry["completedAt"])
+    if started is None and completed is None:
+        return False
+    return (started is None or started > int(lo.strftime(r"%Y%m%d"))) and (
+        completed is None or completed < int(hi.strftime(r"%Y%m%d"))
+    )
+
+
+def _to_collection(
+    items: list[dict[str, Any]], lo: datetime, hi: datetime, has_more: bool
+) -> dict[str, Any]:
+    lists: dict[str, dict[str, Any]] = {}
+    for item in items:
+        list_name, entry = _to_entry(item)
+        if not _in_range(entry, lo, hi):
+            continue
+        lists.setdefault(
+            list_name, {"name": list_name, "status": entry["status"], "entries": []}
+        )["entries"].append(entry)
+    return {"lists": list(lists.values()), "hasNextChunk": has_more}
+
+
+class MalWatchHistoryService:
+    def __init__(
+        self,
+        config: Annotated[AniwrapConfig, Depends(get_config)],
+        mal: Annotated[MalClient | None, Depends(get_mal_client)],
+        cache: Annotated[TTLCache, Depends(get_watch_history_cache)],
+        singleflight: Annotated[SingleFlight, Depends(get_singleflight)],
+    ) -> None:
+        self.config = config
+        self._mal = mal
+        self.cache = cache
+        self.singleflight = singleflight
+
+    @property
+    def mal(self) -> MalClient:
+        if self._mal is None:
+            raise HTTPException(
+                status_code=503, detail="MyAnimeList isn't supported on this server"
+            )
+        return self._mal
+
+    async def get_watch_history(
+        self, username: str, lo: datetime | None = None, hi: datetime | None = None
+    ) -> MediaListCollection:
+        """Fetches the watch list for the specified user, in the given date range.
+
+        Arguments:
+            username: MyAnimeList username
+            lo: lower bound of date range; defaults to the beginning of the current year
+            hi: upper bound of date range; defaults to the end of the current year
+
+        Returns:
+            MediaListCollection
+        """
+        raw = await self.get_watch_history_raw(username, lo, hi)
+        with timed("structure"):
+            return structure(raw, MediaListCollection)
+
+    async def get_watch_history_raw(
+        self,
+        username: str,
+        lo: datetime | None = None,
+        hi: datetime | None = None,
+        priority: Priority = Priority.INTERACTIVE,
+        fields: WatchListFields = WatchListFields.FULL,
+    ) -> dict[str, Any]:
+        """Same as `get_watch_history`, but returns the MediaListCollection JSON as-is.
+
+        Takes the same arguments as AnilistWatchHistoryService's. MAL has no field
+        selection, so the result always has every field; and no rate limit to
+        prioritize requests against, so `priority` has no effect.
+        """
+        default_lo, default_hi = current_year_range()
+        if lo is None:
+            lo = default_lo
+
+        if hi is None:
+            hi = default_hi
+
+        key = ("mal", username, lo.date(), hi.date())
+        return await self.cache.get_or_fetch(
+            key,
+            lambda: self.singleflight.do(
+                ("watch_history", *key),
+                lambda: self._fetch_watch_history(username, lo, hi),
+            ),
+        )
+
+    async def get_updated_entries(
+        self,
+        username: str,
+        lo: datetime,
+        hi: datetime,
+        since: int,
+        priority: Priority = Priority.INTERACTIVE,
+    ) -> tuple[list[int], dict[str, Any], int] | None:
+        """Fetches the entries of the user's watch list updated at or after `since`.
+
+        Same as AnilistWatchHistoryService's; returns the ids of all the updated
+        entries, the updated entries in the date range as MediaListCollection
+        JSON, and the latest `updatedAt` among them. Or None, if more than
+        `snapshot.max_update_pages` pages of entries were updated.
+        """
+        updated: list[dict[str, Any]] = []
+        with timed("fetch"):
+            for page in range(self.config.snapshot.max_update_pages):
+                items, has_next, _ = await self._fetch_page(
+                    username,
+                    page * MAL_UPDATED_PER_PAGE,
+                    MAL_UPDATED_PER_PAGE,
+                    sort="list_updated_at",
+                )
+                entries = [_to_entry(item)[1] for item in items]
+                recent = [e for e in entries if e["updatedAt"] >= since]
+                updated.extend(recent)
+                if len(recent) < len(entries) or not has_next:
+                    break
+            else:
+                return None
+
+        log.info(
+            "%d entries of %s's watch list were updated since %d",
+            len(updated),
+            username,
+            since,
+        )
+        in_range = [entry for entry in updated if _in_range(entry, lo, hi)]
+        return (
+            [entry["mediaId"] for entry in updated],
+            {
+                "lists": [{"name": None, "status": None, "entries": in_range}],
+                "hasNextChunk": False,
+            },
+            max((entry["updatedAt"] for entry in updated), default=since),
+        )
+
+    async def _fetch_watch_history(
+        self, username: str, lo: datetime, hi: datetime
+    ) -> tuple[dict[str, Any], int]:
+        # Returns the collection, and the total size of the responses in bytes.
+        # Same as with AniList's chunks, there's no telling how many pages there
+        # are until one of them is the last, so they're requested a few at a time.
+        log.info(
+            "Fetching MyAnimeList watch history for %s; date range %s - %s",
+            username,
+            lo.date(),
+            hi.date(),
+        )
+        mal_config = self.mal.config
+        page_size, max_pages = mal_config.page_size, mal_config.max_pages
+
+        with timed("fetch"):
+            items, has_next, size = await self._fetch_page(username, 0, page_size)
+            pages, total_size = 1, size
+            while has_next and pages < max_pages:
+                round_ = await asyncio.gather(
+                    *(
+                        self._fetch_page(username, i * page_size, page_size)
+                        for i in range(
+                            pages, min(pages + mal_config.page_concurrency, max_pages)
+                        )
+                    )
+                )
+                for page_items, has_next, size in round_:
+                    items.extend(page_items)
+                    total_size += size
+                    pages += 1
+                    if not has_next:
+                        # anything after this is past the end of the list, and empty
+                        break
+
+        log.info(
+            "Fetched MyAnimeList watch history for user %s in %d page(s)",
+            username,
+            pages,
+        )
+        if has_next:
+            WATCH_LIST_TRUNCATED.labels("mal").inc()
+            log.warning(
+                "API says there is more data left to be fetched for username %s, but we have stopped at %d pages",
+                username,
+                max_pages,
+            )
+        return _to_collection(items, lo, hi, has_next), total_size
+
+    async def _fetch_page(
+        self, username: str, offset: int, limit: int, sort: str | None = None
+    ) -> tuple[list[dict[str, Any]], bool, int]:
+        # Returns the page's items, whether there's a next page, and the size of
+        # the response in bytes.
+        params: dict[str, Any] = {
+            "fields": MAL_ANIMELIST_FIELDS,
+            "limit": limit,
+            "offset": offset,
+            "nsfw": "true",
+        }
+        if sort is not None:
+            params["sort"] = sort
+        body = await self.mal.get(f"/users/{quote(username)}/animelist", params)
+        log.debug(
+            "Fetched MyAnimeList watch history page at offset %d for user %s",
+            offset,
+            username,
+        )
+
+        raw = json.loads(body)
+        return raw["data"], "next" in raw.get("paging", {}), len(body)
@@ -0,0 +1,361 @@
+"""Service to calculate users' wrapped stats.
+
+Puts together the watch history, snapshot and stats services: a user's stats
+come from their snapshot where there is one, brought up to date with just the
+entries they've updated since, and from their full watch history otherwise.
+The current year's stats are stored along with the snapshot, so until it goes
+stale they're served without being recalculated.
+"""
+
+import asyncio
+from datetime import datetime
+from logging import getLogger
+from typing import Annotated, Any
+
+import polars as pl
+from aiohttp import ClientResponseError
+from fastapi import Depends, HTTPException
+
+from aniwrap.config import AniwrapConfig, get_config
+from aniwrap.db.models import ProviderType
+from aniwrap.metrics import timed
+from aniwrap.misc import (
+    current_year_range,
+    get_singleflight,
+    get_statistics_service,
+    get_stats_executor,
+    get_user_registry,
+)
+from aniwrap.service.anilist_client import Priority
+from aniwrap.service.anilist_query import WatchListFields
+from aniwrap.service.executor import StatsExecutor
+from aniwrap.service.singleflight import SingleFlight
+from aniwrap.service.snapshot import Snapshot, SnapshotService
+from aniwrap.service.stats import StatisticsService
+from aniwrap.service.user_registry import UserRegistry
+from aniwrap.service.watch_history.anilist import AnilistWatchHistoryService
+from aniwrap.service.watch_history.mal import MalWatchHistoryService
+from aniwrap.types.dto import BatchStats, GroupStats
+
+log = getLogger(__name__)
+
+
+class WrappedService:
+    def __init__(
+        self,
+        anilist_watch_history: Annotated[AnilistWatchHistoryService, Depends()],
+        mal_watch_history: Annotated[MalWatchHistoryService, Depends()],
+        stats: Annotated[StatisticsService, Depends(get_statistics_service)],
+        stats_executor: Annotated[StatsExecutor, Depends(get_stats_executor)],
+        snapshots: Annotated[SnapshotService, Depends()],
+        singleflight: Annotated[SingleFlight, Depends(get_singleflight)],
+        users: Annotated[UserRegistry, Depends(get_user_registry)],
+        config: Annotated[AniwrapConfig, Depends(get_config)],
+    ) -> None:
+        self.watch_history_services: dict[
+            ProviderType, AnilistWatchHistoryService | MalWatchHistoryService
+        ] = {
+            ProviderType.ANILIST: anilist_watch_history,
+            ProviderType.MAL: mal_watch_history,
+        }
+        self.stats = stats
+        self.stats_executor = stats_executor
+        self.snapshots = snapshots
+        self.singleflight = singleflight
+        self.users = users
+        self.config = config
+
+    async def get_wrapped_json(self, provider: ProviderType, username: str) -> str:
+        """Calculates the user's wrapped stats for the current year.
+
+        Returns:
+            CalculatedStats, serialized to JSON
+        """
+        lo, hi = current_year_range()
+        stored = await self.snapshots.load_stats(provider, username, lo, hi)
+        if stored is None:
+            # a popular wrapped link means lots of identical requests at the same time
+            stored = await self.singleflight.do(
+                ("wrapped", provider, username, lo.date(), hi.date()),
+                lambda: self._calculate(provider, username, lo, hi),
+            )
+        # only users whose stats could be calculated, so the prewarm worker
+        # doesn't go through made up usernames
+        self.users.record(provider, username)
+        return stored
+
+    async def prewarm(self, provider: ProviderType, username: str) -> bool:
+        """Calculates and stores the user's wrapped stats for the current year,
+        unless they're already stored. Upstream requests are sent with
+        `Priority.BACKGROUND`.
+
+        Returns:
+            Whether the stats had to be calculated
+        """
+        lo, hi = current_year_range()
+        if await self.snapshots.load_stats(provider, username, lo, hi) is not None:
+            return False
+
+        # shares the key with get_wrapped_json, so the user showing up in the
+        # meantime doesn't fetch it all over again
+        await self.singleflight.do(
+            ("wrapped", provider, username, lo.date(), hi.date()),
+            lambda: self._calculate(provider, username, lo, hi, Priority.BACKGROUND),
+        )
+        return True
+
+    async def _calculate(
+        self,
+        provider: ProviderType,
+        username: str,
+        lo: datetime,
+        hi: datetime,
+        priority: Priority = Priority.INTERACTIVE,
+    ) -> str:
+        snapshot = await self.snapshots.load(provider, username, lo, hi)
+        if snapshot is not None and snapshot.stale:
+            snapshot = await self._update(
+                provider, username, lo, hi, snapshot, priority
+            )
+        if snapshot is not None:
+            if snapshot.state is not None:
+                result = await self.stats_executor.run(
+                    self.stats.calculate_stats_from_state, snapshot.state, snapshot.df
+                )
+            else:
+                # saved without its aggregates, as they're only needed for updating
+                result = await self.stats_executor.run(
+                    self.stats.calculate_stats, snapshot.df
+                )
+            with timed("serialize"):
+                stats = result.model_dump_json()
+            await self.snapshots.save_stats(provider, username, lo, hi, stats)
+            return stats
+
+        df = await self._fetch(provider, username, lo, hi, priority)
+        result = await self.stats_executor.run(self.stats.calculate_stats, df)
+        # serialized here, so coalesced requests share the JSON too
+        with timed("serialize"):
+            stats = result.model_dump_json()
+        await self.snapshots.save_stats(provider, username, lo, hi, stats)
+        return stats
+
+    async def get_yearly_wrapped_json(
+        self, provider: ProviderType, username: str, start: int, end: int
+    ) -> str:
+        """Calculates the user's wrapped stats for each year from `start` to `end`
+        (inclusive), from a single fetch of their watch history.
+
+        Returns:
+            YearlyStats, serialized to JSON
+        """
+        lo, hi = datetime(start - 1, 12, 31), datetime(end + 1, 1, 1)
+        result = await self.singleflight.do(
+            ("wrapped-years", provider, username, lo.date(), hi.date()),
+            lambda: self._calculate_yearly(provider, username, lo, hi, start, end),
+        )
+        self.users.record(provider, username)
+        return result
+
+    async def _calculate_yearly(
+        self,
+        provider: ProviderType,
+        username: str,
+        lo: datetime,
+        hi: datetime,
+        start: int,
+        end: int,
+    ) -> str:
+        df = await self._load(provider, username, lo, hi)
+        result = await self.stats_executor.run(
+            self.stats.calculate_yearly_stats, df, start, end
+        )
+        with timed("serialize"):
+            return result.model_dump_json()
+
+    async def get_batch_wrapped_json(
+        self, provider: ProviderType, usernames: list[str]
+    ) -> str:
+        """Calculates the wrapped stats of each of the users for the current year,
+        and what they have in common.
+
+        Users whose stats can't be calculated (ex: they don't exist) are left out,
+        with the reason in `BatchStats.errors`.
+
+        Returns:
+            BatchStats, serialized to JSON
+        """
+        lo, hi = current_year_range()
+        usernames = list(dict.fromkeys(usernames))
+        slots = asyncio.Semaphore(self.config.wrapped.batch_concurrency)
+
+        async def load(username: str) -> pl.DataFrame:
+            async with slots:
+                return await self._load(provider, username, lo, hi)
+
+        results = await asyncio.gather(
+            *(load(username) for username in usernames), return_exceptions=True
+        )
+        frames: dict[str, pl.DataFrame] = {}
+        errors: dict[str, str] = {}
+        for username, result in zip(usernames, results):
+            if isinstance(result, pl.DataFrame):
+                frames[username] = result
+                self.users.record(provider, username)
+            elif isinstance(result, Exception):
+                errors[username] = _describe_error(result)
+                expected = isinstance(result, (HTTPException, ClientResponseError))
+                log.warning(
+                    "Leaving %s out of a batch: %s",
+                    username,
+                    errors[username],
+                    exc_info=None if expected else result,
+                )
+            else:
+                # cancelled and the like
+                raise result
+
+        if frames:
+            users, group = await self.stats_executor.run(
+                self.stats.calculate_batch_stats, frames
+            )
+        else:
+            # none of the users' stats could be calculated; still a partial result
+            users = {}
+            group = GroupStats.model_construct(
+                shared_genres=[], shared_anime=[], overlaps=[]
+            )
+        result = BatchStats.model_construct(users=users, errors=errors, group=group)
+        with timed("serialize"):
+            return result.model_dump_json()
+
+    async def _load(
+        self, provider: ProviderType, username: str, lo: datetime, hi: datetime
+    ) -> pl.DataFrame:
+        # The watch history from the snapshot, brought up to date if it's stale, or
+        # fetched in full.
+        snapshot = await self.snapshots.load(provider, username, lo, hi)
+        if snapshot is not None and snapshot.stale:
+            snapshot = await self._update(provider, username, lo, hi, snapshot)
+        if snapshot is not None:
+            return snapshot.df
+        return await self._fetch(provider, username, lo, hi)
+
+    async def _fetch(
+        self,
+        provider: ProviderType,
+        username: str,
+        lo: datetime,
+        hi: datetime,
+        priority: Priority = Priority.INTERACTIVE,
+    ) -> pl.DataFrame:
+        # Fetches the watch history in full, and snapshots it.
+        data = await self.watch_history_services[provider].get_watch_history_raw(
+            username, lo, hi, priority, WatchListFields.WRAPPED
+        )
+        df = await self.stats_executor.run(
+            self.stats.make_dataframe_from_anilist_json, data
+        )
+        # the aggregates are only used to update the snapshot incrementally
+        state = None
+        if self.config.snapshot.enabled and self.config.snapshot.incremental:
+            state = await self.stats_executor.run(self.stats.calculate_state, df)
+        await self.snapshots.save(provider, username, lo, hi, df, state)
+        return df
+
+    async def _update(
+        self,
+        provider: ProviderType,
+        username: str,
+        lo: datetime,
+        hi: datetime,
+        snapshot: Snapshot,
+        priority: Priority = Priority.INTERACTIVE,
+    ) -> Snapshot | None:
+        # Returns None if the snapshot can't be updated incrementally.
+        if snapshot.state is None or snapshot.max_updated_at is None:
+            return None
+
+        updated = await self.watch_history_services[provider].get_updated_entries(
+            username, lo, hi, snapshot.max_updated_at, priority
+        )
+        if updated is None:
+            log.info(
+                "Too much of %s's watch list was updated; fetching it in full",
+                username,
+            )
+            return None
+
+        updated_ids, entries, max_updated_at = updated
+        updated_ids, entries = _drop_unchanged(snapshot.df, updated_ids, entries)
+        if not updated_ids:
+            await self.snapshots.touch(provider, username, lo, hi)
+            return snapshot
+
+        df, state = await self.stats_executor.run(
+            self.stats.apply_changes,
+            snapshot.df,
+            snapshot.state,
+            updated_ids,
+            entries,
+        )
+        max_updated_at = max(max_updated_at, snapshot.max_updated_at)
+        await self.snapshots.save(provider, username, lo, hi, df, state, max_updated_at)
+        return Snapshot(df=df, state=state, max_updated_at=max_updated_at, stale=False)
+
+
+def _drop_unchanged(
+    df: pl.DataFrame, updated_ids: list[int], entries: dict[str, Any]
+) -> tuple[list[int], dict[str, Any]]:
+    # Entries are fetched if they were updated at or after the snapshot's latest
+    # `updated_at` (another entry could've been updated in that same second), so
+    # the ones the snapshot already has come back every time; left in, the
+    # snapshot would never be found unchanged.
+    #
+    # An updated entry in the range has changed, unless the snapshot has it with
+    # the same `updated_at`. One that isn't in the range only matters if the
+    # snapshot has it, since it has to be removed.
+    in_range = {
+        entry["mediaId"]: entry["updatedAt"]
+        for watch_list in entries["lists"]
+        for entry in watch_list["entries"]
+    }
+    known = df.filter(pl.col("media_id").is_in(updated_ids)).select(
+        "media_id", "updated_at"
+    )
+    unchanged = {
+        media_id
+        for media_id, updated_at in known.iter_rows()
+        if in_range.get(media_id) == updated_at
+    }
+    unchanged.update(set(updated_ids) - in_range.keys() - set(known["media_id"]))
+    if not unchanged:
+        return updated_ids, entries
+
+    return (
+        [media_id for media_id in updated_ids if media_id not in unchanged],
+        {
+            **entries,
+            "lists": [
+                {
+                    **watch_list,
+                    "entries": [
+                        entry
+                        for entry in watch_list["entries"]
+                        if entry["mediaId"] not in unchanged
+                    ],
+                }
+                for watch_list in entries["lists"]
+            ],
+        },
+    )
+
+
+def _describe_error(e: Exception) -> str:
+    if isinstance(e, HTTPException):
+        return str(e.detail)
+    if isinstance(e, ClientResponseError):
+        if e.status == 404:
+            return "User not found"
+        return f"The provider responded with {e.status}"
+    return "Failed to calculate stats"
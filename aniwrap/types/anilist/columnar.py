@@ -0,0 +1,100 @@
+"""Columnar (Polars) counterparts of the types in `watch_history.py`.
+
+These only hold the fields that `/wrapped` needs; the GraphQL query used for
+it is derived from `WRAPPED_ENTRY_SCHEMA`, so adding a column here is enough
+to have it fetched. `to_watch_history` then adapts the data to the
+provider-agnostic layout in `aniwrap.types.watch_history`.
+"""
+
+import polars as pl
+
+from aniwrap.types.watch_history import conform
+
+_ANILIST_DATE = pl.Struct({"year": pl.Int64, "month": pl.Int64, "day": pl.Int64})
+
+ANILIST_MEDIA_SCHEMA = pl.Struct(
+    {
+        "averageScore": pl.Int64,
+        "bannerImage": pl.String,
+        "coverImage": pl.Struct({"medium": pl.String}),
+        "description": pl.String,
+        "episodes": pl.Int64,
+        "genres": pl.List(pl.String),
+        "isAdult": pl.Boolean,
+        "isFavourite": pl.Boolean,
+        "meanScore": pl.Int64,
+        "season": pl.String,
+        "seasonYear": pl.Int64,
+        "siteUrl": pl.String,
+        "title": pl.Struct({"userPreferred": pl.String}),
+        "duration": pl.Int64,
+        "format": pl.String,
+        "type": pl.String,
+    }
+)
+
+# The column names and nesting mirror the GraphQL response (and so, MediaList),
+# which keeps the dataframe the same as the one made from the attrs objects.
+WRAPPED_ENTRY_SCHEMA = pl.Schema(
+    {
+        "mediaId": pl.Int64,
+        "score": pl.Float64,
+        "startedAt": _ANILIST_DATE,
+        "completedAt": _ANILIST_DATE,
+        "status": pl.String,
+        "updatedAt": pl.Int64,
+        "media": ANILIST_MEDIA_SCHEMA,
+    }
+)
+
+
+def _fuzzy_date(column: str) -> pl.Expr:
+    # null if any of the parts are
+    date_struct = pl.col(column).struct
+    return pl.date(
+        date_struct.field("year"),
+        date_struct.field("month"),
+        date_struct.field("day"),
+    )
+
+
+def to_watch_history(df: pl.DataFrame) -> pl.DataFrame:
+    """Adapts AniList watch list entries to `WATCH_HISTORY_SCHEMA`.
+
+    `df` has the entries' fields as columns, with `media` unnested into its own
+    fields, and a `list_name` column. Dates can either be fuzzy date structs, or
+    already converted to dates.
+    """
+
+    def to_date(column: str) -> pl.Expr:
+        if isinstance(df.schema[column], pl.Struct):
+            return _fuzzy_date(column)
+        return pl.col(column)
+
+    return conform(
+        df.select(
+            pl.col("mediaId").alias("media_id"),
+            pl.col("list_name"),
+            pl.col("status"),
+            pl.col("score"),
+            to_date("startedAt").alias("started_at"),
+            to_date("completedAt").alias("completed_at"),
+            pl.col("updatedAt").alias("updated_at"),
+            pl.col("title").struct.field("userPreferred").alias("title"),
+            pl.col("bannerImage").alias("banner_url"),
+            pl.col("coverImage").struct.field("medium").alias("cover_url"),
+            pl.col("description"),
+            pl.col("averageScore").alias("average_score"),
+            pl.col("meanScore").alias("mean_score"),
+            pl.col("episodes"),
+            pl.col("duration"),
+            pl.col("genres"),
+            pl.col("season"),
+            pl.col("seasonYear").alias("season_year"),
+            pl.col("format"),
+            pl.col("siteUrl").alias("site_url"),
+            pl.col("isAdult").alias("is_adult"),
+            pl.col("isFavourite").alias("is_favourite"),
+            pl.col("type"),
+        )
+    )
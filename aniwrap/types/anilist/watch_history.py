@@ -52,7 +52,8 @@ class _Title:
 
 @define
 class Media:
-    averageScore: int
+    # null for media without enough scores yet, or not out yet
+    averageScore: int | None
     bannerImage: str
     coverImage: _SizedCoverImage
     description: str
@@ -60,9 +61,10 @@ class Media:
     genres: list[str]
     isAdult: bool
     isFavourite: bool
-    meanScore: int
-    season: SeasonType
-    seasonYear: int
+    meanScore: int | None
+    # null for media that didn't air in a season (ex: music videos)
+    season: SeasonType | None
+    seasonYear: int | None
     siteUrl: str
     title: _Title
     duration: int | None
@@ -1,7 +1,7 @@
 from datetime import date
 from typing import Literal, TypedDict
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 
 # TODO: make all the typeddicts here into BaseModels;
@@ -24,18 +24,31 @@ class _GroupCounts(TypedDict):
     count: int
 
 
+class _SharedAnime(TypedDict):
+    media_id: int
+    usernames: list[str]
+
+
+class _UserOverlap(TypedDict):
+    usernames: list[str]
+    # anime on both users' lists
+    shared: int
+    # shared anime, as a fraction of the anime on either list
+    similarity: float
+
+
 class AnimeData(BaseModel):
     media_id: int
     title: str
     banner_url: str
     cover_url: str
     description: str
-    average_score: int
-    mean_score: int
+    average_score: int | None
+    mean_score: int | None
     episodes: int | None
     genres: list[str]
-    season: Literal["WINTER", "SPRING", "SUMMER", "FALL"]
-    season_year: int
+    season: Literal["WINTER", "SPRING", "SUMMER", "FALL"] | None
+    season_year: int | None
     site_url: str
     is_adult: bool
     is_favourite: bool
@@ -59,3 +72,41 @@ class CalculatedStats(BaseModel):
     signature_genre: _SignatureGenre | None
 
     anime: dict[int, AnimeData]
+
+
+class StatsDelta(BaseModel):
+    # change from the previous year's stats
+    n: int
+    n_completed: int
+    n_ongoing: int
+    n_dropped: int
+    n_episodes: int
+    avg_score: float
+    genre_counts: list[_GroupCounts]
+
+
+class YearlyStats(BaseModel):
+    years: dict[int, CalculatedStats]
+    # year -> change from the year before it; there's none for the first year
+    deltas: dict[int, StatsDelta]
+
+
+class BatchWrappedRequest(BaseModel):
+    provider: Literal["mal", "anilist"]
+    usernames: list[str] = Field(min_length=1)
+
+
+class GroupStats(BaseModel):
+    # genre -> how many of the users watched it; only genres shared by some users
+    shared_genres: list[_GroupCounts]
+    # anime on more than one of the users' lists, most shared first
+    shared_anime: list[_SharedAnime]
+    # pairs of users with anime in common, most similar first
+    overlaps: list[_UserOverlap]
+
+
+class BatchStats(BaseModel):
+    users: dict[str, CalculatedStats]
+    # username -> why their stats couldn't be calculated
+    errors: dict[str, str]
+    group: GroupStats
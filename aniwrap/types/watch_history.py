@@ -0,0 +1,82 @@
+"""The provider-agnostic layout of a watch history, which the stats work on.
+
+One row per list entry (an entry on a custom list has a row for that list too),
+with the media's metadata alongside. Each provider's data is converted into this
+by an adapter (see `aniwrap.types.anilist.columnar`), so the stats, snapshots
+and everything else downstream only deal with the one layout.
+
+Columns with a small, fixed set of values are Enums, and genres are Categorical;
+both are dictionary-encoded in Arrow, which makes the frames (and the snapshots
+they're stored as) smaller and the Polars side of grouping on them faster.
+"""
+
+from logging import getLogger
+
+import polars as pl
+
+log = getLogger(__name__)
+
+STATUS = pl.Enum(["CURRENT", "PLANNING", "COMPLETED", "DROPPED", "PAUSED", "REPEATING"])
+FORMAT = pl.Enum(["TV", "TV_SHORT", "MOVIE", "SPECIAL", "OVA", "ONA", "MUSIC"])
+SEASON = pl.Enum(["WINTER", "SPRING", "SUMMER", "FALL"])
+MEDIA_TYPE = pl.Enum(["ANIME", "MANGA"])
+
+# The media columns are named after AnimeData's fields.
+WATCH_HISTORY_SCHEMA = pl.Schema(
+    {
+        "media_id": pl.Int64,
+        # null for entries that aren't on a list (ex: fetched on their own)
+        "list_name": pl.String,
+        "status": STATUS,
+        # 0 when not scored
+        "score": pl.Float64,
+        "started_at": pl.Date,
+        "completed_at": pl.Date,
+        # Unix timestamp
+        "updated_at": pl.Int64,
+        "title": pl.String,
+        "banner_url": pl.String,
+        "cover_url": pl.String,
+        "description": pl.String,
+        "average_score": pl.Int64,
+        "mean_score": pl.Int64,
+        "episodes": pl.Int64,
+        # minutes per episode
+        "duration": pl.Int64,
+        "genres": pl.List(pl.Categorical),
+        "season": SEASON,
+        "season_year": pl.Int64,
+        "format": FORMAT,
+        "site_url": pl.String,
+        "is_adult": pl.Boolean,
+        "is_favourite": pl.Boolean,
+        "type": MEDIA_TYPE,
+    }
+)
+
+
+def _to_enum(df: pl.DataFrame, column: str, dtype: pl.Enum) -> pl.Expr:
+    # values the enum doesn't have (ex: a format new to the provider) become null,
+    # rather than failing the whole cast; they're logged, since they also drop
+    # out of the stats (ex: an unknown status isn't in any of the status counts)
+    col = pl.col(column).cast(pl.String)
+    known = col.is_in(dtype.categories.to_list())
+    unknown = df.select(col.filter(~known).unique().sort())[column]
+    if not unknown.is_empty():
+        log.warning(
+            f"Got unexpected values for '{column}'; treating them as null: {unknown.to_list()}"
+        )
+    return pl.when(known).then(col).cast(dtype).alias(column)
+
+
+def conform(df: pl.DataFrame) -> pl.DataFrame:
+    """Casts an adapter's output to `WATCH_HISTORY_SCHEMA`, in its column order.
+
+    Every column of the schema has to be there; anything else is dropped.
+    """
+    return df.select(
+        _to_enum(df, name, dtype)
+        if isinstance(dtype, pl.Enum)
+        else pl.col(name).cast(dtype)
+        for name, dtype in WATCH_HISTORY_SCHEMA.items()
+    )
@@ -0,0 +1,266 @@
+"""A stand-in for AniList's GraphQL API, for load testing without hitting AniList.
+
+Answers the queries the app sends (MediaListCollection, and the Page queries for
+media and updated entries) with watch lists from `benchmarks.generate`. Every
+username gets its own list; a username ending in a dash and a number, like
+`alice-5000`, gets a list with that many entries. The username `missing` gets a
+404, same as a user that doesn't exist on AniList.
+
+Responses are delayed by a configurable latency, and requests over the rate
+limit are answered with 429s and the same headers AniList sends. Queries' date
+filters are ignored; the generated lists are all in the current year anyway.
+
+    python -m benchmarks.fake_anilist --port 8081 --latency 150 --rate-limit 90
+
+Then point the app at it with
+`ANIWRAP_ANILIST='{"client_id": 0, "client_secret": "x", "api_base_url": "http://127.0.0.1:8081"}'`.
+"""
+
+import argparse
+import asyncio
+import random
+import re
+import time
+import zlib
+from collections import deque
+from functools import lru_cache
+from typing import Any
+
+import orjson
+from aiohttp import web
+
+from benchmarks.generate import make_collection, make_media
+
+DEFAULT_ENTRIES = 1_000
+_SIZE_SUFFIX = re.compile(r"-(\d+)$")
+_ENTRY_FIELDS = [
+    "advancedScores",
+    "mediaId",
+    "private",
+    "score",
+    "startedAt",
+    "completedAt",
+    "repeat",
+    "updatedAt",
+    "status",
+    "notes",
+    "media",
+]
+
+
+@lru_cache(maxsize=256)
+def _entries(username: str, default_size: int) -> list[tuple[str, str, dict]]:
+    # (list name, list status, entry) for each of the user's entries
+    match = _SIZE_SUFFIX.search(username)
+    size = int(match.group(1)) if match else default_size
+    collection = make_collection(size, seed=zlib.crc32(username.encode()))
+    return [
+        (watch_list["name"], watch_list["status"], entry)
+        for watch_list in collection["lists"]
+        for entry in watch_list["entries"]
+    ]
+
+
+@lru_cache(maxsize=64)
+def _selected_fields(query: str) -> tuple[str, ...]:
+    # Only the entry fields the query selects are sent back, so responses are
+    # about as big as AniList's. Nested fields aren't picked apart; the app
+    # selects all of media's anyway.
+    return tuple(field for field in _ENTRY_FIELDS if re.search(rf"\b{field}\b", query))
+
+
+def _project(entry: dict[str, Any], fields: tuple[str, ...]) -> dict[str, Any]:
+    return {field: entry[field] for field in fields}
+
+
+class RateLimiter:
+    """Sliding one minute window, reported through AniList's headers."""
+
+    def __init__(self, per_minute: int) -> None:
+        self.per_minute = per_minute
+        self._requests: deque[float] = deque()
+
+    def take(self) -> tuple[bool, dict[str, str]]:
+        """Counts a request.
+
+        Returns:
+            Whether it's allowed, and the rate limit headers to respond with
+        """
+        now = time.monotonic()
+        while self._requests and self._requests[0] <= now - 60:
+            self._requests.popleft()
+
+        if len(self._requests) >= self.per_minute:
+            retry_after = max(1, round(self._requests[0] + 60 - now))
+            return False, {
+                "X-RateLimit-Limit": str(self.per_minute),
+                "X-RateLimit-Remaining": "0",
+                "Retry-After": str(retry_after),
+                "X-RateLimit-Reset": str(int(time.time()) + retry_after),
+            }
+
+        self._requests.append(now)
+        return True, {
+            "X-RateLimit-Limit": str(self.per_minute),
+            "X-RateLimit-Remaining": str(self.per_minute - len(self._requests)),
+        }
+
+
+class FakeAnilist:
+    def __init__(
+        self,
+        latency: float,
+        jitter: float,
+        rate_limit: int | None,
+        default_entries: int,
+        compress: bool,
+    ) -> None:
+        self.latency = latency
+        self.jitter = jitter
+        self.limiter = RateLimiter(rate_limit) if rate_limit else None
+        self.default_entries = default_entries
+        self.compress = compress
+        self.requests = 0
+        self.throttled = 0
+
+    async def handle(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        await asyncio.sleep(
+            max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)) / 1000
+        )
+
+        headers: dict[str, str] = {}
+        if self.limiter is not None:
+            allowed, headers = self.limiter.take()
+            if not allowed:
+                self.throttled += 1
+                return self._json(
+                    {"errors": [{"message": "Too Many Requests.", "status": 429}]},
+                    status=429,
+                    headers=headers,
+                )
+
+        body = orjson.loads(await request.read())
+        query: str = body["query"]
+        variables: dict[str, Any] = body.get("variables") or {}
+
+        if variables.get("userName") == "missing":
+            return self._json(
+                {
+                    "errors": [{"message": "Not Found.", "status": 404}],
+                    "data": {"MediaListCollection": None},
+                },
+                status=404,
+                headers=headers,
+            )
+
+        if "MediaListCollection(" in query:
+            data = {"MediaListCollection": self._collection(query, variables)}
+        elif "mediaList(" in query:
+            data = {"Page": self._updated_entries(query, variables)}
+        elif "media(" in query:
+            data = {
+                "Page": {
+                    "media": [{"id": i, **make_media(i)} for i in variables["ids"]]
+                }
+            }
+        else:
+            return self._json(
+                {"errors": [{"message": "Unsupported query.", "status": 400}]},
+                status=400,
+                headers=headers,
+            )
+        return self._json({"data": data}, headers=headers)
+
+    def _collection(self, query: str, variables: dict[str, Any]) -> dict[str, Any]:
+        entries = _entries(variables["userName"], self.default_entries)
+        fields = _selected_fields(query)
+        chunk, per_chunk = variables.get("chunk", 1), variables.get("perChunk", 500)
+
+        lists: dict[str, dict[str, Any]] = {}
+        for name, status, entry in entries[(chunk - 1) * per_chunk : chunk * per_chunk]:
+            lists.setdefault(name, {"name": name, "status": status, "entries": []})[
+                "entries"
+            ].append(_project(entry, fields))
+        return {
+            "lists": list(lists.values()),
+            "hasNextChunk": chunk * per_chunk < len(entries),
+        }
+
+    def _updated_entries(self, query: str, variables: dict[str, Any]) -> dict[str, Any]:
+        entries = sorted(
+            (
+                entry
+                for _, _, entry in _entries(variables["userName"], self.default_entries)
+            ),
+            key=lambda entry: -entry["updatedAt"],
+        )
+        fields = _selected_fields(query)
+        page, per_page = variables.get("page", 1), variables.get("perPage", 50)
+        return {
+            "pageInfo": {"hasNextPage": page * per_page < len(entries)},
+            "mediaList": [
+                _project(entry, fields)
+                for entry in entries[(page - 1) * per_page : page * per_page]
+            ],
+        }
+
+    def _json(
+        self, data: Any, status: int = 200, headers: dict[str, str] | None = None
+    ) -> web.Response:
+        res = web.Response(
+            body=orjson.dumps(data),
+            status=status,
+            headers=headers,
+            content_type="application/json",
+        )
+        if self.compress:
+            res.enable_compression()
+        return res
+
+    async def stats(self, request: web.Request) -> web.Response:
+        return self._json({"requests": self.requests, "throttled": self.throttled})
+
+
+def make_app(fake: FakeAnilist) -> web.Application:
+    app = web.Application(client_max_size=16 * 1024 * 1024)
+    app.router.add_post("/", fake.handle)
+    app.router.add_get("/stats", fake.stats)
+    return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument(
+        "--latency", type=float, default=100, help="milliseconds per response"
+    )
+    parser.add_argument(
+        "--jitter", type=float, default=50, help="+/- milliseconds of latency"
+    )
+    parser.add_argument(
+        "--rate-limit",
+        type=int,
+        default=None,
+        help="requests per minute; unlimited by default",
+    )
+    parser.add_argument(
+        "--entries",
+        type=int,
+        default=DEFAULT_ENTRIES,
+        help="size of lists for usernames without a size suffix",
+    )
+    parser.add_argument(
+        "--compress", action="store_true", help="gzip responses, like AniList does"
+    )
+    args = parser.parse_args()
+
+    fake = FakeAnilist(
+        args.latency, args.jitter, args.rate_limit, args.entries, args.compress
+    )
+    web.run_app(make_app(fake), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
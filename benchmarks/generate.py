@@ -0,0 +1,188 @@
+"""Synthetic AniList watch lists, for the benchmarks and the fake AniList server.
+
+The distributions are loosely modelled on real lists: most entries are TV shows
+from the last decade or so, a handful of genres show up on most entries, about
+a third of the entries aren't scored, and only completed entries have a
+completion date. Everything is seeded, so the same arguments always give the
+same list.
+"""
+
+import random
+from datetime import date
+from typing import Any
+
+# genre -> probability of a show having it
+GENRES = {
+    "Action": 0.45,
+    "Comedy": 0.40,
+    "Drama": 0.30,
+    "Fantasy": 0.30,
+    "Adventure": 0.25,
+    "Romance": 0.25,
+    "Slice of Life": 0.20,
+    "Sci-Fi": 0.15,
+    "Supernatural": 0.15,
+    "Mystery": 0.10,
+    "Psychological": 0.08,
+    "Mecha": 0.06,
+    "Sports": 0.06,
+    "Ecchi": 0.05,
+    "Horror": 0.05,
+    "Music": 0.04,
+    "Thriller": 0.04,
+    "Mahou Shoujo": 0.02,
+}
+FORMATS = {
+    "TV": 0.60,
+    "MOVIE": 0.12,
+    "ONA": 0.08,
+    "OVA": 0.07,
+    "SPECIAL": 0.06,
+    "TV_SHORT": 0.05,
+    "MUSIC": 0.02,
+}
+EPISODES = {
+    "TV": [12, 12, 13, 24, 25, 26, None],
+    "MOVIE": [1],
+    "ONA": [6, 10, 12, 24],
+    "OVA": [1, 2, 4, 6],
+    "SPECIAL": [1, 3, 6],
+    "TV_SHORT": [12, 13, 24],
+    "MUSIC": [1],
+}
+# status -> (probability, name of the list it's on)
+STATUSES = {
+    "COMPLETED": (0.55, "Completed"),
+    "PLANNING": (0.20, "Planning"),
+    "CURRENT": (0.10, "Watching"),
+    "DROPPED": (0.07, "Dropped"),
+    "PAUSED": (0.05, "Paused"),
+    "REPEATING": (0.03, "Rewatching"),
+}
+SEASONS = ["WINTER", "SPRING", "SUMMER", "FALL"]
+# share of entries that are also on a custom list
+CUSTOM_LIST_SHARE = 0.02
+
+
+def _pick(rng: random.Random, weights: dict[str, float]) -> str:
+    return rng.choices(list(weights), list(weights.values()))[0]
+
+
+def make_media(media_id: int) -> dict[str, Any]:
+    """Metadata for one show; the same id always gives the same show."""
+    rng = random.Random(media_id)
+    media_format = _pick(rng, FORMATS)
+    genres = [genre for genre, p in GENRES.items() if rng.random() < p]
+    return {
+        "averageScore": rng.randint(45, 92),
+        "bannerImage": f"https://s4.anilist.co/file/anilistcdn/media/anime/banner/{media_id}.jpg",
+        "coverImage": {
+            "medium": f"https://s4.anilist.co/file/anilistcdn/media/anime/cover/small/{media_id}.jpg"
+        },
+        "description": " ".join(
+            rng.choices(
+                ["lorem", "ipsum", "dolor", "sit", "amet"], k=rng.randint(20, 200)
+            )
+        ),
+        "episodes": rng.choice(EPISODES[media_format]),
+        "genres": genres or [rng.choice(list(GENRES))],
+        "isAdult": False,
+        "isFavourite": rng.random() < 0.03,
+        "meanScore": rng.randint(45, 92),
+        "season": rng.choice(SEASONS),
+        # skewed towards recent years
+        "seasonYear": max(1960, 2025 - int(rng.expovariate(1 / 8))),
+        "siteUrl": f"https://anilist.co/anime/{media_id}",
+        "title": {"userPreferred": f"Anime {media_id}"},
+        "duration": 100 if media_format == "MOVIE" else rng.choice([24, 24, 12, None]),
+        "format": media_format,
+        "type": "ANIME",
+    }
+
+
+def _fuzzy_date(rng: random.Random, year: int, p_null: float) -> dict[str, Any]:
+    if rng.random() < p_null:
+        return {"year": None, "month": None, "day": None}
+    d = date.fromordinal(date(year, 1, 1).toordinal() + rng.randrange(365))
+    return {"year": d.year, "month": d.month, "day": d.day}
+
+
+def make_entry(
+    rng: random.Random, media_id: int, status: str, year: int, updated_at: int
+) -> dict[str, Any]:
+    """A MediaList entry, with every field MediaListCollection has."""
+    scored = status in ("COMPLETED", "DROPPED", "REPEATING") and rng.random() < 0.7
+    return {
+        "advancedScores": {
+            "Story": 0,
+            "Characters": 0,
+            "Visuals": 0,
+            "Audio": 0,
+            "Enjoyment": 0,
+        },
+        "mediaId": media_id,
+        "private": False,
+        "score": (round(min(10, max(1, rng.gauss(7.5, 1.3))), 1) if scored else 0),
+        "startedAt": _fuzzy_date(rng, year, 1 if status == "PLANNING" else 0.15),
+        "completedAt": _fuzzy_date(rng, year, 0.2 if status == "COMPLETED" else 1),
+        "repeat": 1 if status == "REPEATING" else 0,
+        "updatedAt": updated_at,
+        "status": status,
+        "notes": None,
+        "media": make_media(media_id),
+    }
+
+
+def make_collection(n: int, seed: int = 0, year: int | None = None) -> dict[str, Any]:
+    """A MediaListCollection (as the API's JSON) with `n` entries.
+
+    Arguments:
+        n: number of entries
+        seed: lists with different seeds have different entries
+        year: year the dates are in; defaults to the current year
+    """
+    rng = random.Random(seed)
+    year = year or date.today().year
+    media_ids = rng.sample(range(1, max(200_000, 4 * n)), n)
+    updated_at = 1_700_000_000
+
+    lists: dict[str, dict[str, Any]] = {}
+    custom: list[dict[str, Any]] = []
+    for media_id in media_ids:
+        status = _pick(rng, {s: p for s, (p, _) in STATUSES.items()})
+        updated_at += rng.randint(1, 20_000)
+        entry = make_entry(rng, media_id, status, year, updated_at)
+        name = STATUSES[status][1]
+        lists.setdefault(name, {"name": name, "status": status, "entries": []})
+        lists[name]["entries"].append(entry)
+        if rng.random() < CUSTOM_LIST_SHARE:
+            custom.append(entry)
+
+    if custom:
+        lists["Favourites"] = {"name": "Favourites", "status": None, "entries": custom}
+    return {"lists": list(lists.values()), "hasNextChunk": False}
+
+
+def chunk_collection(
+    collection: dict[str, Any], per_chunk: int
+) -> list[dict[str, Any]]:
+    """Splits a collection into the chunks MediaListCollection would return it in."""
+    entries = [
+        (watch_list, entry)
+        for watch_list in collection["lists"]
+        for entry in watch_list["entries"]
+    ]
+    chunks = []
+    for start in range(0, max(len(entries), 1), per_chunk):
+        lists: dict[str, dict[str, Any]] = {}
+        for watch_list, entry in entries[start : start + per_chunk]:
+            lists.setdefault(watch_list["name"], {**watch_list, "entries": []})[
+                "entries"
+            ].append(entry)
+        chunks.append(
+            {
+                "lists": list(lists.values()),
+                "hasNextChunk": start + per_chunk < len(entries),
+            }
+        )
+    return chunks
@@ -0,0 +1,142 @@
+"""Load driver for a running instance of the app.
+
+Sends requests to `/watched` or `/wrapped` from a number of concurrent clients,
+for a set of usernames, and reports the throughput and latency percentiles.
+Meant to be run against an app pointed at `benchmarks.fake_anilist`:
+
+    python -m benchmarks.fake_anilist --port 8081 &
+    ANIWRAP_ANILIST='{..., "api_base_url": "http://127.0.0.1:8081"}' uvicorn aniwrap.app:app &
+    python -m benchmarks.load --endpoint wrapped --users 200 --entries 2000 --concurrency 32
+
+With fewer users than requests, some of the requests are for users already
+seen, so the caches and snapshots get their share of the traffic; use
+`--users` to control how much.
+"""
+
+import argparse
+import asyncio
+import random
+import statistics
+import sys
+import time
+from collections import Counter
+
+from aiohttp import ClientSession, ClientTimeout, TCPConnector
+
+
+def _percentile(sorted_values: list[float], p: float) -> float:
+    # nearest rank
+    index = max(0, min(len(sorted_values) - 1, round(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+async def run(
+    url: str,
+    endpoint: str,
+    usernames: list[str],
+    concurrency: int,
+    duration: float | None,
+    total: int | None,
+    seed: int,
+) -> tuple[list[float], Counter[int | str], float]:
+    """Sends requests until `duration` seconds have passed or `total` were sent.
+
+    Returns:
+        The latency of each successful request, the count of each status code
+        (or exception type), and the time it all took
+    """
+    rng = random.Random(seed)
+    latencies: list[float] = []
+    statuses: Counter[int | str] = Counter()
+    sent = 0
+    start = time.perf_counter()
+    deadline = start + duration if duration is not None else None
+
+    def more() -> bool:
+        nonlocal sent
+        if total is not None and sent >= total:
+            return False
+        if deadline is not None and time.perf_counter() >= deadline:
+            return False
+        sent += 1
+        return True
+
+    async with ClientSession(
+        base_url=url,
+        connector=TCPConnector(limit=concurrency),
+        timeout=ClientTimeout(total=300),
+    ) as http:
+
+        async def client() -> None:
+            while more():
+                params = {"provider": "anilist", "username": rng.choice(usernames)}
+                sent_at = time.perf_counter()
+                try:
+                    async with http.get(f"/{endpoint}/", params=params) as res:
+                        await res.read()
+                        statuses[res.status] += 1
+                        if res.status == 200:
+                            latencies.append(time.perf_counter() - sent_at)
+                except Exception as e:
+                    statuses[type(e).__name__] += 1
+
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+
+    return latencies, statuses, time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--endpoint", choices=["wrapped", "watched"], default="wrapped")
+    parser.add_argument("--users", type=int, default=100, help="distinct usernames")
+    parser.add_argument(
+        "--entries", type=int, default=1_000, help="entries in each user's list"
+    )
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument(
+        "--duration", type=float, default=30, help="seconds to send requests for"
+    )
+    parser.add_argument(
+        "--requests",
+        type=int,
+        default=None,
+        help="send this many requests instead of running for --duration",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    # the size suffix tells the fake AniList how long to make the list
+    usernames = [f"load{i}-{args.entries}" for i in range(args.users)]
+    latencies, statuses, elapsed = asyncio.run(
+        run(
+            args.url,
+            args.endpoint,
+            usernames,
+            args.concurrency,
+            None if args.requests is not None else args.duration,
+            args.requests,
+            args.seed,
+        )
+    )
+
+    n = sum(statuses.values())
+    print(f"{n} requests in {elapsed:.1f}s ({n / elapsed:.1f} req/s)")
+    print(
+        "statuses: "
+        + ", ".join(f"{status}: {count}" for status, count in statuses.most_common())
+    )
+    if not latencies:
+        print("no successful requests", file=sys.stderr)
+        sys.exit(1)
+
+    ms = sorted(latency * 1000 for latency in latencies)
+    print(
+        f"latency: mean {statistics.fmean(ms):.1f}ms, "
+        + ", ".join(f"p{p} {_percentile(ms, p):.1f}ms" for p in (50, 95, 99))
+        + f", max {ms[-1]:.1f}ms"
+    )
+
+
+if __name__ == "__main__":
+    main()
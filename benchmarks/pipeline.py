@@ -0,0 +1,340 @@
+"""Benchmarks for the watch list ingestion and stats pipeline.
+
+Times each stage of turning a MediaListCollection into wrapped stats, over
+synthetic watch lists of a few sizes, plus the whole `/wrapped` handler against
+a stubbed AniList. Results are compared against a stored baseline, so slowdowns
+(and changes to the computed stats) show up before they're deployed.
+
+The stats are computed with both engines (see `stats.engine`), which are timed
+side by side and have to come up with the same stats.
+
+    python -m benchmarks.pipeline                  # run, and compare against the baseline
+    python -m benchmarks.pipeline --save-baseline  # run, and store the results as the baseline
+
+Peak memory is what tracemalloc sees, which is only the Python heap; Polars and
+DuckDB allocate natively, so their share only shows up in the process' max RSS.
+"""
+
+import argparse
+import gc
+import json
+import logging
+import os
+import platform
+import resource
+import statistics
+import sys
+import time
+import tracemalloc
+from collections.abc import Callable
+from pathlib import Path
+from typing import Any
+
+import cattrs
+import orjson
+
+from aniwrap.service.stats import StatisticsService, _registered
+from aniwrap.service.stats_polars import PolarsStatisticsService
+from aniwrap.types.anilist.watch_history import MediaListCollection
+from benchmarks.generate import chunk_collection, make_collection
+
+BASELINE_PATH = Path(__file__).parent / "baseline.json"
+DEFAULT_SIZES = [1_000, 5_000, 20_000]
+
+
+def _configure_app() -> None:
+    # The app reads its config on first use, so this has to happen before it's
+    # imported. Nothing is cached, so every request does the full amount of work,
+    # and nothing needs a database; the required settings just need to be there.
+    os.environ["ANIWRAP_SNAPSHOT"] = '{"enabled": false}'
+    os.environ["ANIWRAP_CACHE"] = '{"enabled": false}'
+    os.environ["ANIWRAP_MEDIA_CACHE"] = '{"enabled": false}'
+    os.environ["ANIWRAP_USER_REGISTRY"] = '{"enabled": false}'
+    os.environ.setdefault(
+        "ANIWRAP_DATABASE_URL", "postgresql+asyncpg://bench@localhost/bench"
+    )
+    os.environ.setdefault(
+        "ANIWRAP_ANILIST", '{"client_id": 0, "client_secret": "bench"}'
+    )
+    os.environ.setdefault("ANIWRAP_GEMINI_API_KEY", "bench")
+
+
+_configure_app()
+
+
+class StubAnilistClient:
+    """Answers MediaListCollection queries from a prepared watch list."""
+
+    def __init__(self, collection: dict[str, Any], per_chunk: int = 500) -> None:
+        self._chunks = [
+            orjson.dumps({"data": {"MediaListCollection": chunk}})
+            for chunk in chunk_collection(collection, per_chunk)
+        ]
+        # chunks are requested a few at a time, so some go past the end
+        self._past_end = orjson.dumps(
+            {"data": {"MediaListCollection": {"lists": [], "hasNextChunk": False}}}
+        )
+
+    async def query(self, query: str, variables: dict[str, Any], *_, **__) -> bytes:
+        chunk = variables.get("chunk", 1)
+        if chunk > len(self._chunks):
+            return self._past_end
+        return self._chunks[chunk - 1]
+
+    async def close(self) -> None:
+        pass
+
+
+def _time(fn: Callable[[], Any], repeat: int) -> dict[str, float]:
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+
+    gc.collect()
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "median_ms": statistics.median(times) * 1000,
+        "min_ms": min(times) * 1000,
+        "peak_kib": peak / 1024,
+    }
+
+
+def _digest(stats: dict[str, Any]) -> dict[str, Any]:
+    # What gets compared against the baseline. Ties for first/last completion
+    # can go either way, so only their dates are compared; the anime metadata
+    # follows from the rest, so only its size is.
+    return {
+        **{k: v for k, v in stats.items() if k not in ("anime",)},
+        "first_completed": (stats["first_completed"] or {}).get("completed_at"),
+        "last_completed": (stats["last_completed"] or {}).get("completed_at"),
+        "anime": len(stats["anime"]),
+    }
+
+
+def _rounded(value: Any) -> Any:
+    # The engines add up scores in a different order, so averages can be off in
+    # the last few bits.
+    if isinstance(value, float):
+        return round(value, 9)
+    if isinstance(value, dict):
+        return {k: _rounded(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_rounded(v) for v in value]
+    return value
+
+
+def _compare_engines(
+    stats: StatisticsService, polars: StatisticsService, df: Any, frames: Any
+) -> list[str]:
+    """Returns the stats that the DuckDB and Polars engines don't agree on."""
+    outputs: dict[str, Callable[[StatisticsService], Any]] = {
+        "calculate_stats": lambda s: s.calculate_stats(df),
+        "calculate_yearly_stats": lambda s: s.calculate_yearly_stats(df, 2015, 2026),
+        "calculate_batch_stats": lambda s: s.calculate_batch_stats(frames),
+    }
+    mismatches = []
+    for name, fn in outputs.items():
+        a, b = (
+            _rounded(orjson.loads(orjson.dumps(fn(s), default=_dump)))
+            for s in (stats, polars)
+        )
+        if a != b:
+            mismatches.append(name)
+    return mismatches
+
+
+def _dump(obj: Any) -> Any:
+    return obj.model_dump(mode="json")
+
+
+def bench_size(
+    n: int, repeat: int
+) -> tuple[dict[str, dict[str, float]], Any, list[str]]:
+    """Benchmarks every stage on a watch list with `n` entries.
+
+    Returns:
+        Timings per stage, the digest of the stats that were computed, and the
+        stats the two engines don't agree on
+    """
+    from fastapi.testclient import TestClient
+
+    from aniwrap.app import app
+    from aniwrap.misc import get_anilist_client
+
+    stats = StatisticsService()
+    polars = PolarsStatisticsService()
+    raw = make_collection(n)
+    raw_json = orjson.dumps(raw)
+    data = cattrs.structure(raw, MediaListCollection)
+    df = stats.make_dataframe_from_anilist_json(raw)
+    # a group the size of the list, for the batch stats
+    frames = {
+        f"user{i}": stats.make_dataframe_from_anilist_json(
+            make_collection(n // 4, seed=i + 1)
+        )
+        for i in range(4)
+    }
+    state = stats.calculate_state(df)
+
+    def registered(query: Callable[[Any], Any]) -> Callable[[], Any]:
+        def run() -> Any:
+            with _registered(df) as con:
+                return query(con)
+
+        return run
+
+    stages: dict[str, Callable[[], Any]] = {
+        "orjson.loads": lambda: orjson.loads(raw_json),
+        "cattrs.structure": lambda: cattrs.structure(raw, MediaListCollection),
+        "_flatten_anilist_data": lambda: stats._flatten_anilist_data(data),
+        "make_dataframe_from_anilist": lambda: stats.make_dataframe_from_anilist(data),
+        "make_dataframe_from_anilist_json": (
+            lambda: stats.make_dataframe_from_anilist_json(raw)
+        ),
+        "_get_summary": registered(stats._get_summary),
+        "_get_group_counts": registered(stats._get_group_counts),
+        "_get_media": lambda: stats._get_media(df),
+        "calculate_stats": lambda: stats.calculate_stats(df),
+        "calculate_stats [polars]": lambda: polars.calculate_stats(df),
+        "calculate_yearly_stats": lambda: stats.calculate_yearly_stats(df, 2015, 2026),
+        "calculate_yearly_stats [polars]": (
+            lambda: polars.calculate_yearly_stats(df, 2015, 2026)
+        ),
+        "calculate_batch_stats": lambda: stats.calculate_batch_stats(frames),
+        "calculate_batch_stats [polars]": lambda: polars.calculate_batch_stats(frames),
+        "calculate_state": lambda: stats.calculate_state(df),
+        "calculate_stats_from_state": (
+            lambda: stats.calculate_stats_from_state(state, df)
+        ),
+    }
+    results = {name: _time(fn, repeat) for name, fn in stages.items()}
+
+    stub = StubAnilistClient(raw)
+    app.dependency_overrides[get_anilist_client] = lambda: stub
+    try:
+        with TestClient(app) as client:
+
+            def wrapped() -> Any:
+                res = client.get(
+                    "/wrapped/", params={"provider": "anilist", "username": "bench"}
+                )
+                res.raise_for_status()
+                return res.json()
+
+            results["GET /wrapped"] = _time(wrapped, repeat)
+            digest = _digest(wrapped())
+    finally:
+        app.dependency_overrides.pop(get_anilist_client)
+
+    return (
+        results,
+        json.loads(json.dumps(digest, default=str)),
+        _compare_engines(stats, polars, df, frames),
+    )
+
+
+def _compare(
+    results: dict[str, Any], baseline: dict[str, Any], threshold: float
+) -> list[str]:
+    problems = []
+    for size, run in results["sizes"].items():
+        base = baseline["sizes"].get(size)
+        if base is None:
+            continue
+        if run["digest"] != base["digest"]:
+            problems.append(f"n={size}: stats differ from the baseline's")
+        for stage, timing in run["stages"].items():
+            base_timing = base["stages"].get(stage)
+            if base_timing is None:
+                continue
+            ratio = timing["median_ms"] / base_timing["median_ms"]
+            if ratio > threshold:
+                problems.append(
+                    f"n={size}: {stage} took {timing['median_ms']:.1f}ms, "
+                    f"{ratio:.2f}x the baseline's {base_timing['median_ms']:.1f}ms"
+                )
+    return problems
+
+
+def _print_table(results: dict[str, Any], baseline: dict[str, Any] | None) -> None:
+    for size, run in results["sizes"].items():
+        base = (baseline or {}).get("sizes", {}).get(size, {}).get("stages", {})
+        print(f"\nn={size}")
+        print(f"  {'stage':<34}{'median':>11}{'min':>11}{'py peak':>12}{'vs base':>9}")
+        for stage, t in run["stages"].items():
+            vs = ""
+            if stage in base:
+                vs = f"{t['median_ms'] / base[stage]['median_ms']:.2f}x"
+            print(
+                f"  {stage:<34}{t['median_ms']:>9.2f}ms{t['min_ms']:>9.2f}ms"
+                f"{t['peak_kib'] / 1024:>9.1f}MiB{vs:>9}"
+            )
+    print(f"\nmax RSS: {results['max_rss_mib']:.0f}MiB")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="store the results as the new baseline instead of comparing",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=1.25,
+        help="a stage is a regression if it's this many times slower than the baseline",
+    )
+    args = parser.parse_args()
+    # the synthetic lists have every status, which the stats warn about each time
+    logging.getLogger("aniwrap").setLevel(logging.ERROR)
+
+    results: dict[str, Any] = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "sizes": {},
+    }
+    engine_problems: list[str] = []
+    for n in args.sizes:
+        print(f"benchmarking n={n}...", file=sys.stderr)
+        stages, digest, mismatches = bench_size(n, args.repeat)
+        results["sizes"][str(n)] = {"stages": stages, "digest": digest}
+        for name in mismatches:
+            engine_problems.append(f"n={n}: the engines' {name} differ")
+    # ru_maxrss is in KiB on Linux
+    results["max_rss_mib"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    baseline = None
+    if not args.save_baseline and args.baseline.exists():
+        baseline = json.loads(args.baseline.read_text())
+    _print_table(results, baseline)
+    for problem in engine_problems:
+        print(f"MISMATCH: {problem}")
+
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(results, indent=2) + "\n")
+        print(f"saved the baseline to {args.baseline}")
+    elif baseline is not None:
+        problems = _compare(results, baseline, args.threshold)
+        for problem in problems:
+            print(f"REGRESSION: {problem}")
+        if problems:
+            sys.exit(1)
+    else:
+        print(f"no baseline at {args.baseline}; run with --save-baseline to store one")
+    if engine_problems:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""Benchmark for how long a fresh instance of the app takes to start.
+
+Each run starts a new interpreter, so nothing is cached between runs (other than
+by the OS). Three things are timed:
+
+- import: importing `aniwrap.app`, and which of the heavy libraries that pulled in
+- live: from starting uvicorn to the first answer from `/ping`
+- ready: from starting uvicorn to `/ready` saying the warm up is done
+
+    python -m benchmarks.startup
+    python -m benchmarks.startup --executor process --engine polars
+
+The app doesn't need a database or AniList to start; without a database, the warm
+up just logs that it couldn't connect.
+"""
+
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+# checked for after importing the app
+HEAVY_MODULES = ["duckdb", "polars", "pyarrow", "cattrs", "sqlalchemy", "asyncpg"]
+
+_IMPORT_SCRIPT = f"""
+import json, sys, time
+start = time.perf_counter()
+import aniwrap.app
+seconds = time.perf_counter() - start
+print(json.dumps({{
+    "seconds": seconds,
+    "loaded": [m for m in {HEAVY_MODULES!r} if m in sys.modules],
+}}))
+"""
+
+
+def _env(executor: str, engine: str) -> dict[str, str]:
+    env = dict(os.environ)
+    env["ANIWRAP_STATS"] = json.dumps({"executor": executor, "engine": engine})
+    env.setdefault(
+        "ANIWRAP_DATABASE_URL", "postgresql+asyncpg://bench@localhost:1/bench"
+    )
+    env.setdefault("ANIWRAP_ANILIST", '{"client_id": 0, "client_secret": "bench"}')
+    env.setdefault("ANIWRAP_GEMINI_API_KEY", "bench")
+    return env
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _status(url: str) -> int | None:
+    try:
+        with urllib.request.urlopen(url, timeout=1) as res:
+            return res.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except OSError:
+        # not listening yet
+        return None
+
+
+def time_import(env: dict[str, str]) -> tuple[float, list[str]]:
+    out = subprocess.run(
+        [sys.executable, "-c", _IMPORT_SCRIPT],
+        env=env,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    result = json.loads(out.strip().splitlines()[-1])
+    return result["seconds"], result["loaded"]
+
+
+def time_start(env: dict[str, str], timeout: float) -> tuple[float, float]:
+    """Starts the app, and waits for it to be live, then ready.
+
+    Returns:
+        Seconds until it was live, and until it was ready
+    """
+    port = _free_port()
+    url = f"http://127.0.0.1:{port}"
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "aniwrap.app:app", "--port", str(port)],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        live = ready = None
+        while ready is None:
+            if time.perf_counter() - start > timeout:
+                raise TimeoutError(f"the app wasn't ready after {timeout}s")
+            if proc.poll() is not None:
+                raise RuntimeError(f"the app exited with {proc.returncode}")
+            if live is None and _status(f"{url}/ping") == 200:
+                live = time.perf_counter() - start
+            if live is not None and _status(f"{url}/ready") == 200:
+                ready = time.perf_counter() - start
+            time.sleep(0.01)
+        return live, ready
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--executor", choices=["thread", "process"], default="thread")
+    parser.add_argument("--engine", choices=["duckdb", "polars"], default="duckdb")
+    parser.add_argument("--timeout", type=float, default=60)
+    args = parser.parse_args()
+    env = _env(args.executor, args.engine)
+
+    imports, lives, readies = [], [], []
+    loaded: list[str] = []
+    for i in range(args.repeat):
+        print(f"run {i + 1}/{args.repeat}...", file=sys.stderr)
+        seconds, loaded = time_import(env)
+        imports.append(seconds)
+        live, ready = time_start(env, args.timeout)
+        lives.append(live)
+        readies.append(ready)
+
+    print(f"executor={args.executor} engine={args.engine}")
+    for name, times in (("import", imports), ("live", lives), ("ready", readies)):
+        print(
+            f"  {name:<8}{statistics.median(times) * 1000:>9.0f}ms median"
+            f"{min(times) * 1000:>9.0f}ms min"
+        )
+    print(f"  loaded on import: {', '.join(loaded) or 'none'}")
+
+
+if __name__ == "__main__":
+    main()
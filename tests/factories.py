@@ -0,0 +1,73 @@
+"""Watch lists to test with, in the MediaListCollection JSON the stats are built from."""
+
+from datetime import date
+from typing import Any
+
+import polars as pl
+
+from aniwrap.service.stats import StatisticsService
+
+
+def fuzzy_date(d: date | None) -> dict[str, int | None]:
+    if d is None:
+        return {"year": None, "month": None, "day": None}
+    return {"year": d.year, "month": d.month, "day": d.day}
+
+
+def make_entry(
+    media_id: int,
+    status: str = "COMPLETED",
+    score: float = 0,
+    genres: list[str] | None = None,
+    started_at: date | None = None,
+    completed_at: date | None = None,
+    updated_at: int = 0,
+    format: str = "TV",
+    season_year: int = 2020,
+    episodes: int = 12,
+) -> dict[str, Any]:
+    return {
+        "mediaId": media_id,
+        "score": score,
+        "startedAt": fuzzy_date(started_at),
+        "completedAt": fuzzy_date(completed_at),
+        "status": status,
+        "updatedAt": updated_at,
+        "media": {
+            "averageScore": 70,
+            "bannerImage": "",
+            "coverImage": {"medium": ""},
+            "description": "",
+            "episodes": episodes,
+            "genres": genres or [],
+            "isAdult": False,
+            "isFavourite": False,
+            "meanScore": 70,
+            "season": "WINTER",
+            "seasonYear": season_year,
+            "siteUrl": "",
+            "title": {"userPreferred": f"Anime {media_id}"},
+            "duration": 24,
+            "format": format,
+            "type": "ANIME",
+        },
+    }
+
+
+def make_collection(*entries: dict[str, Any]) -> dict[str, Any]:
+    """Puts the entries on the list for their status, like AniList does."""
+    lists: dict[str, list[dict[str, Any]]] = {}
+    for entry in entries:
+        lists.setdefault(entry["status"], []).append(entry)
+    return {
+        "lists": [
+            {"name": status.title(), "status": status, "entries": status_entries}
+            for status, status_entries in lists.items()
+        ]
+    }
+
+
+def make_watch_history(*entries: dict[str, Any]) -> pl.DataFrame:
+    return StatisticsService().make_dataframe_from_anilist_json(
+        make_collection(*entries)
+    )
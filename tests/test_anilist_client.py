@@ -0,0 +1,125 @@
+import asyncio
+import time
+from collections.abc import AsyncIterator
+from typing import Any
+
+import pytest
+import pytest_asyncio
+from aiohttp import ClientSession, web
+
+from aniwrap.config import AnilistConfig
+from aniwrap.service.anilist_client import AnilistClient, Priority
+
+# 100 requests a second, so the tests don't wait long for a token; no waiting
+# between retries
+CONFIG = AnilistConfig(
+    client_id=0, client_secret="", rate_limit=6000, backoff_base=0, backoff_max=0
+)
+
+
+@pytest_asyncio.fixture
+async def client() -> AsyncIterator[AnilistClient]:
+    # the HTTP session is only needed to send queries
+    http: Any = None
+    client = AnilistClient(CONFIG, http)
+    yield client
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_waiters_go_by_priority_then_age(client: AnilistClient) -> None:
+    order: list[str] = []
+
+    async def acquire(name: str, priority: Priority) -> None:
+        await client._acquire(priority)
+        order.append(name)
+
+    client._bucket.block(0.05)
+    await asyncio.gather(
+        acquire("background 1", Priority.BACKGROUND),
+        acquire("background 2", Priority.BACKGROUND),
+        acquire("interactive 1", Priority.INTERACTIVE),
+        acquire("interactive 2", Priority.INTERACTIVE),
+    )
+    assert order == ["interactive 1", "interactive 2", "background 1", "background 2"]
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiters_are_skipped(
+    client: AnilistClient, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    taken: list[None] = []
+    take = client._bucket.take
+    monkeypatch.setattr(client._bucket, "take", lambda: taken.append(take()))
+
+    client._bucket.block(0.05)
+    cancelled = asyncio.create_task(client._acquire(Priority.INTERACTIVE))
+    waiting = asyncio.create_task(client._acquire(Priority.BACKGROUND))
+    await asyncio.sleep(0)
+    cancelled.cancel()
+
+    await asyncio.wait_for(waiting, 1)
+    assert cancelled.cancelled()
+    # the cancelled waiter didn't use up a token
+    assert len(taken) == 1
+    assert client._waiters == []
+
+
+@pytest.mark.asyncio
+async def test_failures_are_passed_to_waiters(
+    client: AnilistClient, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    def broken() -> float:
+        raise ValueError("broken")
+
+    delay = client._bucket.delay
+    monkeypatch.setattr(client._bucket, "delay", broken)
+    waiters = [client._acquire(Priority.INTERACTIVE) for _ in range(3)]
+    results = await asyncio.wait_for(
+        asyncio.gather(*waiters, return_exceptions=True), 1
+    )
+    assert [type(r) for r in results] == [ValueError] * 3
+    assert client._waiters == []
+
+    # later requests are let through again
+    monkeypatch.setattr(client._bucket, "delay", delay)
+    await asyncio.wait_for(client._acquire(Priority.INTERACTIVE), 1)
+
+
+@pytest_asyncio.fixture
+async def upstream() -> AsyncIterator[tuple[list[int], str]]:
+    # answers with the statuses in the list, in order, then 200s; 429s ask for
+    # a second's wait
+    statuses: list[int] = []
+
+    async def handle(request: web.Request) -> web.Response:
+        status = statuses.pop(0) if statuses else 200
+        if status == 429:
+            return web.Response(status=429, headers={"Retry-After": "1"})
+        return web.Response(status=status, body=b"ok")
+
+    app = web.Application()
+    app.router.add_post("/", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]  # type: ignore[union-attr]
+    yield statuses, f"http://127.0.0.1:{port}/"
+    await runner.cleanup()
+
+
+@pytest.mark.asyncio
+async def test_retry_after_blocks_requests(upstream: tuple[list[int], str]) -> None:
+    statuses, url = upstream
+    statuses.append(429)
+    async with ClientSession() as http:
+        client = AnilistClient(CONFIG.model_copy(update={"api_base_url": url}), http)
+        start = time.monotonic()
+        assert await client.query("query {}", {}) == b"ok"
+        # the 429 left no room for anything else in the meantime
+        assert client._bucket.blocked_until > start
+        # the retry waited for the Retry-After, not just the (zero) backoff
+        assert time.monotonic() - start >= 1
+        assert statuses == []
+        await client.close()
@@ -0,0 +1,133 @@
+import asyncio
+import json
+from datetime import datetime
+from typing import Any
+
+import pytest
+from prometheus_client import REGISTRY
+
+from aniwrap.config import AnilistConfig, CacheConfig, MediaCacheConfig
+from aniwrap.service.anilist_client import Priority
+from aniwrap.service.cache import TTLCache
+from aniwrap.service.singleflight import SingleFlight
+from aniwrap.service.watch_history.anilist import AnilistWatchHistoryService
+
+LO, HI = datetime(2024, 12, 31), datetime(2026, 1, 1)
+
+
+class _FakeAnilist:
+    """Answers MediaListCollection queries with canned chunks.
+
+    Every chunk has one entry on "Completed", and even chunks one on "Watching"
+    too; chunks past `last` are empty, like AniList's.
+    """
+
+    def __init__(self, last: int | None) -> None:
+        self.last = last
+        self.requested: list[int] = []
+        # the chunks requested at the same time, per round
+        self.rounds: list[list[int]] = []
+        self._in_flight: list[int] = []
+
+    async def query(
+        self, query: str, variables: dict[str, Any], priority: Priority
+    ) -> bytes:
+        chunk = variables["chunk"]
+        self.requested.append(chunk)
+        if not self._in_flight:
+            self.rounds.append(self._in_flight)
+        self._in_flight.append(chunk)
+        await asyncio.sleep(0)
+        self._in_flight = []
+
+        lists = []
+        if self.last is None or chunk <= self.last:
+            lists.append(_list("Completed", chunk))
+            if chunk % 2 == 0:
+                lists.append(_list("Watching", chunk))
+        has_next = self.last is None or chunk < self.last
+        collection = {"lists": lists, "hasNextChunk": has_next}
+        return json.dumps({"data": {"MediaListCollection": collection}}).encode()
+
+
+def _list(name: str, chunk: int) -> dict[str, Any]:
+    return {"name": name, "status": None, "entries": [{"mediaId": chunk}]}
+
+
+class _Config:
+    def __init__(self, **anilist: Any) -> None:
+        self.anilist = AnilistConfig(client_id=0, client_secret="", **anilist)
+        self.media_cache = MediaCacheConfig(enabled=False)
+
+
+def make_service(anilist: _FakeAnilist, **config: Any) -> AnilistWatchHistoryService:
+    # only what the service uses of each; no media cache
+    fakes: list[Any] = [_Config(**config), anilist, None]
+    config_, anilist_, media = fakes
+    return AnilistWatchHistoryService(
+        config_,
+        anilist_,
+        TTLCache(CacheConfig(enabled=False)),
+        SingleFlight(),
+        media,
+    )
+
+
+def _truncated() -> float:
+    value = REGISTRY.get_sample_value(
+        "aniwrap_watch_list_truncated_total", {"provider": "anilist"}
+    )
+    return value or 0.0
+
+
+@pytest.mark.asyncio
+async def test_chunks_are_fetched_in_rounds_and_merged() -> None:
+    anilist = _FakeAnilist(last=6)
+    service = make_service(anilist, chunk_concurrency=4)
+
+    collection = await service.get_watch_history_raw("a", LO, HI)
+
+    assert anilist.rounds == [[1], [2, 3, 4, 5], [6, 7, 8, 9]]
+    # lists of the same name are joined, in chunk order
+    assert [
+        (watch_list["name"], [e["mediaId"] for e in watch_list["entries"]])
+        for watch_list in collection["lists"]
+    ] == [("Completed", [1, 2, 3, 4, 5, 6]), ("Watching", [2, 4, 6])]
+    assert collection["hasNextChunk"] is False
+
+
+@pytest.mark.asyncio
+async def test_stops_at_the_last_chunk() -> None:
+    anilist = _FakeAnilist(last=1)
+    service = make_service(anilist, chunk_concurrency=4)
+
+    collection = await service.get_watch_history_raw("a", LO, HI)
+
+    assert anilist.requested == [1]
+    assert [watch_list["name"] for watch_list in collection["lists"]] == ["Completed"]
+
+    # chunks after the last one in a round don't count
+    anilist = _FakeAnilist(last=3)
+    collection = await make_service(anilist, chunk_concurrency=4).get_watch_history_raw(
+        "a", LO, HI
+    )
+    assert anilist.requested == [1, 2, 3, 4, 5]
+    assert collection["lists"][0]["entries"] == [
+        {"mediaId": 1},
+        {"mediaId": 2},
+        {"mediaId": 3},
+    ]
+
+
+@pytest.mark.asyncio
+async def test_truncated_at_max_chunks() -> None:
+    anilist = _FakeAnilist(last=None)
+    service = make_service(anilist, chunk_concurrency=4, max_chunks=3)
+    before = _truncated()
+
+    collection = await service.get_watch_history_raw("a", LO, HI)
+
+    assert anilist.requested == [1, 2, 3]
+    assert len(collection["lists"][0]["entries"]) == 3
+    assert collection["hasNextChunk"] is True
+    assert _truncated() == before + 1
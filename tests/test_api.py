@@ -0,0 +1,94 @@
+from collections.abc import Iterator
+from datetime import date
+from typing import Any
+
+import orjson
+import pytest
+from cattrs import structure
+from fastapi.testclient import TestClient
+
+from aniwrap.app import app
+from aniwrap.config import WrappedConfig, get_config
+from aniwrap.service.watch_history.anilist import AnilistWatchHistoryService
+from aniwrap.service.watch_history.mal import MalWatchHistoryService
+from aniwrap.service.wrapped import WrappedService
+from aniwrap.types.anilist.watch_history import MediaListCollection
+from tests.factories import make_collection, make_entry
+
+YEAR = date.today().year
+
+
+class _Config:
+    wrapped = WrappedConfig()
+
+
+class _WrappedService:
+    async def get_yearly_wrapped_json(self, *args: Any) -> str:
+        return '{"years": {}, "deltas": {}}'
+
+
+class _WatchHistoryService:
+    async def get_watch_history(self, username: str) -> MediaListCollection:
+        scores = dict.fromkeys(
+            ["Story", "Characters", "Visuals", "Audio", "Enjoyment"], 0
+        )
+        # plus what the factories leave out, since the stats don't use it
+        extra = {"advancedScores": scores, "private": False, "repeat": 0}
+        collection = make_collection(
+            {**make_entry(1, genres=["Drama"]), **extra, "notes": None},
+            {**make_entry(2, status="CURRENT", score=8.5), **extra, "notes": "ok"},
+            {**make_entry(3, status="PLANNING"), **extra, "notes": None},
+        )
+        return structure({**collection, "hasNextChunk": False}, MediaListCollection)
+
+
+@pytest.fixture
+def client() -> Iterator[TestClient]:
+    # without the lifespan, so nothing is started up
+    app.dependency_overrides[WrappedService] = _WrappedService
+    app.dependency_overrides[AnilistWatchHistoryService] = _WatchHistoryService
+    app.dependency_overrides[MalWatchHistoryService] = _WatchHistoryService
+    app.dependency_overrides[get_config] = _Config
+    yield TestClient(app)
+    app.dependency_overrides.clear()
+
+
+@pytest.mark.parametrize(
+    "start,end",
+    [
+        (1, 1),
+        # end before start, rather than defaulting to this year
+        (YEAR, 0),
+        (YEAR, YEAR + 1),
+        (YEAR - 10, YEAR),
+    ],
+)
+def test_yearly_wrapped_rejects_bad_years(
+    client: TestClient, start: int, end: int
+) -> None:
+    res = client.get(
+        "/wrapped/years",
+        params={"provider": "anilist", "username": "a", "start": start, "end": end},
+    )
+    assert res.status_code == 422
+
+
+def test_yearly_wrapped(client: TestClient) -> None:
+    res = client.get(
+        "/wrapped/years", params={"provider": "anilist", "username": "a", "start": YEAR}
+    )
+    assert res.status_code == 200
+
+
+@pytest.mark.parametrize("provider", ["anilist", "mal"])
+def test_streamed_watch_history_is_the_same_json(
+    client: TestClient, provider: str
+) -> None:
+    params = {"provider": provider, "username": "a"}
+    res = client.get("/watched/", params=params)
+    streamed = client.get("/watched/", params={**params, "stream": True})
+
+    assert res.status_code == streamed.status_code == 200
+    assert streamed.headers["content-type"] == res.headers["content-type"]
+    assert streamed.content == res.content
+    assert len(orjson.loads(streamed.content)["lists"]) == 3
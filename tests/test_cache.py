@@ -0,0 +1,91 @@
+import asyncio
+from collections.abc import Awaitable, Callable
+
+import pytest
+
+from aniwrap.config import CacheConfig
+from aniwrap.service.cache import TTLCache
+
+
+class _Clock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch: pytest.MonkeyPatch) -> _Clock:
+    clock = _Clock()
+    monkeypatch.setattr("aniwrap.service.cache.time", clock)
+    return clock
+
+
+def counter() -> tuple[list[int], Callable[[], Awaitable[tuple[int, int]]]]:
+    # a fetch returning how many times it's been called
+    calls: list[int] = []
+
+    async def fetch() -> tuple[int, int]:
+        calls.append(len(calls) + 1)
+        return len(calls), 1
+
+    return calls, fetch
+
+
+@pytest.mark.asyncio
+async def test_stale_while_revalidate(clock: _Clock) -> None:
+    cache: TTLCache[str, int] = TTLCache(CacheConfig(ttl=10, stale_ttl=100))
+    calls, fetch = counter()
+
+    assert await cache.get_or_fetch("key", fetch) == 1
+    clock.now = 5
+    assert await cache.get_or_fetch("key", fetch) == 1
+    assert calls == [1]
+
+    # stale: served as is, and refreshed in the background, only once
+    clock.now = 50
+    assert await cache.get_or_fetch("key", fetch) == 1
+    assert await cache.get_or_fetch("key", fetch) == 1
+    await asyncio.sleep(0)
+    assert calls == [1, 2]
+    assert await cache.get_or_fetch("key", fetch) == 2
+
+    # too stale to serve at all
+    clock.now = 500
+    assert await cache.get_or_fetch("key", fetch) == 3
+
+    stats = cache.stats()
+    assert (stats.hits, stats.stale_hits, stats.misses) == (2, 2, 2)
+
+
+@pytest.mark.asyncio
+async def test_failed_refresh_keeps_the_stale_entry(clock: _Clock) -> None:
+    cache: TTLCache[str, int] = TTLCache(CacheConfig(ttl=10, stale_ttl=100))
+    _, fetch = counter()
+    await cache.get_or_fetch("key", fetch)
+
+    async def fail() -> tuple[int, int]:
+        raise ConnectionError
+
+    clock.now = 50
+    assert await cache.get_or_fetch("key", fail) == 1
+    await asyncio.sleep(0)
+    assert await cache.get_or_fetch("key", fail) == 1
+    assert cache.stats().refresh_errors == 1
+    await cache.close()
+
+
+@pytest.mark.asyncio
+async def test_evicts_least_recently_used(clock: _Clock) -> None:
+    cache: TTLCache[str, int] = TTLCache(CacheConfig(max_entries=2, max_bytes=100))
+    for key in ("a", "b"):
+        cache.put(key, 0, 10)
+    # "a" was used more recently than "b"
+    assert cache.get("a") == 0
+    cache.put("c", 0, 10)
+    assert (cache.get("a"), cache.get("b"), cache.get("c")) == (0, None, 0)
+
+    cache.put("d", 0, 95)
+    assert [cache.get(key) for key in ("a", "c", "d")] == [None, None, 0]
+    assert cache.stats().bytes == 95
@@ -0,0 +1,41 @@
+from datetime import date, datetime
+
+from cattrs import structure
+
+from aniwrap.service.stats import StatisticsService
+from aniwrap.service.stats_polars import PolarsStatisticsService
+from aniwrap.service.watch_history.mal import _to_collection
+from aniwrap.types.anilist.watch_history import MediaListCollection
+
+YEAR = date.today().year
+
+
+def test_entry_without_mean_or_season() -> None:
+    # ex: a music video, which MAL has little metadata for
+    item = {
+        "node": {
+            "id": 1,
+            "title": "Some Song",
+            "media_type": "music",
+            "genres": [{"id": 19, "name": "Music"}],
+        },
+        "list_status": {
+            "status": "completed",
+            "score": 0,
+            "finish_date": f"{YEAR}-03-01",
+            "updated_at": f"{YEAR}-03-01T00:00:00+00:00",
+        },
+    }
+    collection = _to_collection(
+        [item], datetime(YEAR - 1, 12, 31), datetime(YEAR + 1, 1, 1), has_more=False
+    )
+
+    media = structure(collection, MediaListCollection).lists[0].entries[0].media
+    assert (media.averageScore, media.season, media.seasonYear) == (None, None, None)
+    assert media.format == "MUSIC"
+
+    df = StatisticsService().make_dataframe_from_anilist_json(collection)
+    for stats in (StatisticsService(), PolarsStatisticsService()):
+        result = stats.calculate_stats(df)
+        assert result.anime[1].season is None
+        assert result.decade_counts == [{"group": None, "count": 1}]
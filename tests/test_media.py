@@ -0,0 +1,147 @@
+import json
+from typing import Any
+
+import pytest
+from prometheus_client import REGISTRY
+
+from aniwrap.config import AnilistConfig, CacheConfig, MediaCacheConfig
+from aniwrap.service.anilist_client import Priority
+from aniwrap.service.cache import TTLCache
+from aniwrap.service.media.anilist import AnilistMediaService
+
+
+def media(media_id: int) -> dict[str, Any]:
+    return {"title": {"romaji": f"Anime {media_id}"}, "episodes": 12}
+
+
+class _FakeAnilist:
+    # answers media page queries, leaving out the ones in `deleted`
+    def __init__(self, deleted: frozenset[int] = frozenset()) -> None:
+        self.deleted = deleted
+        self.requested: list[list[int]] = []
+
+    async def query(
+        self, query: str, variables: dict[str, Any], priority: Priority
+    ) -> bytes:
+        self.requested.append(variables["ids"])
+        page = [
+            {"id": i, **media(i)} for i in variables["ids"] if i not in self.deleted
+        ]
+        return json.dumps({"data": {"Page": {"media": page}}}).encode()
+
+
+class _FakeSession:
+    # returns the stored media for every select, and keeps track of the rest
+    def __init__(self, stored: dict[int, dict[str, Any]]) -> None:
+        self.stored = stored
+        self.executed = 0
+        self.commits = 0
+
+    async def __aenter__(self) -> "_FakeSession":
+        return self
+
+    async def __aexit__(self, *exc_info: object) -> None:
+        pass
+
+    async def execute(self, stmt: Any) -> list[tuple[int, dict[str, Any]]]:
+        self.executed += 1
+        return list(self.stored.items())
+
+    async def commit(self) -> None:
+        self.commits += 1
+
+
+class _Config:
+    def __init__(self, **media_cache: Any) -> None:
+        self.anilist = AnilistConfig(client_id=0, client_secret="")
+        self.media_cache = MediaCacheConfig(**media_cache)
+
+
+def make_service(
+    anilist: _FakeAnilist, session: _FakeSession | None = None, **media_cache: Any
+) -> AnilistMediaService:
+    # only what the service uses of each
+    fakes: list[Any] = [_Config(**media_cache), anilist, lambda: session]
+    config, anilist_, sessionmaker = fakes
+    return AnilistMediaService(
+        config, anilist_, TTLCache(CacheConfig(ttl=3600)), sessionmaker
+    )
+
+
+def make_collection(*lists: list[int]) -> dict[str, Any]:
+    return {
+        "lists": [
+            {"name": str(i), "entries": [{"mediaId": m} for m in media_ids]}
+            for i, media_ids in enumerate(lists)
+        ]
+    }
+
+
+@pytest.mark.asyncio
+async def test_cache_hits_are_not_fetched() -> None:
+    anilist = _FakeAnilist()
+    service = make_service(anilist)
+    service.cache.put(1, media(1), 1)
+    service.cache.put(2, media(2), 1)
+
+    assert await service.get_many({1, 2, 3}) == {i: media(i) for i in (1, 2, 3)}
+    assert anilist.requested == [[3]]
+    # and the fetched one is cached for next time
+    assert await service.get_many({1, 2, 3}) == {i: media(i) for i in (1, 2, 3)}
+    assert anilist.requested == [[3]]
+
+
+@pytest.mark.asyncio
+async def test_stored_media_are_not_fetched() -> None:
+    anilist = _FakeAnilist()
+    session = _FakeSession({1: media(1)})
+    service = make_service(anilist, session, persist=True)
+
+    assert await service.get_many({1, 2}) == {1: media(1), 2: media(2)}
+    assert anilist.requested == [[2]]
+    # the stored media is cached, and the fetched media is saved
+    assert service.cache.get(1) == media(1)
+    assert session.executed == 2
+    assert session.commits == 1
+
+
+@pytest.mark.asyncio
+async def test_gives_up_on_mostly_uncached_lists() -> None:
+    anilist = _FakeAnilist()
+    service = make_service(anilist, max_lookup_pages=2)
+
+    assert await service.get_many(set(range(101))) is None
+    assert anilist.requested == []
+    collection = make_collection(list(range(101)))
+    assert not await service.hydrate(collection)
+    assert collection == make_collection(list(range(101)))
+
+    # fetched in pages otherwise
+    assert await service.get_many(set(range(100))) is not None
+    assert sorted(map(len, anilist.requested)) == [50, 50]
+
+
+@pytest.mark.asyncio
+async def test_hydrate() -> None:
+    anilist = _FakeAnilist(deleted=frozenset({3}))
+    service = make_service(anilist)
+    service.cache.put(1, media(1), 1)
+    collection = make_collection([1, 2, 3], [3, 4])
+
+    before = REGISTRY.get_sample_value("aniwrap_media_missing_total") or 0
+    assert await service.hydrate(collection)
+    assert collection == {
+        "lists": [
+            {
+                "name": "0",
+                "entries": [
+                    {"mediaId": 1, "media": media(1)},
+                    {"mediaId": 2, "media": media(2)},
+                ],
+            },
+            {"name": "1", "entries": [{"mediaId": 4, "media": media(4)}]},
+        ]
+    }
+    assert anilist.requested == [[2, 3, 4]]
+    # both entries of the media AniList didn't return are counted
+    assert REGISTRY.get_sample_value("aniwrap_media_missing_total") == before + 2
@@ -0,0 +1,65 @@
+from collections.abc import AsyncIterator
+from datetime import UTC, datetime, tzinfo
+
+import pytest
+import pytest_asyncio
+from aiohttp import web
+
+from aniwrap import misc
+from aniwrap.config import HttpConfig
+from aniwrap.misc import current_year_range, get_http_pool_stats, make_http_client
+
+
+@pytest_asyncio.fixture
+async def upstream() -> AsyncIterator[str]:
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(body=b"ok")
+
+    app = web.Application()
+    app.router.add_get("/", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]  # type: ignore[union-attr]
+    yield f"http://127.0.0.1:{port}/"
+    await runner.cleanup()
+
+
+@pytest.mark.asyncio
+async def test_http_pool_stats(upstream: str) -> None:
+    http = make_http_client(HttpConfig(pool_size=10, pool_size_per_host=5))
+    try:
+        for _ in range(3):
+            async with http.get(upstream) as res:
+                assert await res.read() == b"ok"
+        assert get_http_pool_stats(http) == {
+            "limit": 10,
+            "limit_per_host": 5,
+            "requests_in_flight": 0,
+            "queued": 0,
+            # kept alive in between
+            "created": 1,
+            "reused": 2,
+        }
+    finally:
+        await http.close()
+
+
+class _NewYearsEve(datetime):
+    # still 2025 in local time (some way west of UTC), 2026 in UTC
+    @classmethod
+    def now(cls, tz: tzinfo | None = None) -> "_NewYearsEve":
+        now = cls(2026, 1, 1, 2, tzinfo=UTC)
+        return now.astimezone(tz) if tz is not None else cls(2025, 12, 31, 21)
+
+    @classmethod
+    def today(cls) -> "_NewYearsEve":
+        return cls.now()
+
+
+def test_current_year_is_utcs(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(misc, "datetime", _NewYearsEve)
+    lo, hi = current_year_range()
+    assert (lo, hi) == (datetime(2025, 12, 31), datetime(2027, 1, 1))
+    assert lo.tzinfo is None and hi.tzinfo is None
@@ -0,0 +1,169 @@
+import asyncio
+from typing import Any, NamedTuple
+
+import pytest
+from fastapi import HTTPException
+from prometheus_client import REGISTRY
+
+from aniwrap.config import PrewarmConfig
+from aniwrap.db.models import ProviderType
+from aniwrap.service import prewarm
+from aniwrap.service.prewarm import PrewarmWorker
+
+
+class _Row(NamedTuple):
+    id: int
+    provider: str
+    username: str
+
+
+class _Result:
+    def __init__(self, rows: list[_Row]) -> None:
+        self.rows = rows
+
+    def all(self) -> list[_Row]:
+        return self.rows
+
+
+class _FakeSession:
+    # answers the worker's queries from a list of users, keeping track of the
+    # keyset (last id) each page was asked for with
+    def __init__(self, users: list[_Row]) -> None:
+        self.users = users
+        self.pages: list[int | None] = []
+
+    def __call__(self) -> "_FakeSession":
+        return self
+
+    async def __aenter__(self) -> "_FakeSession":
+        return self
+
+    async def __aexit__(self, *exc_info: object) -> None:
+        pass
+
+    async def scalar(self, stmt: Any) -> int:
+        return len(self.users)
+
+    async def execute(self, stmt: Any) -> _Result:
+        params = stmt.compile().params
+        last_id = params.get("id_1")
+        self.pages.append(last_id)
+        rows = [u for u in self.users if last_id is None or u.id > last_id]
+        return _Result(rows[: params["param_1"]])
+
+
+class _FakeWrapped:
+    # users are warmed unless their name says otherwise
+    def __init__(self) -> None:
+        self.config = _WrappedConfig()
+        self.prewarmed: list[tuple[ProviderType, str]] = []
+
+    async def prewarm(self, provider: ProviderType, username: str) -> bool:
+        self.prewarmed.append((provider, username))
+        if username == "private":
+            raise HTTPException(status_code=404)
+        if username == "broken":
+            raise ValueError("broken")
+        return username != "stored"
+
+
+class _WrappedConfig:
+    mal = object()
+
+
+class _FakeAnilist:
+    def headroom(self) -> float:
+        return 1.0
+
+
+def make_worker(users: list[_Row], **config: Any) -> tuple[PrewarmWorker, Any]:
+    # only what the worker uses of each
+    fakes: list[Any] = [_FakeSession(users), _FakeAnilist(), _FakeWrapped()]
+    session, anilist, wrapped = fakes
+    worker = PrewarmWorker(PrewarmConfig(**config), session, anilist, wrapped)
+    return worker, fakes
+
+
+def users(*usernames: str) -> list[_Row]:
+    return [
+        _Row(i, "mal" if i % 2 else "anilist", username)
+        for i, username in enumerate(usernames, start=1)
+    ]
+
+
+def prewarmed(result: str) -> float:
+    return (
+        REGISTRY.get_sample_value("aniwrap_prewarm_users_total", {"result": result})
+        or 0
+    )
+
+
+@pytest.mark.asyncio
+async def test_users_are_loaded_in_batches() -> None:
+    worker, (session, _, wrapped) = make_worker(
+        users("a", "b", "c", "d", "e"), batch_size=2
+    )
+    await worker.run_once()
+
+    # each page starts after the last user of the previous one
+    assert session.pages == [None, 2, 4, 5]
+    assert wrapped.prewarmed == [
+        (ProviderType.MAL, "a"),
+        (ProviderType.ANILIST, "b"),
+        (ProviderType.MAL, "c"),
+        (ProviderType.ANILIST, "d"),
+        (ProviderType.MAL, "e"),
+    ]
+    progress = worker.progress()
+    assert not progress.running
+    assert (progress.passes, progress.total, progress.done) == (1, 5, 5)
+
+
+@pytest.mark.asyncio
+async def test_failing_users_dont_stop_the_pass() -> None:
+    worker, (_, _, wrapped) = make_worker(
+        users("private", "a", "broken", "stored", "b"), batch_size=2
+    )
+    before = {r: prewarmed(r) for r in ("warmed", "skipped", "failed")}
+    await worker.run_once()
+
+    assert len(wrapped.prewarmed) == 5
+    progress = worker.progress()
+    assert (progress.warmed, progress.skipped, progress.failed) == (2, 1, 2)
+    assert progress.done == 5
+    assert progress.finished_at is not None
+    assert {r: prewarmed(r) - before[r] for r in before} == {
+        "warmed": 2,
+        "skipped": 1,
+        "failed": 2,
+    }
+
+
+@pytest.mark.asyncio
+async def test_failed_passes_are_retried_with_backoff(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    worker, _ = make_worker([], initial_delay=0, interval=100)
+    outcomes = [ValueError("broken"), ValueError("broken"), None, ValueError("broken")]
+
+    async def run_once() -> None:
+        if (outcome := outcomes.pop(0)) is not None:
+            raise outcome
+
+    delays: list[float] = []
+    sleep = asyncio.sleep
+
+    async def fake_sleep(delay: float) -> None:
+        delays.append(delay)
+        if not outcomes:
+            raise asyncio.CancelledError
+        await sleep(0)
+
+    monkeypatch.setattr(worker, "run_once", run_once)
+    monkeypatch.setattr(prewarm.asyncio, "sleep", fake_sleep)
+    with pytest.raises(asyncio.CancelledError):
+        await worker._run()
+
+    # the backoff is reset by a successful pass
+    retry = prewarm._RETRY_DELAY
+    assert delays == [0, retry, retry * 2, 100, retry]
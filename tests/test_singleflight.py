@@ -0,0 +1,100 @@
+import asyncio
+
+import pytest
+
+from aniwrap.service.singleflight import SingleFlight
+
+
+@pytest.mark.asyncio
+async def test_concurrent_calls_share_the_result() -> None:
+    sf = SingleFlight()
+    calls = 0
+    release = asyncio.Event()
+
+    async def fn() -> int:
+        nonlocal calls
+        calls += 1
+        await release.wait()
+        return calls
+
+    callers = [asyncio.create_task(sf.do("key", fn)) for _ in range(3)]
+    await asyncio.sleep(0)
+    release.set()
+
+    assert await asyncio.gather(*callers) == [1, 1, 1]
+    assert calls == 1
+    # done, so the next call runs again
+    assert await sf.do("key", fn) == 2
+
+
+@pytest.mark.asyncio
+async def test_error_reaches_every_caller() -> None:
+    sf = SingleFlight()
+    release = asyncio.Event()
+
+    async def fn() -> int:
+        await release.wait()
+        raise ValueError("upstream failed")
+
+    callers = [asyncio.create_task(sf.do("key", fn)) for _ in range(2)]
+    await asyncio.sleep(0)
+    release.set()
+
+    results = await asyncio.gather(*callers, return_exceptions=True)
+    assert [type(r) for r in results] == [ValueError, ValueError]
+
+    async def ok() -> int:
+        return 1
+
+    # the failed call isn't kept around
+    assert await sf.do("key", ok) == 1
+
+
+@pytest.mark.asyncio
+async def test_cancelling_one_caller_keeps_the_call() -> None:
+    sf = SingleFlight()
+    release = asyncio.Event()
+
+    async def fn() -> str:
+        await release.wait()
+        return "done"
+
+    first = asyncio.create_task(sf.do("key", fn))
+    second = asyncio.create_task(sf.do("key", fn))
+    await asyncio.sleep(0)
+    first.cancel()
+    await asyncio.sleep(0)
+    release.set()
+
+    assert await second == "done"
+    with pytest.raises(asyncio.CancelledError):
+        await first
+
+
+@pytest.mark.asyncio
+async def test_cancelling_the_last_caller_cancels_the_call() -> None:
+    sf = SingleFlight()
+    started = asyncio.Event()
+    cancelled = asyncio.Event()
+
+    async def fn() -> str:
+        started.set()
+        try:
+            await asyncio.Event().wait()
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+        return "unreachable"
+
+    callers = [asyncio.create_task(sf.do("key", fn)) for _ in range(2)]
+    await started.wait()
+    for caller in callers:
+        caller.cancel()
+    await asyncio.gather(*callers, return_exceptions=True)
+    await asyncio.wait_for(cancelled.wait(), timeout=1)
+
+    async def ok() -> str:
+        return "new"
+
+    # a new call for the key starts afresh
+    assert await sf.do("key", ok) == "new"
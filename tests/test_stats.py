@@ -0,0 +1,133 @@
+from datetime import date
+
+import pytest
+
+from aniwrap.service.stats import StatisticsService
+from aniwrap.service.stats_polars import PolarsStatisticsService
+from tests.factories import make_entry, make_watch_history
+
+YEAR = date.today().year
+
+
+@pytest.fixture(params=[StatisticsService, PolarsStatisticsService])
+def stats(request: pytest.FixtureRequest) -> StatisticsService:
+    return request.param()
+
+
+def test_no_genres(stats: StatisticsService) -> None:
+    df = make_watch_history(
+        make_entry(1, score=8, completed_at=date(YEAR, 1, 1)),
+        make_entry(2, status="CURRENT", started_at=date(YEAR, 2, 1)),
+    )
+
+    result = stats.calculate_stats(df)
+    assert result.n == 2
+    assert result.genre_counts == []
+    assert result.signature_genre is None
+
+    yearly = stats.calculate_yearly_stats(df, YEAR, YEAR)
+    assert yearly.years[YEAR].genre_counts == []
+
+    users, group = stats.calculate_batch_stats({"a": df, "b": df})
+    assert users["a"].n == users["b"].n == 2
+    assert group.shared_genres == []
+
+    # and the next job on the same worker still works
+    with_genres = make_watch_history(make_entry(3, genres=["Action"]))
+    assert stats.calculate_stats(with_genres).genre_counts == [
+        {"group": "Action", "count": 1}
+    ]
+
+
+def test_invalidated_connection_is_replaced(monkeypatch: pytest.MonkeyPatch) -> None:
+    import duckdb
+
+    from aniwrap.service import stats as stats_module
+
+    service = StatisticsService()
+    df = make_watch_history(make_entry(1, genres=["Action"]))
+    service.calculate_stats(df)
+    con = stats_module._get_connection()
+
+    def invalidate(self: StatisticsService, con: duckdb.DuckDBPyConnection) -> None:
+        raise duckdb.FatalException("database has been invalidated")
+
+    with monkeypatch.context() as m:
+        m.setattr(StatisticsService, "_get_summary", invalidate)
+        with pytest.raises(duckdb.FatalException):
+            service.calculate_stats(df)
+
+    assert service.calculate_stats(df).n == 1
+    assert stats_module._get_connection() is not con
+
+
+def test_unknown_status_is_logged(caplog: pytest.LogCaptureFixture) -> None:
+    df = make_watch_history(
+        make_entry(1),
+        make_entry(2, status="REWATCHING_LATER", format="SOMETHING_NEW"),
+    )
+
+    assert df["status"].to_list() == ["COMPLETED", None]
+    assert df["format"].to_list() == ["TV", None]
+    assert "'status'; treating them as null: ['REWATCHING_LATER']" in caplog.text
+    assert "'format'; treating them as null: ['SOMETHING_NEW']" in caplog.text
+
+
+def test_empty_watch_history(stats: StatisticsService) -> None:
+    df = make_watch_history()
+
+    assert stats.calculate_stats(df).n == 0
+
+    yearly = stats.calculate_yearly_stats(df, YEAR - 2, YEAR)
+    assert [s.n for s in yearly.years.values()] == [0, 0, 0]
+    assert [d.n for d in yearly.deltas.values()] == [0, 0]
+
+    with_entries = make_watch_history(make_entry(1, completed_at=date(YEAR, 1, 1)))
+    users, group = stats.calculate_batch_stats({"a": df, "b": with_entries})
+    assert (users["a"].n, users["b"].n) == (0, 1)
+    assert group.overlaps == []
+
+
+@pytest.mark.parametrize("genres", [["Drama", "Action"], ["Action", "Drama"]])
+def test_signature_genre_tie_goes_to_the_first_by_name(
+    stats: StatisticsService, genres: list[str]
+) -> None:
+    df = make_watch_history(
+        *(
+            make_entry(i, score=8, genres=[genre], completed_at=date(YEAR, 1, i + 1))
+            for i, genre in enumerate(genres)
+        )
+    )
+
+    result = stats.calculate_stats(df)
+    assert result.signature_genre is not None
+    assert result.signature_genre["name"] == "Action"
+    yearly = stats.calculate_yearly_stats(df, YEAR, YEAR).years[YEAR]
+    assert yearly.signature_genre == result.signature_genre
+    users, _ = stats.calculate_batch_stats({"a": df})
+    assert users["a"].signature_genre == result.signature_genre
+
+
+def test_engines_agree_on_ties() -> None:
+    # every genre has the same count and score, and so does every decade's count
+    df = make_watch_history(
+        *(
+            make_entry(
+                i,
+                score=7,
+                genres=[genre],
+                completed_at=date(YEAR, 1, i + 1),
+                season_year=1990 + 10 * (i % 3),
+            )
+            for i, genre in enumerate(["Sports", "Drama", "Action", "Comedy"] * 2)
+        )
+    )
+    duckdb, polars = StatisticsService(), PolarsStatisticsService()
+
+    assert duckdb.calculate_stats(df) == polars.calculate_stats(df)
+    assert duckdb.calculate_yearly_stats(df, YEAR - 1, YEAR) == (
+        polars.calculate_yearly_stats(df, YEAR - 1, YEAR)
+    )
+    assert duckdb.calculate_batch_stats({"a": df, "b": df}) == (
+        polars.calculate_batch_stats({"a": df, "b": df})
+    )
@@ -0,0 +1,75 @@
+from datetime import date
+
+import pytest
+
+from aniwrap.service.stats import StatisticsService
+from aniwrap.service.stats_state import StatsState
+from tests.factories import make_collection, make_entry, make_watch_history
+
+YEAR = date.today().year
+
+ENTRIES = [
+    make_entry(1, score=8, genres=["Action", "Drama"], completed_at=date(YEAR, 1, 5)),
+    make_entry(2, score=6, genres=["Comedy"], completed_at=date(YEAR, 3, 1)),
+    make_entry(3, score=9, genres=["Drama"], completed_at=date(YEAR, 6, 30)),
+    make_entry(4, status="CURRENT", genres=["Action"], started_at=date(YEAR, 7, 1)),
+    make_entry(5, status="DROPPED", format="MOVIE", season_year=1999),
+]
+
+
+@pytest.mark.parametrize(
+    "changed_ids,changed",
+    [
+        # rescored
+        (
+            [2],
+            [make_entry(2, score=10, genres=["Comedy"], completed_at=date(YEAR, 3, 1))],
+        ),
+        # the first completed one left the range, so the first is recomputed
+        ([1], []),
+        # the last completed one was dropped, so the last is recomputed
+        ([3], [make_entry(3, status="DROPPED", genres=["Drama"])]),
+        # a new one, completed after all the others, with a new genre
+        (
+            [6],
+            [make_entry(6, score=7, genres=["Horror"], completed_at=date(YEAR, 9, 1))],
+        ),
+        # all at once, and one that was never in the range
+        (
+            [1, 4, 5, 99],
+            [
+                make_entry(4, genres=["Action"], completed_at=date(YEAR, 8, 1)),
+                make_entry(5, status="DROPPED", format="OVA", season_year=2005),
+            ],
+        ),
+    ],
+)
+def test_fold_matches_from_frame(changed_ids: list[int], changed: list[dict]) -> None:
+    stats = StatisticsService()
+    df = make_watch_history(*ENTRIES)
+    state = StatsState.from_frame(df, YEAR)
+
+    merged, folded = stats.apply_changes(
+        df, state, changed_ids, make_collection(*changed)
+    )
+
+    assert folded == StatsState.from_frame(merged, YEAR)
+    assert stats.calculate_stats_from_state(folded, merged) == stats.calculate_stats(
+        merged
+    )
+
+
+def test_state_round_trips_through_json() -> None:
+    state = StatsState.from_frame(make_watch_history(*ENTRIES), YEAR)
+    assert StatsState.from_json(state.to_json()) == state
+
+
+@pytest.mark.parametrize("genres", [["Drama", "Action"], ["Action", "Drama"]])
+def test_signature_genre_tie_goes_to_the_first_by_name(genres: list[str]) -> None:
+    df = make_watch_history(
+        *(
+            make_entry(i, score=8, genres=[genre], completed_at=date(YEAR, 1, i + 1))
+            for i, genre in enumerate(genres)
+        )
+    )
+    assert StatsState.from_frame(df, YEAR).summary()["signature_genre"] == "Action"
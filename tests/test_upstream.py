@@ -0,0 +1,54 @@
+from collections.abc import AsyncIterator
+
+import pytest
+import pytest_asyncio
+from aiohttp import ClientSession, web
+from fastapi import HTTPException
+
+from aniwrap.config import MalConfig
+from aniwrap.service.mal_client import MalClient
+
+# no waiting between retries
+CONFIG = MalConfig(client_id="test", max_retries=2, backoff_base=0, backoff_max=0)
+
+
+@pytest_asyncio.fixture
+async def upstream() -> AsyncIterator[tuple[list[int], str]]:
+    # answers with the statuses in the list, in order, then 200s
+    statuses: list[int] = []
+
+    async def handle(request: web.Request) -> web.Response:
+        status = statuses.pop(0) if statuses else 200
+        return web.Response(status=status, body=b"ok" if status == 200 else b"")
+
+    app = web.Application()
+    app.router.add_get("/anime", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]  # type: ignore[union-attr]
+    yield statuses, f"http://127.0.0.1:{port}"
+    await runner.cleanup()
+
+
+@pytest.mark.asyncio
+async def test_retries_server_errors(upstream: tuple[list[int], str]) -> None:
+    statuses, url = upstream
+    statuses.extend([503, 500])
+    async with ClientSession() as http:
+        client = MalClient(CONFIG.model_copy(update={"api_base_url": url}), http)
+        assert await client.get("/anime", {}) == b"ok"
+    assert statuses == []
+
+
+@pytest.mark.asyncio
+async def test_rate_limited_after_retries(upstream: tuple[list[int], str]) -> None:
+    statuses, url = upstream
+    statuses.extend([429, 429, 429])
+    async with ClientSession() as http:
+        client = MalClient(CONFIG.model_copy(update={"api_base_url": url}), http)
+        with pytest.raises(HTTPException) as e:
+            await client.get("/anime", {})
+    assert e.value.status_code == 503
+    assert e.value.headers == {"Retry-After": "60"}
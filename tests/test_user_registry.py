@@ -0,0 +1,120 @@
+import asyncio
+from typing import Any
+
+import pytest
+from prometheus_client import REGISTRY
+from sqlalchemy.exc import SQLAlchemyError
+
+from aniwrap.config import UserRegistryConfig
+from aniwrap.db.models import ProviderType
+from aniwrap.service.user_registry import UserRegistry
+
+ANILIST, MAL = ProviderType.ANILIST, ProviderType.MAL
+
+
+class _FakeSession:
+    # keeps the rows of every committed upsert; fails while `down` is set
+    def __init__(self) -> None:
+        self.down = False
+        self.written: list[list[tuple[ProviderType, str]]] = []
+        self._rows: list[tuple[ProviderType, str]] = []
+
+    def __call__(self) -> "_FakeSession":
+        return self
+
+    async def __aenter__(self) -> "_FakeSession":
+        return self
+
+    async def __aexit__(self, *exc_info: object) -> None:
+        self._rows = []
+
+    async def execute(self, stmt: Any, params: list[dict[str, Any]]) -> None:
+        await asyncio.sleep(0)
+        if self.down:
+            raise SQLAlchemyError("database is down")
+        self._rows = [(p["provider"], p["username"]) for p in params]
+
+    async def commit(self) -> None:
+        self.written.append(self._rows)
+
+
+def make_registry(**config: Any) -> tuple[UserRegistry, _FakeSession]:
+    session = _FakeSession()
+    # only needs to be callable like a sessionmaker
+    sessionmaker: Any = session
+    return UserRegistry(UserRegistryConfig(**config), sessionmaker), session
+
+
+def registered(result: str) -> float:
+    return (
+        REGISTRY.get_sample_value("aniwrap_registered_users_total", {"result": result})
+        or 0
+    )
+
+
+@pytest.mark.asyncio
+async def test_users_are_written_in_one_batch() -> None:
+    registry, session = make_registry()
+    written = registered("written")
+    registry.record(MAL, "b")
+    registry.record(ANILIST, "a")
+    registry.record(MAL, "b")
+    registry.record(ANILIST, "x" * 51)
+    assert session.written == []
+
+    await registry.flush()
+    # once each, in a consistent order, and not the name that wouldn't fit
+    assert session.written == [[(ANILIST, "a"), (MAL, "b")]]
+    assert registered("written") == written + 2
+
+    await registry.flush()
+    assert len(session.written) == 1
+
+
+@pytest.mark.asyncio
+async def test_users_are_flushed_in_the_background() -> None:
+    registry, session = make_registry(flush_interval=0.01)
+    registry.start()
+    registry.record(ANILIST, "a")
+    await asyncio.sleep(0.05)
+    assert session.written == [[(ANILIST, "a")]]
+
+    # and on the way out
+    registry.record(ANILIST, "b")
+    await registry.stop()
+    assert session.written == [[(ANILIST, "a")], [(ANILIST, "b")]]
+
+
+@pytest.mark.asyncio
+async def test_failed_flushes_are_retried() -> None:
+    registry, session = make_registry()
+    registry.record(ANILIST, "a")
+    session.down = True
+    await registry.flush()
+    assert session.written == []
+
+    registry.record(ANILIST, "b")
+    session.down = False
+    await registry.flush()
+    assert session.written == [[(ANILIST, "a"), (ANILIST, "b")]]
+
+
+@pytest.mark.asyncio
+async def test_users_past_max_pending_are_dropped() -> None:
+    registry, session = make_registry(max_pending=2)
+    dropped = registered("dropped")
+    for username in "abc":
+        registry.record(ANILIST, username)
+    assert registered("dropped") == dropped + 1
+
+    # users recorded while a flush fails leave less room for its retry
+    session.down = True
+    flush = asyncio.create_task(registry.flush())
+    await asyncio.sleep(0)
+    registry.record(ANILIST, "d")
+    await flush
+    assert registered("dropped") == dropped + 2
+
+    session.down = False
+    await registry.flush()
+    assert session.written == [[(ANILIST, "a"), (ANILIST, "d")]]
@@ -0,0 +1,210 @@
+from collections.abc import Iterator
+from datetime import date, datetime
+from typing import Any
+
+import orjson
+import pytest
+from attrs import evolve
+from fastapi import HTTPException
+
+from aniwrap.config import SnapshotConfig, StatsConfig, WrappedConfig
+from aniwrap.db.models import ProviderType
+from aniwrap.service.executor import StatsExecutor
+from aniwrap.service.singleflight import SingleFlight
+from aniwrap.service.snapshot import Snapshot
+from aniwrap.service.stats import StatisticsService
+from aniwrap.service.wrapped import WrappedService
+from tests.factories import make_collection, make_entry
+
+YEAR = date.today().year
+
+
+class _WatchHistory:
+    # username -> the user's entries, as returned by the provider
+    def __init__(self, entries: dict[str, list[dict[str, Any]]]) -> None:
+        self.entries = entries
+
+    async def get_watch_history_raw(
+        self, username: str, *args: Any, **kwargs: Any
+    ) -> dict[str, Any]:
+        if username not in self.entries:
+            raise HTTPException(status_code=404, detail="User not found")
+        return make_collection(*self.entries[username])
+
+    async def get_updated_entries(
+        self, username: str, lo: datetime, hi: datetime, since: int, *args: Any
+    ) -> tuple[list[int], dict[str, Any], int]:
+        updated = [e for e in self.entries[username] if e["updatedAt"] >= since]
+        return (
+            [e["mediaId"] for e in updated],
+            {"lists": [{"name": None, "status": None, "entries": updated}]},
+            max((e["updatedAt"] for e in updated), default=since),
+        )
+
+
+class _Snapshots:
+    # one user's snapshot, kept in memory
+    def __init__(self) -> None:
+        self.snapshot: Snapshot | None = None
+        self.saved = 0
+        self.touched = 0
+
+    async def load(self, *args: Any) -> Snapshot | None:
+        return self.snapshot
+
+    async def save(
+        self,
+        provider: ProviderType,
+        username: str,
+        lo: datetime,
+        hi: datetime,
+        df: Any,
+        state: Any = None,
+        max_updated_at: int | None = None,
+    ) -> None:
+        self.saved += 1
+        self.snapshot = Snapshot(
+            df=df,
+            state=state,
+            max_updated_at=max_updated_at or df["updated_at"].max(),
+            stale=False,
+        )
+
+    async def touch(self, *args: Any) -> None:
+        self.touched += 1
+
+    async def load_stats(self, *args: Any) -> None:
+        return None
+
+    async def save_stats(self, *args: Any) -> None:
+        pass
+
+
+class _Users:
+    def record(self, provider: ProviderType, username: str) -> None:
+        pass
+
+
+class _Config:
+    def __init__(self, snapshot: SnapshotConfig | None = None) -> None:
+        self.snapshot = snapshot or SnapshotConfig()
+        self.wrapped = WrappedConfig()
+
+
+class _CountingExecutor(StatsExecutor):
+    def __init__(self) -> None:
+        super().__init__(StatsConfig(executor="thread", max_workers=1))
+        self.calls: list[str] = []
+
+    async def run(self, fn: Any, *args: Any, **kwargs: Any) -> Any:
+        self.calls.append(fn.__name__)
+        return await super().run(fn, *args, **kwargs)
+
+
+@pytest.fixture
+def executor() -> Iterator[_CountingExecutor]:
+    executor = _CountingExecutor()
+    yield executor
+    executor.shutdown()
+
+
+def make_service(
+    executor: StatsExecutor,
+    watch_history: _WatchHistory,
+    snapshots: _Snapshots | None = None,
+    config: _Config | None = None,
+) -> WrappedService:
+    # only what WrappedService uses of each
+    fakes: list[Any] = [snapshots or _Snapshots(), _Users(), config or _Config()]
+    snapshots_, users, config_ = fakes
+    watch_history_: Any = watch_history
+    return WrappedService(
+        watch_history_,
+        watch_history_,
+        StatisticsService(),
+        executor,
+        snapshots_,
+        SingleFlight(),
+        users,
+        config_,
+    )
+
+
+@pytest.mark.asyncio
+async def test_batch_with_no_users_found(executor: _CountingExecutor) -> None:
+    service = make_service(executor, _WatchHistory({}))
+
+    result = orjson.loads(
+        await service.get_batch_wrapped_json(ProviderType.ANILIST, ["a", "b"])
+    )
+
+    assert result == {
+        "users": {},
+        "errors": {"a": "User not found", "b": "User not found"},
+        "group": {"shared_genres": [], "shared_anime": [], "overlaps": []},
+    }
+    assert "calculate_batch_stats" not in executor.calls
+
+
+@pytest.mark.asyncio
+async def test_batch_with_some_users_found(executor: _CountingExecutor) -> None:
+    entry = make_entry(1, genres=["Action"], completed_at=date(YEAR, 1, 1))
+    service = make_service(executor, _WatchHistory({"a": [entry]}))
+
+    result = orjson.loads(
+        await service.get_batch_wrapped_json(ProviderType.ANILIST, ["a", "b"])
+    )
+
+    assert list(result["users"]) == ["a"]
+    assert result["users"]["a"]["n"] == 1
+    assert result["errors"] == {"b": "User not found"}
+
+
+@pytest.mark.asyncio
+async def test_stale_snapshot_without_changes_is_touched(
+    executor: _CountingExecutor,
+) -> None:
+    entries = [
+        make_entry(1, completed_at=date(YEAR, 1, 1), updated_at=100),
+        make_entry(2, completed_at=date(YEAR, 2, 1), updated_at=200),
+    ]
+    watch_history = _WatchHistory({"a": entries})
+    snapshots = _Snapshots()
+    service = make_service(executor, watch_history, snapshots)
+    await service.get_wrapped_json(ProviderType.ANILIST, "a")
+    assert snapshots.saved == 1
+
+    # the entry updated last comes back, but hasn't changed
+    assert snapshots.snapshot is not None
+    snapshots.snapshot = evolve(snapshots.snapshot, stale=True)
+    await service.get_wrapped_json(ProviderType.ANILIST, "a")
+    assert (snapshots.saved, snapshots.touched) == (1, 1)
+
+    # one that did change is applied
+    entries[0] = make_entry(1, status="DROPPED", updated_at=300)
+    snapshots.snapshot = evolve(snapshots.snapshot, stale=True)
+    result = orjson.loads(await service.get_wrapped_json(ProviderType.ANILIST, "a"))
+    assert (snapshots.saved, snapshots.touched) == (2, 1)
+    assert (result["n_completed"], result["n_dropped"]) == (1, 1)
+    assert snapshots.snapshot.max_updated_at == 300
+
+
+@pytest.mark.asyncio
+async def test_snapshot_without_state(executor: _CountingExecutor) -> None:
+    entry = make_entry(1, completed_at=date(YEAR, 1, 1))
+    snapshots = _Snapshots()
+    service = make_service(
+        executor,
+        _WatchHistory({"a": [entry]}),
+        snapshots,
+        _Config(SnapshotConfig(incremental=False)),
+    )
+
+    first = await service.get_wrapped_json(ProviderType.ANILIST, "a")
+    assert snapshots.snapshot is not None and snapshots.snapshot.state is None
+    assert "calculate_state" not in executor.calls
+
+    # served from the snapshot, without fetching again
+    second = await service.get_wrapped_json(ProviderType.ANILIST, "a")
+    assert first == second
+    assert snapshots.saved == 1